@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+"""
+Compares two result files of `run.py`:
+
+    python3 benchmarks/compare.py before.json after.json
+
+Prints the minimum times of all benchmarks in both files and their ratio. Exits
+with 1 if a benchmark got slower by more than the threshold.
+"""
+import argparse
+import json
+import sys
+
+
+def compare(before, after, threshold=0.1):
+    """Prints the comparison and returns the keys of the benchmarks that are more
+    than `threshold` (relative) slower in `after`.
+    """
+    print(
+        "{:<28} {:>10} {:>10} {:>8}".format(
+            "benchmark", _get_label(before), _get_label(after), "ratio"
+        )
+    )
+    regressions = []
+    for key, new in after["results"].items():
+        old = before["results"].get(key)
+        if old is None:
+            print(f"{key:<28} {'-':>10} {new['min']:>9.3f}s")
+            continue
+        ratio = new["min"] / old["min"] if old["min"] > 0 else float("inf")
+        flag = ""
+        if ratio > 1 + threshold:
+            flag = "  slower"
+            regressions.append(key)
+        elif ratio < 1 / (1 + threshold):
+            flag = "  faster"
+        print(f"{key:<28} {old['min']:>9.3f}s {new['min']:>9.3f}s {ratio:>8.2f}{flag}")
+    return regressions
+
+
+def _get_label(results):
+    if results["commit"] is None:
+        return "?"
+    label = results["commit"][:8]
+    if results["dirty"]:
+        label += "+"
+    return label
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare benchmark results.")
+    parser.add_argument("before", help="JSON results of run.py")
+    parser.add_argument("after", help="JSON results of run.py")
+    parser.add_argument(
+        "-t",
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="relative slowdown counted as a regression (default: 0.1)",
+    )
+    args = parser.parse_args()
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+    regressions = compare(before, after, args.threshold)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+"""
+Generates synthetic source packages for the benchmarks: a source tree with a
+`.gitignore`, ignored build output, text and binary files, and a `debian/`
+directory with a changelog, control files, and quilt patches.
+
+The trees are deterministic for a given preset and seed, so results of different
+commits are comparable.
+"""
+import argparse
+import os
+import random
+
+# Bump when the layout changes; trees generated by older versions are redone.
+GENERATOR_VERSION = 1
+
+KiB = 1024
+MiB = 1024 * KiB
+GiB = 1024 * MiB
+
+# name: (number of files, total size in bytes, number of patches)
+PRESETS = {
+    "tiny": (50, 256 * KiB, 2),
+    "small": (1000, 16 * MiB, 5),
+    "medium": (20000, 256 * MiB, 10),
+    "large": (200000, 2 * GiB, 20),
+    "huge": (1000000, 4 * GiB, 50),
+}
+
+# Files per directory
+_FANOUT = 64
+
+# Share of the files that are incompressible binaries
+_BINARY_RATIO = 0.1
+
+_CHANGELOG = """bench (1.0-1) unstable; urgency=medium
+
+  * Synthetic package for benchmarks.
+
+ -- Bench <bench@example.com>  Sat, 01 Jan 2022 00:00:00 +0000
+"""
+
+_CONTROL = """Source: bench
+Section: devel
+Priority: optional
+Maintainer: Bench <bench@example.com>
+Build-Depends: debhelper (>= 9)
+Standards-Version: 4.1.3
+
+Package: bench
+Architecture: any
+Depends: ${shlibs:Depends}, ${misc:Depends}
+Description: synthetic package for benchmarks
+ Generated by launchpadtools' benchmarks/generate.py.
+"""
+
+_RULES = """#!/usr/bin/make -f
+%:
+\tdh $@
+"""
+
+
+def _get_block(rng, binary):
+    """Returns 1 MiB of random bytes or of source-code-like text that file
+    contents are cut from.
+    """
+    if binary:
+        return rng.randbytes(MiB)
+    words = "int return static const void for if else struct buffer size value".split()
+    lines = []
+    size = 0
+    while size < MiB:
+        line = "    " * rng.randrange(4) + " ".join(rng.choices(words, k=8)) + ";\n"
+        lines.append(line)
+        size += len(line)
+    return "".join(lines).encode("ascii")[:MiB]
+
+
+def _write_file(path, size, block, offset, header):
+    with open(path, "wb") as f:
+        # The header makes every file unique.
+        f.write(header[:size])
+        size -= min(size, len(header))
+        while size > 0:
+            n = min(size, len(block) - offset)
+            f.write(block[offset : offset + n])
+            size -= n
+            offset = 0
+
+
+def _get_paths(num_files):
+    """Distributes `num_files` over a directory tree with `_FANOUT` entries per
+    directory.
+    """
+    levels = 0
+    while _FANOUT ** (levels + 1) < num_files:
+        levels += 1
+    paths = []
+    for k in range(num_files):
+        parts = []
+        n = k // _FANOUT
+        for _ in range(levels):
+            parts.append(f"d{n % _FANOUT:02d}")
+            n //= _FANOUT
+        paths.append(os.path.join("src", *reversed(parts), f"file{k}"))
+    return paths
+
+
+def _write_debian(directory, num_patches):
+    debian = os.path.join(directory, "debian")
+    os.makedirs(os.path.join(debian, "source"))
+    os.makedirs(os.path.join(debian, "patches"))
+    for name, content in [
+        ("changelog", _CHANGELOG),
+        ("control", _CONTROL),
+        ("rules", _RULES),
+        ("compat", "9\n"),
+        ("copyright", "Public domain.\n"),
+        (os.path.join("source", "format"), "3.0 (quilt)\n"),
+    ]:
+        with open(os.path.join(debian, name), "w") as f:
+            f.write(content)
+    os.chmod(os.path.join(debian, "rules"), 0o755)
+
+    series = []
+    for k in range(num_patches):
+        name = f"{k:04d}-add-file.patch"
+        with open(os.path.join(debian, "patches", name), "w") as f:
+            f.write(
+                f"--- /dev/null\n"
+                f"+++ b/patched/file{k}.c\n"
+                f"@@ -0,0 +1,2 @@\n"
+                f"+/* added by patch {k} */\n"
+                f"+int patched{k} = {k};\n"
+            )
+        series.append(name)
+    with open(os.path.join(debian, "patches", "series"), "w") as f:
+        f.write("".join(name + "\n" for name in series))
+
+
+def generate(directory, num_files, total_size, num_patches=0, seed=0):
+    """Creates a package with `num_files` files of `total_size` bytes in total
+    (not counting `debian/`) in `directory`, which must not exist yet.
+    """
+    rng = random.Random(seed)
+    blocks = [_get_block(rng, False), _get_block(rng, True)]
+    os.makedirs(directory)
+
+    with open(os.path.join(directory, ".gitignore"), "w") as f:
+        f.write("/build/\n*.o\n")
+    os.makedirs(os.path.join(directory, "build"))
+    with open(os.path.join(directory, "build", "output.o"), "wb") as f:
+        f.write(blocks[1][: 64 * KiB])
+
+    mean_size = total_size / max(num_files, 1)
+    created = set()
+    for k, relpath in enumerate(_get_paths(num_files)):
+        binary = rng.random() < _BINARY_RATIO
+        # Sizes vary between half and one and a half times the mean.
+        size = int(mean_size * (0.5 + rng.random()))
+        path = os.path.join(directory, relpath)
+        parent = os.path.dirname(path)
+        if parent not in created:
+            os.makedirs(parent, exist_ok=True)
+            created.add(parent)
+        if binary:
+            path += ".bin"
+        else:
+            path += ".c"
+        header = f"/* {relpath} */\n".encode("ascii")
+        _write_file(path, size, blocks[binary], rng.randrange(MiB), header)
+
+    _write_debian(directory, num_patches)
+    return
+
+
+def generate_preset(directory, preset, seed=0):
+    num_files, total_size, num_patches = PRESETS[preset]
+    generate(directory, num_files, total_size, num_patches, seed)
+    return
+
+
+def _main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic package.")
+    parser.add_argument("directory", help="target directory (must not exist)")
+    parser.add_argument(
+        "-p", "--preset", choices=PRESETS, default="small", help="size of the tree"
+    )
+    parser.add_argument("-s", "--seed", type=int, default=0, help="random seed")
+    args = parser.parse_args()
+    generate_preset(args.directory, args.preset, args.seed)
+    return
+
+
+if __name__ == "__main__":
+    _main()
@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+"""
+Benchmarks of the expensive steps of launchpad-submit on synthetic packages:
+
+    python3 benchmarks/run.py -t tiny small medium -o results.json
+    python3 benchmarks/compare.py before.json results.json
+
+The trees are generated once (see `generate.py`) and kept in the tree directory.
+`debuild`, `debsign`, `dput`, and `quilt` are taken from `stubs/`, so nothing but
+Python is needed and nothing is uploaded. The results are written as JSON,
+together with the commit they were measured on.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import generate
+
+_THIS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(_THIS_DIR))
+
+import launchpadtools  # noqa: E402
+
+BENCHMARKS = [
+    "tree_hash",
+    "stage",
+    "create_tarball",
+    "create_tarball_xz",
+    "update_patches",
+    "submit_dry",
+]
+
+
+def _get_tree(tree_dir, preset, seed):
+    """Returns the directory of the tree of `preset`, generating it if needed."""
+    directory = os.path.join(tree_dir, f"{preset}-{seed}")
+    stamp = directory + ".generated"
+    expected = f"{generate.GENERATOR_VERSION}\n"
+    if os.path.isfile(stamp):
+        with open(stamp) as f:
+            if f.read() == expected:
+                return directory
+    shutil.rmtree(directory, ignore_errors=True)
+    print(f"Generating {preset} tree...", flush=True)
+    generate.generate_preset(directory, preset, seed)
+    with open(stamp, "w") as f:
+        f.write(expected)
+    return directory
+
+
+def _get_size(directory):
+    num_files = 0
+    num_bytes = 0
+    for root, _, files in os.walk(directory):
+        for name in files:
+            num_files += 1
+            num_bytes += os.lstat(os.path.join(root, name)).st_size
+    return num_files, num_bytes
+
+
+def _tree_hash(tree, scratch):
+    return lambda: launchpadtools.submit._get_tree_hash(tree)
+
+
+def _stage(tree, scratch):
+    target = os.path.join(scratch, "orig")
+    shutil.rmtree(target, ignore_errors=True)
+    return lambda: launchpadtools.staging.stage_tree(tree, target)
+
+
+def _create_tarball(tree, scratch):
+    tarball = os.path.join(scratch, "bench_1.0.orig.tar.gz")
+    return lambda: launchpadtools.submit._create_tarball(
+        tree, tarball, "bench-1.0", excludes=["./debian"]
+    )
+
+
+def _create_tarball_xz(tree, scratch):
+    tarball = os.path.join(scratch, "bench_1.0.orig.tar.xz")
+    compression = launchpadtools.tarball.Compression("xz")
+    return lambda: launchpadtools.submit._create_tarball(
+        tree, tarball, "bench-1.0", excludes=["./debian"], compression=compression
+    )
+
+
+def _update_patches(tree, scratch):
+    # The patches are updated in place, so work on a copy of debian/ next to
+    # links of the rest.
+    target = os.path.join(scratch, "patched")
+    shutil.rmtree(target, ignore_errors=True)
+    launchpadtools.staging.stage_tree(tree, target)
+    return lambda: launchpadtools.submit._update_patches(target)
+
+
+def _submit_dry(tree, scratch):
+    cache_dir = os.path.join(scratch, "cache")
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    return lambda: launchpadtools.submit.submit(
+        tree,
+        ["bionic", "focal"],
+        "bench/bench",
+        "bench",
+        force=True,
+        dry=True,
+        cache_dir=cache_dir,
+        use_cache=False,
+    )
+
+
+def _run(benchmark, tree, repeat):
+    """Runs `benchmark` `repeat` times and returns the wall times of the runs,
+    without the setup, and the metrics records of the last run.
+    """
+    setup = globals()["_" + benchmark]
+    times = []
+    with tempfile.TemporaryDirectory() as scratch:
+        metrics_file = os.path.join(scratch, "metrics.jsonl")
+        for _ in range(repeat):
+            function = setup(tree, scratch)
+            if os.path.exists(metrics_file):
+                os.remove(metrics_file)
+            launchpadtools.metrics.enable(metrics_file)
+            # keep the output of the steps out of the results
+            with open(os.devnull, "w") as devnull:
+                saved = os.dup(1)
+                sys.stdout.flush()
+                os.dup2(devnull.fileno(), 1)
+                try:
+                    tic = time.perf_counter()
+                    function()
+                    times.append(time.perf_counter() - tic)
+                finally:
+                    sys.stdout.flush()
+                    os.dup2(saved, 1)
+                    os.close(saved)
+                    launchpadtools.metrics.enable(None)
+        records = []
+        if os.path.exists(metrics_file):
+            records = launchpadtools.metrics.read(metrics_file)
+    return times, records
+
+
+def _get_stage_times(records):
+    totals = {}
+    for r in records:
+        key = f"{r['kind']}:{r['name']}"
+        totals[key] = totals.get(key, 0.0) + r["wall_time"]
+    return totals
+
+
+def _get_commit():
+    try:
+        commit = subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], cwd=_THIS_DIR, stderr=subprocess.DEVNULL
+        )
+        status = subprocess.check_output(
+            ["git", "status", "--porcelain", "--untracked-files=no"], cwd=_THIS_DIR
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit.decode("ascii").strip(), bool(status.strip())
+
+
+def _parse_arguments():
+    parser = argparse.ArgumentParser(description="Benchmark launchpadtools.")
+    parser.add_argument(
+        "-t",
+        "--trees",
+        nargs="+",
+        choices=generate.PRESETS,
+        default=["tiny", "small"],
+        help="tree presets to run (default: tiny small)",
+    )
+    parser.add_argument(
+        "-b",
+        "--benchmarks",
+        nargs="+",
+        choices=BENCHMARKS,
+        default=BENCHMARKS,
+        help="benchmarks to run (default: all)",
+    )
+    parser.add_argument(
+        "-r", "--repeat", type=int, default=3, help="runs per benchmark (default: 3)"
+    )
+    parser.add_argument("-s", "--seed", type=int, default=0, help="tree random seed")
+    parser.add_argument(
+        "--tree-dir",
+        default=os.path.join(
+            os.path.expanduser("~"), ".cache", "launchpadtools", "benchmarks"
+        ),
+        help="where the generated trees are kept (default: %(default)s)",
+    )
+    parser.add_argument(
+        "-o", "--output", default=None, help="JSON file for the results"
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = _parse_arguments()
+    os.environ["PATH"] = (
+        os.path.join(_THIS_DIR, "stubs") + os.pathsep + os.environ["PATH"]
+    )
+
+    commit, dirty = _get_commit()
+    results = {
+        "commit": commit,
+        "dirty": dirty,
+        "date": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "repeat": args.repeat,
+        "results": {},
+    }
+    for preset in args.trees:
+        tree = _get_tree(args.tree_dir, preset, args.seed)
+        num_files, num_bytes = _get_size(tree)
+        for benchmark in args.benchmarks:
+            times, records = _run(benchmark, tree, args.repeat)
+            key = f"{preset}/{benchmark}"
+            results["results"][key] = {
+                "tree": preset,
+                "benchmark": benchmark,
+                "files": num_files,
+                "bytes": num_bytes,
+                "times": times,
+                "min": min(times),
+                "median": statistics.median(times),
+                # total wall time per stage in the last run
+                "stages": _get_stage_times(records),
+            }
+            print(
+                f"{key:<28} min {min(times):8.3f}s  "
+                f"median {statistics.median(times):8.3f}s",
+                flush=True,
+            )
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    return
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,35 @@
 # -*- coding: utf-8 -*-
 #
+import importlib
 
 from launchpadtools.__about__ import __version__, __author__, __author_email__
 
-from . import submit
-from . import cli
+__all__ = [
+    "__version__",
+    "__author__",
+    "__author_email__",
+    "changelog",
+    "checkpoint",
+    "workspace",
+    "watch",
+    "metrics",
+    "patches",
+    "pipeline",
+    "submit",
+    "batch",
+    "daemon",
+    "cli",
+]
 
-__all__ = ["__version__", "__author__", "__author_email__", "submit", "cli"]
+
+def __getattr__(name):
+    # The submodules are imported on first use, so that, e.g., `launchpad-submit
+    # --help` doesn't pay for the imports of the build and upload stages.
+    if name.startswith("_"):
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    try:
+        return importlib.import_module(f".{name}", __name__)
+    except ModuleNotFoundError as e:
+        if e.name != f"{__name__}.{name}":
+            raise
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
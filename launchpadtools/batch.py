@@ -0,0 +1,502 @@
+# -*- coding: utf-8 -*-
+#
+"""
+Submission of many packages in one run, described by a TOML manifest like
+
+    launchpad_login = "john"
+    ubuntu_releases = ["bionic", "focal"]
+
+    [[package]]
+    directory = "~/src/foo"
+    ppa = "john/foo-nightly"
+    version_append_hash = true
+    exclude = ["build/", "*.pyc"]
+    compression = "xz"
+    components = ["docs"]
+
+    [[package]]
+    directory = "~/src/bar"
+    ppa = "john/bar-nightly"
+    ubuntu_releases = ["focal"]
+
+Top-level keys are defaults for all packages. The stages of all packages are
+scheduled on two bounded pools: Hashing, copying, creating tarballs, and
+building run in a pool of processes; publication lookups and uploads in a pool
+of threads. Packages whose tree hash is already published are skipped right
+after hashing. All packages share the caches, the publication indices, and the
+SFTP connections.
+"""
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+
+from . import metrics, publications, submit, tarball, upload, watch
+from .cache import UploadJournal
+
+# Manifest keys and their defaults
+_DEFAULTS = {
+    "directory": None,
+    "ppa": None,
+    "ubuntu_releases": None,
+    "launchpad_login": None,
+    "debuild_params": "",
+    "version_override": None,
+    "version_append_datetime": False,
+    "version_append_hash": False,
+    "force": False,
+    "update_patches": False,
+    "build_once": False,
+    "exclude": [],
+    "compression": "gz",
+    "compression_level": None,
+    "components": [],
+}
+# Keys that may be left unset
+_OPTIONAL = ["version_override", "compression_level"]
+
+
+class ManifestError(Exception):
+    pass
+
+
+def _load_toml(filename):
+    try:
+        import tomllib
+    except ImportError:  # Python < 3.11
+        import toml
+
+        with open(filename, "r") as handle:
+            return toml.load(handle)
+    with open(filename, "rb") as handle:
+        return tomllib.load(handle)
+
+
+def load_manifest(filename):
+    """Returns the package entries of a manifest as dictionaries with all keys of
+    `_DEFAULTS`. Relative directories are relative to the manifest.
+    """
+    data = _load_toml(filename)
+    packages = data.pop("package", [])
+    if not packages:
+        raise ManifestError(f"{filename}: No [[package]] entries.")
+
+    entries = []
+    for k, package in enumerate(packages):
+        for key in list(data) + list(package):
+            if key not in _DEFAULTS:
+                raise ManifestError(f"{filename}: Unknown key `{key}`.")
+        entry = {**_DEFAULTS, **data, **package}
+        for key, value in entry.items():
+            if value is None and key not in _OPTIONAL:
+                raise ManifestError(f"{filename}: Package {k + 1} lacks `{key}`.")
+        for key in ["exclude", "components"]:
+            if not isinstance(entry[key], list):
+                raise ManifestError(f"{filename}: `{key}` must be a list.")
+        if entry["compression"] not in list(tarball.DEFAULT_LEVELS) + ["auto"]:
+            raise ManifestError(
+                f"{filename}: Unknown compression `{entry['compression']}`."
+            )
+        if entry["compression"] == "auto" and entry["compression_level"] is not None:
+            raise ManifestError(
+                f"{filename}: `compression_level` doesn't apply to `auto`."
+            )
+        entry["directory"] = os.path.join(
+            os.path.dirname(os.path.abspath(filename)),
+            os.path.expanduser(entry["directory"]),
+        )
+        entries.append(entry)
+    return entries
+
+
+def _prepare(entry, work_dir, cache_dir, use_cache, hash_cache=None):
+    """Reads the versions and hashes the source of a package. Runs in the CPU pool.
+    `hash_cache` is an open `HashCache` to use instead of opening one.
+    """
+    package = submit.read_package(
+        entry["directory"],
+        entry["version_override"],
+        entry["version_append_datetime"],
+        entry["version_append_hash"],
+        entry["exclude"],
+        entry["components"],
+    )
+    with metrics.context(package=package["name"]):
+        return submit.hash_package(
+            package,
+            work_dir,
+            UploadJournal(cache_dir, persistent=use_cache),
+            entry["compression"],
+            entry["compression_level"],
+            single_pass=entry["force"],
+            cache_dir=cache_dir,
+            use_cache=use_cache,
+            hash_cache=hash_cache,
+        )
+
+
+def _build(entry, package, releases, on_ppa, work_dir, cache_dir, use_cache, dry):
+    """Copies the source, creates the orig tarball, and builds the source packages
+    for `releases`. Runs in the CPU pool.
+
+    Returns the build results and the list of `(release, work_dir,
+    chlog_version)` to upload.
+    """
+    uploads = []
+
+    def upload_release(release, release_work_dir, chlog_version):
+        uploads.append((release, release_work_dir, chlog_version))
+
+    with metrics.context(package=package["name"]):
+        # The packages are built in parallel already, so build the releases one
+        # after another.
+        results = submit.build_package(
+            package,
+            work_dir,
+            releases,
+            entry["ppa"],
+            entry["launchpad_login"],
+            UploadJournal(cache_dir, persistent=use_cache),
+            upload_release,
+            on_ppa=on_ppa,
+            debuild_params=entry["debuild_params"],
+            do_update_patches=entry["update_patches"],
+            build_once=entry["build_once"],
+            dry=dry,
+            cache_dir=cache_dir,
+            use_cache=use_cache,
+        )
+    return results, uploads
+
+
+def _check(index, entry, package, dry):
+    """Returns the releases that need a submission and the orig and component
+    tarballs the PPA has (`None` if that doesn't matter). Runs in the network
+    pool.
+    """
+    with metrics.context(package=package["name"]):
+        return submit.check_package(package, index, entry["ubuntu_releases"], dry)
+
+
+def _upload(uploader, journal, entry, package, release, work_dir, chlog_version):
+    """Uploads the source package of `release`. Returns the upload (see `watch`)
+    and the error, if any. Runs in the network pool.
+    """
+    try:
+        uploaded = submit.upload_package(
+            uploader,
+            journal,
+            package,
+            entry["ppa"],
+            entry["launchpad_login"],
+            release,
+            work_dir,
+            chlog_version,
+        )
+    except (submit.DputException, subprocess.CalledProcessError) as e:
+        return None, e
+    return uploaded, None
+
+
+class _Scheduler:
+    """Moves the packages through the stages prepare (CPU), check (network),
+    build (CPU), and upload (network). Everything but the work in the pools
+    happens in the thread calling `run()`.
+    """
+
+    def __init__(
+        self,
+        entries,
+        cpu_pool,
+        network_pool,
+        dry,
+        cache_dir,
+        use_cache,
+        publication_ttl,
+    ):
+        self.entries = entries
+        self.cpu_pool = cpu_pool
+        self.network_pool = network_pool
+        self.dry = dry
+        self.cache_dir = cache_dir
+        self.use_cache = use_cache
+        self.publication_ttl = publication_ttl
+
+        self.journal = UploadJournal(cache_dir, persistent=use_cache)
+        self.indices = {}
+        self.uploaders = {}
+        self.lock = threading.Lock()
+        # future -> (entry index, callback, log file or None)
+        self.pending = {}
+        self.reports = [
+            {
+                "directory": entry["directory"],
+                "ppa": entry["ppa"],
+                "status": None,
+                "results": {},
+                "error": None,
+                "elapsed_time": None,
+            }
+            for entry in entries
+        ]
+        self.work_dirs = {}
+        self.tics = {}
+        self.open_uploads = {}
+        # (entry index, upload) of the successful uploads, see `watch`
+        self.uploads = []
+        # number of unfinished packages per PPA connection
+        self.remaining = {}
+        for entry in entries:
+            key = (entry["launchpad_login"], entry["ppa"])
+            self.remaining[key] = self.remaining.get(key, 0) + 1
+
+    def _submit_cpu(self, k, stage, callback, function, *args):
+        log_file = os.path.join(self.work_dirs[k], f"{stage}.log")
+        future = self.cpu_pool.submit(submit.run_logged, log_file, function, *args)
+        self.pending[future] = (k, callback, log_file)
+
+    def _submit_network(self, k, callback, function, *args):
+        future = self.network_pool.submit(function, *args)
+        self.pending[future] = (k, callback, None)
+
+    def run(self):
+        for k, entry in enumerate(self.entries):
+            self.tics[k] = time.time()
+            self.work_dirs[k] = tempfile.mkdtemp(prefix="launchpadtools-")
+            self._submit_cpu(
+                k,
+                "prepare",
+                self._on_prepared,
+                _prepare,
+                entry,
+                self.work_dirs[k],
+                self.cache_dir,
+                self.use_cache,
+            )
+
+        while self.pending:
+            done, _ = wait(self.pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                k, callback, log_file = self.pending.pop(future)
+                if log_file is not None:
+                    print(f"==> {self.entries[k]['directory']} <==")
+                    with open(log_file) as f:
+                        print(f.read())
+                try:
+                    result = future.result()
+                except Exception as e:
+                    # Don't let one package take down the others.
+                    self.reports[k]["error"] = e
+                    self._finish(k)
+                else:
+                    callback(k, result)
+        return self.reports
+
+    def _get_index(self, entry, name):
+        key = (entry["ppa"], name)
+        with self.lock:
+            if key not in self.indices:
+                self.indices[key] = publications.PublicationIndex(
+                    entry["ppa"],
+                    name,
+                    cache_dir=self.cache_dir,
+                    ttl=self.publication_ttl,
+                    persistent=self.use_cache,
+                )
+            return self.indices[key]
+
+    def _get_uploader(self, login):
+        with self.lock:
+            if login not in self.uploaders:
+                self.uploaders[login] = upload.Uploader(login)
+            return self.uploaders[login]
+
+    def _on_prepared(self, k, package):
+        entry = self.entries[k]
+        if entry["force"]:
+            self._on_checked(k, (package, entry["ubuntu_releases"], None))
+        else:
+            self._submit_network(k, self._on_checked, self._check, entry, package)
+
+    def _check(self, entry, package):
+        """Runs in the network pool."""
+        index = self._get_index(entry, package["name"])
+        releases, on_ppa = _check(index, entry, package, self.dry)
+        return package, releases, on_ppa
+
+    def _on_checked(self, k, result):
+        package, releases, on_ppa = result
+        if not releases:
+            self.reports[k]["status"] = "up-to-date"
+            self._finish(k)
+            return
+        self._submit_cpu(
+            k,
+            "build",
+            self._on_built,
+            _build,
+            self.entries[k],
+            package,
+            releases,
+            on_ppa,
+            self.work_dirs[k],
+            self.cache_dir,
+            self.use_cache,
+            self.dry,
+        )
+        self.reports[k]["package"] = package
+
+    def _on_built(self, k, result):
+        results, uploads = result
+        self.reports[k]["status"] = "submitted"
+        self.reports[k]["results"] = results
+        self.open_uploads[k] = len(uploads)
+        if not uploads:
+            self._finish(k)
+            return
+        for release, work_dir, chlog_version in uploads:
+            self._submit_network(
+                k, self._on_uploaded, self._upload, k, release, work_dir, chlog_version
+            )
+
+    def _upload(self, k, release, work_dir, chlog_version):
+        """Runs in the network pool."""
+        entry = self.entries[k]
+        uploaded, error = _upload(
+            self._get_uploader(entry["launchpad_login"]),
+            self.journal,
+            entry,
+            self.reports[k]["package"],
+            release,
+            work_dir,
+            chlog_version,
+        )
+        if uploaded is not None:
+            with self.lock:
+                self.uploads.append((k, uploaded))
+        return release, error
+
+    def _on_uploaded(self, k, result):
+        release, error = result
+        self.reports[k]["results"][release] = error
+        self.open_uploads[k] -= 1
+        if self.open_uploads[k] == 0:
+            self._finish(k)
+
+    def _finish(self, k):
+        if self.reports[k]["elapsed_time"] is not None:
+            # already finished by an error in one of several uploads
+            return
+        entry = self.entries[k]
+        shutil.rmtree(self.work_dirs[k], ignore_errors=True)
+        self.reports[k]["elapsed_time"] = time.time() - self.tics[k]
+        self.reports[k].pop("package", None)
+
+        # Launchpad processes the uploads once the connection is closed.
+        key = (entry["launchpad_login"], entry["ppa"])
+        self.remaining[key] -= 1
+        if self.remaining[key] == 0 and entry["launchpad_login"] in self.uploaders:
+            self.uploaders[entry["launchpad_login"]].close(entry["ppa"])
+
+    def close(self):
+        for uploader in self.uploaders.values():
+            uploader.close()
+        for work_dir in self.work_dirs.values():
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def print_summary(reports):
+    print("\nSummary:")
+    for report in reports:
+        head = "    {} ({}):".format(report["directory"], report["ppa"])
+        if report["elapsed_time"] is not None:
+            time_str = " ({:.1f}s)".format(report["elapsed_time"])
+        else:
+            time_str = ""
+        if report["error"] is not None:
+            error = report["error"]
+            print(f"{head} FAILED ({type(error).__name__}: {error}){time_str}")
+        elif report["status"] == "up-to-date":
+            print(f"{head} up-to-date{time_str}")
+        else:
+            print(f"{head} submitted{time_str}")
+            for release, error in report["results"].items():
+                if error is None:
+                    print(f"        {release}: success")
+                else:
+                    print(
+                        f"        {release}: FAILED ({type(error).__name__}: {error})"
+                    )
+    print()
+
+
+def has_failures(reports):
+    return any(
+        report["error"] is not None
+        or any(error is not None for error in report["results"].values())
+        for report in reports
+    )
+
+
+def run(
+    manifest,
+    jobs=None,
+    network_jobs=4,
+    dry=False,
+    cache_dir=None,
+    use_cache=True,
+    publication_ttl=publications.DEFAULT_TTL,
+    wait=False,
+    wait_timeout=None,
+):
+    """Submits all packages of the manifest. `jobs` is the number of processes for
+    the CPU-bound stages (default: number of CPUs), `network_jobs` the number of
+    threads for publication lookups and uploads. With `wait`, the builds of all
+    uploads are watched together until they have finished or `wait_timeout` seconds
+    have passed; releases that failed to build get a `watch.BuildError` as result.
+
+    Returns a report for each package: a dictionary with the keys `directory`,
+    `ppa`, `status` (`"up-to-date"` or `"submitted"`), `results` (release ->
+    `None` or exception), `error` (exception that aborted the package or `None`),
+    and `elapsed_time`.
+    """
+    entries = load_manifest(manifest)
+    with ProcessPoolExecutor(
+        max_workers=jobs,
+        initializer=metrics.enable,
+        initargs=(metrics.get_filename(),),
+    ) as cpu_pool, ThreadPoolExecutor(max_workers=network_jobs) as network_pool:
+        scheduler = _Scheduler(
+            entries,
+            cpu_pool,
+            network_pool,
+            dry,
+            cache_dir,
+            use_cache,
+            publication_ttl,
+        )
+        try:
+            reports = scheduler.run()
+        finally:
+            scheduler.close()
+
+    if wait and scheduler.uploads:
+        indices, uploads = zip(*scheduler.uploads)
+        outcomes = submit.wait_for_builds(
+            scheduler.journal, list(uploads), timeout=wait_timeout
+        )
+        for k, outcome in zip(indices, outcomes):
+            if outcome["status"] != "built":
+                error = watch.BuildError(outcome)
+                reports[k]["results"][outcome["series"]] = error
+
+    print_summary(reports)
+    return reports
@@ -0,0 +1,456 @@
+# -*- coding: utf-8 -*-
+#
+"""
+Persistent caches shared between runs.
+"""
+import contextlib
+import errno
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+
+# Maximum number of entries kept in the hash cache
+DEFAULT_MAX_ENTRIES = 2 * 10 ** 6
+
+# Entries are marked as used at most once in this many seconds.
+_TOUCH_INTERVAL = 24 * 60 * 60
+
+# Layout of the hash cache database; tables of older layouts are dropped.
+_SCHEMA_VERSION = 1
+
+
+def get_cache_dir():
+    """Returns the launchpadtools cache directory, by default
+    `~/.cache/launchpadtools`.
+    """
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    return os.path.join(base, "launchpadtools")
+
+
+class HashCache:
+    """On-disk cache of Git blob hashes keyed by (root directory, relative path) and
+    validated by (size, mtime_ns, inode), plus tree hashes validated by a
+    signature of the stat data of the entire subtree. Tree hashes are also keyed
+    by a variant (see `treehash.get_variant()`), since different selections of
+    files, e.g., with and without `.gitignore`, give different hashes of the same
+    directory.
+
+    The cache is an SQLite database, so concurrent runs can safely share it.
+    Lookups are answered from memory; all writes happen in one transaction in
+    `flush()`, which also evicts the least recently used entries beyond
+    `max_entries`. A long-lived instance thus keeps the hashes in memory between
+    runs. It may be used by several threads, but only by one at a time.
+    """
+
+    def __init__(self, cache_dir=None, max_entries=DEFAULT_MAX_ENTRIES):
+        if cache_dir is None:
+            cache_dir = get_cache_dir()
+        os.makedirs(cache_dir, exist_ok=True)
+        self.max_entries = max_entries
+        self._db = sqlite3.connect(
+            os.path.join(cache_dir, "hashes.sqlite"),
+            timeout=60,
+            check_same_thread=False,
+        )
+        self._db.execute("PRAGMA journal_mode=WAL")
+        with self._db:
+            (version,) = self._db.execute("PRAGMA user_version").fetchone()
+            if version < _SCHEMA_VERSION:
+                self._db.execute("DROP TABLE IF EXISTS trees")
+                self._db.execute(f"PRAGMA user_version = {_SCHEMA_VERSION}")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS blobs ("
+                "root TEXT, path TEXT, size INTEGER, mtime_ns INTEGER, "
+                "inode INTEGER, digest BLOB, last_used INTEGER, "
+                "PRIMARY KEY (root, path))"
+            )
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS trees ("
+                "root TEXT, variant TEXT, path TEXT, signature BLOB, digest BLOB, "
+                "last_used INTEGER, PRIMARY KEY (root, variant, path))"
+            )
+        self._blobs = {}
+        self._trees = {}
+        self._dirty_blobs = {}
+        self._dirty_trees = {}
+        self._now = int(time.time())
+
+    def _load(self, root):
+        if root in self._blobs:
+            return
+        self._blobs[root] = {
+            path: ((size, mtime_ns, inode), digest, last_used)
+            for path, size, mtime_ns, inode, digest, last_used in self._db.execute(
+                "SELECT path, size, mtime_ns, inode, digest, last_used "
+                "FROM blobs WHERE root = ?",
+                (root,),
+            )
+        }
+        self._trees[root] = {
+            (variant, path): (signature, digest, last_used)
+            for variant, path, signature, digest, last_used in self._db.execute(
+                "SELECT variant, path, signature, digest, last_used FROM trees "
+                "WHERE root = ?",
+                (root,),
+            )
+        }
+
+    def get_blob(self, root, path, stat_key):
+        self._load(root)
+        entry = self._blobs[root].get(path)
+        if entry is None or entry[0] != stat_key:
+            return None
+        if entry[2] < self._now - _TOUCH_INTERVAL:
+            self.put_blob(root, path, stat_key, entry[1])
+        return entry[1]
+
+    def put_blob(self, root, path, stat_key, digest):
+        self._load(root)
+        entry = self._blobs[root].get(path)
+        if entry is not None and entry[:2] == (stat_key, digest):
+            if entry[2] >= self._now - _TOUCH_INTERVAL:
+                return
+        self._blobs[root][path] = (stat_key, digest, self._now)
+        self._dirty_blobs[(root, path)] = (stat_key, digest)
+
+    def get_tree(self, root, variant, path, signature):
+        self._load(root)
+        entry = self._trees[root].get((variant, path))
+        if entry is None or entry[0] != signature:
+            return None
+        if entry[2] < self._now - _TOUCH_INTERVAL:
+            self.put_tree(root, variant, path, signature, entry[1])
+        return entry[1]
+
+    def put_tree(self, root, variant, path, signature, digest):
+        self._load(root)
+        entry = self._trees[root].get((variant, path))
+        if entry is not None and entry[:2] == (signature, digest):
+            if entry[2] >= self._now - _TOUCH_INTERVAL:
+                return
+        self._trees[root][(variant, path)] = (signature, digest, self._now)
+        self._dirty_trees[(root, variant, path)] = (signature, digest)
+
+    def flush(self):
+        """Writes all new entries to disk and evicts old ones.
+        """
+        if not self._dirty_blobs and not self._dirty_trees:
+            return
+        with self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO blobs VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    (root, path) + stat_key + (digest, self._now)
+                    for (root, path), (stat_key, digest) in self._dirty_blobs.items()
+                ),
+            )
+            self._db.executemany(
+                "INSERT OR REPLACE INTO trees VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    key + (signature, digest, self._now)
+                    for key, (signature, digest) in self._dirty_trees.items()
+                ),
+            )
+            for table in ["blobs", "trees"]:
+                (count,) = self._db.execute(f"SELECT COUNT(*) FROM {table}").fetchone()
+                if count > self.max_entries:
+                    self._db.execute(
+                        f"DELETE FROM {table} WHERE rowid IN (SELECT rowid FROM "
+                        f"{table} ORDER BY last_used LIMIT ?)",
+                        (count - self.max_entries,),
+                    )
+        self._dirty_blobs = {}
+        self._dirty_trees = {}
+        # for instances that live longer than a run
+        self._now = int(time.time())
+
+    def close(self):
+        self.flush()
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+# Default maximum total size of the orig tarball store
+DEFAULT_MAX_STORE_BYTES = 5 * 1024 ** 3
+
+
+class OrigStore:
+    """Content-addressed store of orig tarballs. Tarballs are filed under a digest
+    of a key dictionary that must determine their content (tree hash, prefix,
+    compression settings, ...). Retrieval hard-links if possible.
+
+    The least recently used tarballs are evicted once the total size exceeds
+    `max_bytes`. Files are only ever added by atomic renames, so concurrent runs
+    can share the store.
+    """
+
+    def __init__(self, cache_dir=None, max_bytes=DEFAULT_MAX_STORE_BYTES):
+        if cache_dir is None:
+            cache_dir = get_cache_dir()
+        self.directory = os.path.join(cache_dir, "origs")
+        os.makedirs(self.directory, exist_ok=True)
+        self.max_bytes = max_bytes
+
+    def _get_path(self, key):
+        digest = hashlib.sha256(json.dumps(key, sort_keys=True).encode("utf-8"))
+        return os.path.join(self.directory, digest.hexdigest())
+
+    def get(self, key, dest):
+        """Puts the tarball for `key` at `dest`. Returns `False` if there is none.
+        """
+        path = self._get_path(key)
+        try:
+            try:
+                os.link(path, dest)
+            except OSError as e:
+                if e.errno != errno.EXDEV:
+                    raise
+                shutil.copy2(path, dest)
+            # mark as recently used
+            os.utime(path)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def has(self, key):
+        return os.path.exists(self._get_path(key))
+
+    def put(self, key, filename):
+        path = self._get_path(key)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        try:
+            os.link(filename, tmp)
+        except OSError:
+            shutil.copy2(filename, tmp)
+        os.utime(tmp)
+        os.replace(tmp, path)
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".tmp"):
+                continue
+            try:
+                st = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+# Number of orig tarballs remembered per PPA
+DEFAULT_MAX_JOURNAL_ENTRIES = 100
+# Upload bandwidth (bytes per second) assumed until one has been measured
+DEFAULT_BANDWIDTH = 2 * 1024 ** 2
+# Smaller uploads are dominated by latency and don't tell the bandwidth.
+_MIN_BANDWIDTH_BYTES = 1024 ** 2
+
+
+def _read_json(filename):
+    if filename is None:
+        return {}
+    try:
+        with open(filename, "r") as handle:
+            return json.load(handle)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def _write_json(filename, data):
+    if filename is not None:
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        tmp = f"{filename}.{os.getpid()}.tmp"
+        with open(tmp, "w") as handle:
+            json.dump(data, handle, indent=1)
+        os.replace(tmp, filename)
+
+
+class UploadJournal:
+    """Record of the orig tarballs uploaded to each PPA, identified by file name and
+    SHA-256, so later uploads can leave out tarballs the PPA already has. It also
+    keeps the measured upload bandwidth, the compressions that `--compression
+    auto` picked, and the uploads whose builds haven't been watched to the end (see
+    `watch`).
+
+    The journal consists of JSON files in the cache directory. Every change
+    re-reads and atomically replaces a file while holding a lock on
+    `journal.lock`, so concurrent runs don't lose each other's entries. With
+    `persistent=False`, it only lives in memory.
+    """
+
+    def __init__(
+        self, cache_dir=None, persistent=True, max_entries=DEFAULT_MAX_JOURNAL_ENTRIES
+    ):
+        if cache_dir is None:
+            cache_dir = get_cache_dir()
+        self.filename = os.path.join(cache_dir, "uploads.json") if persistent else None
+        self.tuning_filename = (
+            os.path.join(cache_dir, "tuning.json") if persistent else None
+        )
+        self.builds_filename = (
+            os.path.join(cache_dir, "builds.json") if persistent else None
+        )
+        self.max_entries = max_entries
+        self._entries = self._load()
+        self._tuning = _read_json(self.tuning_filename)
+        self._builds = _read_json(self.builds_filename)
+        self._sha256 = {}
+        self._lock = threading.Lock()
+        self._lock_filename = (
+            os.path.join(cache_dir, "journal.lock") if persistent else None
+        )
+
+    @contextlib.contextmanager
+    def _locked(self):
+        """Locks the journal against the other threads and processes for a
+        read-modify-write.
+        """
+        with self._lock:
+            if self._lock_filename is None:
+                yield
+                return
+            os.makedirs(os.path.dirname(self._lock_filename), exist_ok=True)
+            with open(self._lock_filename, "w") as handle:
+                fcntl.flock(handle, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(handle, fcntl.LOCK_UN)
+
+    def _load(self):
+        return _read_json(self.filename)
+
+    def get_sha256(self, path):
+        """Returns the SHA-256 of a file, computed once per file version.
+        """
+        st = os.stat(path)
+        key = (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+        if key not in self._sha256:
+            sha = hashlib.sha256()
+            with open(path, "rb") as handle:
+                for chunk in iter(lambda: handle.read(1024 * 1024), b""):
+                    sha.update(chunk)
+            self._sha256[key] = sha.hexdigest()
+        return self._sha256[key]
+
+    def contains(self, ppa_string, path):
+        """Checks if the file at `path` has been uploaded to the PPA.
+        """
+        sha256 = self._entries.get(ppa_string, {}).get(os.path.basename(path))
+        return sha256 is not None and sha256 == self.get_sha256(path)
+
+    def put(self, ppa_string, filename, sha256):
+        with self._locked():
+            if self.filename is not None:
+                self._entries = self._load()
+            entries = self._entries.setdefault(ppa_string, {})
+            # keep the insertion order as age order
+            entries.pop(filename, None)
+            entries[filename] = sha256
+            for old in list(entries)[: -self.max_entries]:
+                del entries[old]
+            self._save()
+
+    def discard(self, ppa_string, filename):
+        with self._locked():
+            if self.filename is not None:
+                self._entries = self._load()
+            if self._entries.get(ppa_string, {}).pop(filename, None) is not None:
+                self._save()
+
+    def _save(self):
+        _write_json(self.filename, self._entries)
+
+    def get_bandwidth(self):
+        """Returns the upload bandwidth in bytes per second."""
+        return self._tuning.get("bandwidth", DEFAULT_BANDWIDTH)
+
+    def record_bandwidth(self, sent_bytes, seconds):
+        """Updates the upload bandwidth with the one of an upload, averaged with the
+        previous ones.
+        """
+        if sent_bytes < _MIN_BANDWIDTH_BYTES or seconds <= 0:
+            return
+        with self._locked():
+            if self.tuning_filename is not None:
+                self._tuning = _read_json(self.tuning_filename)
+            bandwidth = sent_bytes / seconds
+            if "bandwidth" in self._tuning:
+                bandwidth = (self._tuning["bandwidth"] + bandwidth) / 2
+            self._tuning["bandwidth"] = bandwidth
+            _write_json(self.tuning_filename, self._tuning)
+
+    def get_compression(self, name, upstream_version):
+        """Returns the codec and level picked for the orig tarball of `name` in
+        `upstream_version`, or `None`. A PPA can only ever have one orig tarball
+        per version, so the pick must not change.
+        """
+        entry = self._tuning.get("compressions", {}).get(name)
+        if entry is None or entry["upstream_version"] != upstream_version:
+            return None
+        return entry["compression"], entry["level"]
+
+    def put_compression(self, name, upstream_version, compression, level):
+        with self._locked():
+            if self.tuning_filename is not None:
+                self._tuning = _read_json(self.tuning_filename)
+            self._tuning.setdefault("compressions", {})[name] = {
+                "upstream_version": upstream_version,
+                "compression": compression,
+                "level": level,
+            }
+            _write_json(self.tuning_filename, self._tuning)
+
+    def put_upload(self, upload):
+        """Records an upload (see `watch`) whose builds are yet to be watched."""
+        with self._locked():
+            if self.builds_filename is not None:
+                self._builds = _read_json(self.builds_filename)
+            uploads = [u for u in self._builds.get("uploads", []) if u != upload]
+            uploads.append(upload)
+            self._builds["uploads"] = uploads[-self.max_entries :]
+            _write_json(self.builds_filename, self._builds)
+
+    def get_uploads(self, ppa_string=None):
+        """Returns the recorded uploads, oldest first, optionally only those to
+        `ppa_string`.
+        """
+        with self._lock:
+            if self.builds_filename is not None:
+                self._builds = _read_json(self.builds_filename)
+            uploads = self._builds.get("uploads", [])
+        return [u for u in uploads if ppa_string in [None, u["ppa"]]]
+
+    def discard_uploads(self, uploads):
+        """Forgets uploads, e.g., once their builds have an outcome."""
+        keys = [(u["ppa"], u["name"], u["version"], u["series"]) for u in uploads]
+        with self._locked():
+            if self.builds_filename is not None:
+                self._builds = _read_json(self.builds_filename)
+            self._builds["uploads"] = [
+                u
+                for u in self._builds.get("uploads", [])
+                if (u["ppa"], u["name"], u["version"], u["series"]) not in keys
+            ]
+            _write_json(self.builds_filename, self._builds)
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+#
+"""
+Reading and writing `debian/changelog`, see
+<https://www.debian.org/doc/debian-policy/ch-source.html#debian-changelog-debian-changelog>.
+
+Entries are written in the format of `dch --create`, without running dch.
+"""
+import email.utils
+import functools
+import getpass
+import os
+import pwd
+import re
+import socket
+
+# package (version) distribution(s); key=value, ...
+_HEADER = re.compile(
+    r"^(\w[-+0-9a-z.]*) \(([^() \t]+)\)((?:\s+[-+0-9a-z.]+)+);(.*)$", re.IGNORECASE
+)
+#  -- maintainer <address>  date
+_TRAILER = re.compile(r"^ -- (.*) <(.*)>  ?(.*\S)\s*$")
+
+
+class ChangelogError(Exception):
+    pass
+
+
+@functools.lru_cache(maxsize=1)
+def _get_mail_name():
+    try:
+        with open("/etc/mailname", "r") as handle:
+            name = handle.read().strip()
+    except OSError:
+        name = ""
+    # getfqdn() might ask the DNS, so it's only done once.
+    return name or socket.getfqdn()
+
+
+def _split_address(value):
+    out = re.match(r"^(.*?)\s*<(.+)>$", value)
+    if out:
+        return out.group(1) or None, out.group(2)
+    return None, value
+
+
+def get_maintainer():
+    """Returns the name and email address to sign changelog entries with. Like dch,
+    this looks at `DEBFULLNAME`, `DEBEMAIL`, `NAME`, and `EMAIL` (the email
+    variables may be of the form `Name <address>`), and falls back to the account
+    of the user.
+    """
+    name = os.environ.get("DEBFULLNAME")
+    address = None
+    for var in ["DEBEMAIL", "EMAIL"]:
+        if os.environ.get(var):
+            name_in_address, address = _split_address(os.environ[var])
+            name = name or name_in_address
+            break
+    name = name or os.environ.get("NAME")
+
+    user = getpass.getuser()
+    if not name:
+        try:
+            gecos = pwd.getpwnam(user).pw_gecos
+        except KeyError:
+            gecos = ""
+        name = gecos.split(",")[0] or user
+    if not address:
+        address = f"{user}@{_get_mail_name()}"
+    return name, address
+
+
+def format_entry(
+    package,
+    version,
+    distribution,
+    changes=("launchpad-submit update",),
+    urgency="medium",
+    maintainer=None,
+    date=None,
+):
+    """Returns a changelog entry. `maintainer` is a tuple of name and email address
+    (default: `get_maintainer()`), `date` an RFC 2822 date (default: now).
+    """
+    if maintainer is None:
+        maintainer = get_maintainer()
+    if date is None:
+        date = email.utils.formatdate(localtime=True)
+    name, address = maintainer
+    lines = [f"{package} ({version}) {distribution}; urgency={urgency}", ""]
+    lines += [f"  * {change}" for change in changes]
+    lines += ["", f" -- {name} <{address}>  {date}", ""]
+    return "\n".join(lines)
+
+
+def write(filename, package, version, distribution, **kwargs):
+    """Replaces `filename` by a changelog with a single entry; the keyword
+    arguments are those of `format_entry()`. The file is replaced rather than
+    overwritten, so hard links to it are left alone.
+    """
+    tmp = f"{filename}.{os.getpid()}.tmp"
+    with open(tmp, "w") as handle:
+        handle.write(format_entry(package, version, distribution, **kwargs))
+    os.replace(tmp, filename)
+    return
+
+
+def iter_entries(text):
+    """Yields the entries of a changelog, newest first, as dictionaries with the
+    keys `package`, `version`, `distributions` (list), `urgency`, `fields` (all
+    `key=value` pairs of the header), `header` (the header line), `changes` (the
+    lines between the header and the trailer), `maintainer` (name and email
+    address), and `date`.
+
+    Text after the last complete entry that doesn't start a new one (e.g., old
+    formats or editor settings) is ignored.
+    """
+    entry = None
+    found = False
+    for k, line in enumerate(text.splitlines()):
+        if entry is None:
+            if not line.strip():
+                continue
+            out = _HEADER.match(line)
+            if out is None:
+                if found:
+                    return
+                raise ChangelogError(f"line {k + 1}: expected entry header: {line}")
+            package, version, distributions, fields = out.groups()
+            fields = dict(
+                _split_field(field, k) for field in fields.split(",") if field.strip()
+            )
+            entry = {
+                "package": package,
+                "version": version,
+                "distributions": distributions.split(),
+                "urgency": fields.get("urgency"),
+                "fields": fields,
+                "header": line,
+                "changes": [],
+            }
+            continue
+
+        out = _TRAILER.match(line)
+        if out is None:
+            if line.startswith(" -- "):
+                raise ChangelogError(f"line {k + 1}: malformed trailer: {line}")
+            entry["changes"].append(line)
+            continue
+        name, address, date = out.groups()
+        # strip surrounding blank lines
+        changes = entry["changes"]
+        while changes and not changes[0].strip():
+            changes.pop(0)
+        while changes and not changes[-1].strip():
+            changes.pop()
+        entry["maintainer"] = (name, address)
+        entry["date"] = date
+        yield entry
+        entry = None
+        found = True
+
+    if entry is not None:
+        raise ChangelogError(f"entry {entry['header']} has no trailer")
+    if not found:
+        raise ChangelogError("no entries")
+
+
+def parse(text):
+    """Returns all entries of a changelog, see `iter_entries()`."""
+    return list(iter_entries(text))
+
+
+def _split_field(field, k):
+    key, sep, value = field.strip().partition("=")
+    if not sep:
+        raise ChangelogError(f"line {k + 1}: expected key=value, got {field}")
+    return key.lower(), value
+
+
+def read_latest(filename):
+    """Returns the topmost entry of the changelog `filename`, see
+    `iter_entries()`.
+    """
+    with open(filename, "r") as handle:
+        return next(iter_entries(handle.read()))
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+#
+"""
+Journal of the completed stages of a submission in a persistent work directory,
+so that an interrupted or partly failed submission can be resumed.
+
+The journal is `checkpoints.json` in the work directory. It records the stages
+`hashed`, `staged`, and `tarballed` once, and `built`, `uploaded`, and `failed`
+per release, together with the SHA-256 of the files they produced. Files are
+only reused if they still have these checksums.
+"""
+import hashlib
+import json
+import os
+import shutil
+import threading
+
+FILENAME = "checkpoints.json"
+
+# The stages of a release in order; completing one invalidates the later ones.
+RELEASE_STAGES = ["built", "uploaded"]
+
+
+class CheckpointError(Exception):
+    pass
+
+
+def _sha256(path):
+    sha = hashlib.sha256()
+    with open(path, "rb") as handle:
+        for chunk in iter(lambda: handle.read(1024 * 1024), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+class StageJournal:
+    """The stages recorded in the work directory `work_dir`. Stages are
+    dictionaries of data, e.g., the checksums of the files they created, keyed by
+    the stage name (and the release for per-release stages).
+    """
+
+    def __init__(self, work_dir):
+        self.work_dir = work_dir
+        self.filename = os.path.join(work_dir, FILENAME)
+        self._lock = threading.Lock()
+        self._data = None
+        if os.path.isfile(self.filename):
+            with open(self.filename, "r") as handle:
+                self._data = json.load(handle)
+
+    def reset(self):
+        """Empties the work directory for a fresh start. Directories without a
+        journal are only used if they are empty, so nothing else gets deleted.
+        """
+        os.makedirs(self.work_dir, exist_ok=True)
+        entries = os.listdir(self.work_dir)
+        if entries and self._data is None:
+            raise CheckpointError(
+                f"{self.work_dir} is neither empty nor a launchpadtools work directory."
+            )
+        for name in entries:
+            path = os.path.join(self.work_dir, name)
+            if os.path.isdir(path) and not os.path.islink(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+        self._data = None
+        return
+
+    def is_started(self):
+        return self._data is not None
+
+    def open(self, key):
+        """Continues the journal if it was started for `key` (a JSON-compatible
+        dictionary describing the submission), and starts a new one otherwise.
+        Returns `True` if the journal is continued.
+        """
+        if self._data is not None:
+            if self._data["key"] == key:
+                return True
+            self.reset()
+        self._data = {"key": key, "stages": {}, "releases": {}}
+        self._save()
+        return False
+
+    def _save(self):
+        tmp = f"{self.filename}.{os.getpid()}.tmp"
+        with open(tmp, "w") as handle:
+            json.dump(self._data, handle, indent=1)
+        os.replace(tmp, self.filename)
+
+    def _get_stages(self, release):
+        if release is None:
+            return self._data["stages"]
+        return self._data["releases"].setdefault(release, {})
+
+    def get(self, stage, release=None):
+        """Returns the data of `stage`, or `None` if it hasn't been completed or any
+        of its files has changed since.
+        """
+        with self._lock:
+            data = self._get_stages(release).get(stage)
+        if data is None:
+            return None
+        for relpath, sha256 in data.get("files", {}).items():
+            path = os.path.join(self.work_dir, relpath)
+            if not os.path.isfile(path) or _sha256(path) != sha256:
+                return None
+        return data
+
+    def put(self, stage, release=None, files=(), **data):
+        """Records `stage` as completed with the keyword arguments as data and the
+        checksums of `files`, which must be in the work directory. Completing a
+        stage of a release clears its failure and the later stages.
+        """
+        data["files"] = {
+            os.path.relpath(path, self.work_dir): _sha256(path) for path in files
+        }
+        with self._lock:
+            stages = self._get_stages(release)
+            if stage in RELEASE_STAGES:
+                for later in RELEASE_STAGES[RELEASE_STAGES.index(stage) + 1 :]:
+                    stages.pop(later, None)
+            stages[stage] = data
+            stages.pop("failed", None)
+            self._save()
+        return
+
+    def fail(self, release, error):
+        """Records that `release` failed with the exception `error`."""
+        with self._lock:
+            stages = self._get_stages(release)
+            stages["failed"] = {"error": f"{type(error).__name__}: {error}"}
+            self._save()
+        return
+
+    def get_summary(self):
+        """Returns a line for each release in the journal with its last completed
+        stage and its failure, if any.
+        """
+        lines = []
+        with self._lock:
+            releases = dict(self._data["releases"]) if self._data else {}
+        for release, stages in releases.items():
+            done = [s for s in RELEASE_STAGES if s in stages]
+            line = f"{release}: {done[-1] if done else 'not built'}"
+            if "failed" in stages:
+                line += f", then failed ({stages['failed']['error']})"
+            lines.append(line)
+        return lines
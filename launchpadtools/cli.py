@@ -4,11 +4,219 @@
 Automatically create tarball and submit it to launchpad.
 """
 import argparse
+import contextlib
+import json
+import os
+import sys
+import tempfile
+
 import launchpadtools
 
 
-def _parse_cmd_arguments():
-    parser = argparse.ArgumentParser(description="Submit builds to launchpad.")
+def _add_cache_arguments(parser):
+    parser.add_argument(
+        "--cache-dir",
+        help="cache directory (default: ~/.cache/launchpadtools)",
+        type=str,
+        default=None,
+    )
+    parser.add_argument(
+        "--no-cache",
+        help="don't use or update the on-disk caches",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--publication-ttl",
+        help="seconds for which the cached list of the PPA's publications is used "
+        "without asking Launchpad (default: %(default)s)",
+        type=float,
+        default=launchpadtools.publications.DEFAULT_TTL,
+    )
+
+
+def _add_metrics_arguments(parser):
+    parser.add_argument(
+        "--metrics-json",
+        help="append timings and resource usage of all stages to FILE as JSON lines",
+        metavar="FILE",
+        type=str,
+        default=None,
+    )
+    parser.add_argument(
+        "--profile",
+        help="print the time spent per stage at the end",
+        action="store_true",
+        default=False,
+    )
+
+
+def _add_wait_arguments(parser):
+    parser.add_argument(
+        "--wait",
+        help="wait for Launchpad to build the uploads and fail if any build fails",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--wait-timeout",
+        help="seconds to wait for the builds at most (default: no limit)",
+        metavar="SECONDS",
+        type=float,
+        default=None,
+    )
+
+
+@contextlib.contextmanager
+def _metrics(args):
+    filename = args.metrics_json
+    tmp = None
+    if args.profile and filename is None:
+        fd, tmp = tempfile.mkstemp(prefix="launchpadtools-", suffix=".jsonl")
+        os.close(fd)
+        filename = tmp
+    launchpadtools.metrics.enable(filename)
+    try:
+        yield
+    finally:
+        launchpadtools.metrics.enable(None)
+        if args.profile:
+            launchpadtools.metrics.print_summary(launchpadtools.metrics.read(filename))
+        if tmp is not None:
+            os.remove(tmp)
+
+
+def _parse_batch_arguments(argv):
+    parser = argparse.ArgumentParser(
+        prog="launchpad-submit batch",
+        description="Submit all packages of a manifest to launchpad.",
+    )
+    parser.add_argument("manifest", help="TOML file describing the packages")
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        help="number of processes for hashing, tarballs, and builds "
+        "(default: number of CPUs)",
+        type=int,
+        default=None,
+    )
+    parser.add_argument(
+        "-n",
+        "--network-jobs",
+        help="number of concurrent Launchpad lookups and uploads (default: 4)",
+        type=int,
+        default=4,
+    )
+    parser.add_argument(
+        "--dry",
+        help="only create tarballs and changelogs; don't build or upload",
+        action="store_true",
+        default=False,
+    )
+    _add_wait_arguments(parser)
+    _add_cache_arguments(parser)
+    _add_metrics_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def _parse_wait_arguments(argv):
+    parser = argparse.ArgumentParser(
+        prog="launchpad-submit wait",
+        description="Wait for Launchpad to build the packages uploaded by earlier "
+        "runs, in one go for all PPAs.",
+    )
+    parser.add_argument("-p", "--ppa", help="only wait for the uploads to PPA")
+    parser.add_argument(
+        "-t",
+        "--timeout",
+        help="seconds to wait at most (default: no limit)",
+        metavar="SECONDS",
+        type=float,
+        default=None,
+    )
+    parser.add_argument(
+        "--json",
+        help="write the outcomes of the uploads to FILE as JSON",
+        metavar="FILE",
+        default=None,
+    )
+    parser.add_argument(
+        "--cache-dir",
+        help="cache directory (default: ~/.cache/launchpadtools)",
+        type=str,
+        default=None,
+    )
+    _add_metrics_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def _parse_daemon_arguments(argv):
+    parser = argparse.ArgumentParser(
+        prog="launchpad-submit daemon",
+        description="Watch the packages of a manifest and submit them on changes.",
+    )
+    parser.add_argument("manifest", help="TOML file describing the packages")
+    parser.add_argument(
+        "-i",
+        "--interval",
+        help="seconds between two scans of the source directories "
+        "(default: %(default)s)",
+        type=float,
+        default=launchpadtools.daemon.DEFAULT_INTERVAL,
+    )
+    parser.add_argument(
+        "--debounce",
+        help="seconds a source directory must not change before it is submitted "
+        "(default: %(default)s)",
+        type=float,
+        default=launchpadtools.daemon.DEFAULT_DEBOUNCE,
+    )
+    parser.add_argument(
+        "-m",
+        "--max-submissions",
+        help="number of packages submitted at the same time (default: %(default)s)",
+        type=int,
+        default=2,
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        help="number of processes for builds (default: number of CPUs)",
+        type=int,
+        default=None,
+    )
+    parser.add_argument(
+        "-n",
+        "--network-jobs",
+        help="number of concurrent Launchpad lookups and uploads (default: 4)",
+        type=int,
+        default=4,
+    )
+    parser.add_argument(
+        "--status-port",
+        help="serve the state of all packages as JSON on localhost:PORT",
+        metavar="PORT",
+        type=int,
+        default=None,
+    )
+    parser.add_argument(
+        "--dry",
+        help="only create tarballs and changelogs; don't build or upload",
+        action="store_true",
+        default=False,
+    )
+    _add_cache_arguments(parser)
+    _add_metrics_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def _parse_cmd_arguments(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Submit builds to launchpad.",
+        epilog="Use `launchpad-submit batch MANIFEST` to submit many packages at once, "
+        "`launchpad-submit daemon MANIFEST` to submit them whenever they change, "
+        "`launchpad-submit wait` to wait for the builds of earlier uploads.",
+    )
     parser.add_argument(
         "-d",
         "--directory",
@@ -47,6 +255,25 @@ def _parse_cmd_arguments():
         action="store_true",
         default=False,
     )
+    parser.add_argument(
+        "-x",
+        "--exclude",
+        help="leave paths matching the gitignore-style PATTERN out of the tree hash, "
+        "the tarball, and the source package, in addition to those in "
+        ".launchpadignore (can be given multiple times)",
+        metavar="PATTERN",
+        action="append",
+        default=[],
+    )
+    parser.add_argument(
+        "--component",
+        help="put the top-level directory NAME into a component tarball of its own "
+        "(can be given multiple times)",
+        metavar="NAME",
+        dest="components",
+        action="append",
+        default=[],
+    )
     parser.add_argument(
         "--update-patches",
         help="Automatically update patches",
@@ -67,27 +294,175 @@ def _parse_cmd_arguments():
         type=str,
         default="",
     )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        help="number of releases to build in parallel (default: 1)",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "--upload-jobs",
+        help="number of releases to upload in parallel while the next ones are "
+        "built (default: 1)",
+        metavar="N",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "--build-once",
+        help="run debuild (and lintian) for the first release only and derive the "
+        "source packages for all others from it",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "-c",
+        "--compression",
+        help="compression of the orig tarball; `auto` picks the codec and level "
+        "that are quickest to compress and upload, measured on the source "
+        "(default: gz; zst needs the zstd executable, and a dpkg that unpacks "
+        "zstd-compressed source packages in the target releases)",
+        choices=["gz", "xz", "zst", "auto"],
+        default="gz",
+    )
+    parser.add_argument(
+        "--compression-level",
+        help="compression level (default: 6 for gz and xz, 3 for zst)",
+        metavar="N",
+        type=int,
+    )
+    parser.add_argument(
+        "--compression-threads",
+        help="number of compression threads (default: number of CPUs)",
+        metavar="N",
+        type=int,
+    )
+    parser.add_argument(
+        "-w",
+        "--work-dir",
+        help="build in DIR instead of a temporary directory and keep it, with a "
+        "journal of the completed stages",
+        metavar="DIR",
+    )
+    parser.add_argument(
+        "--resume",
+        help="continue the submission in --work-dir where it failed or was "
+        "interrupted; stages whose files are unchanged are skipped",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--workspace",
+        help="keep a copy of the source in DIR that is synced on every run, so "
+        "that only changed files are copied and compressed; runs on the same "
+        "workspace wait for each other",
+        metavar="DIR",
+    )
+    _add_wait_arguments(parser)
+    _add_cache_arguments(parser)
+    _add_metrics_arguments(parser)
     parser.add_argument(
         "-v",
         "--version",
         action="version",
         version="launchpadtools %s" % launchpadtools.__version__,
     )
-    return parser.parse_args()
+    args = parser.parse_args(argv)
+    if args.resume and args.work_dir is None:
+        parser.error("--resume requires --work-dir")
+    if args.workspace is not None and args.work_dir is not None:
+        parser.error("--workspace and --work-dir exclude each other")
+    if args.compression == "auto" and args.compression_level is not None:
+        parser.error("--compression auto picks the level itself")
+    if args.build_once and args.jobs != 1:
+        parser.error("--build-once runs a single debuild, --jobs doesn't apply")
+    return args
 
 
-def main():
-    args = _parse_cmd_arguments()
-    launchpadtools.submit.submit(
-        args.directory,
-        args.ubuntu_releases,
-        args.ppa,
-        args.launchpad_login,
-        args.debuild_params,
-        args.version_override,
-        args.version_append_datetime,
-        args.version_append_hash,
-        args.force,
-        args.update_patches,
-    )
-    return
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+
+    if argv and argv[0] == "batch":
+        args = _parse_batch_arguments(argv[1:])
+        with _metrics(args):
+            reports = launchpadtools.batch.run(
+                args.manifest,
+                jobs=args.jobs,
+                network_jobs=args.network_jobs,
+                dry=args.dry,
+                cache_dir=args.cache_dir,
+                use_cache=not args.no_cache,
+                publication_ttl=args.publication_ttl,
+                wait=args.wait,
+                wait_timeout=args.wait_timeout,
+            )
+        return int(launchpadtools.batch.has_failures(reports))
+
+    if argv and argv[0] == "wait":
+        args = _parse_wait_arguments(argv[1:])
+        with _metrics(args):
+            journal = launchpadtools.cache.UploadJournal(args.cache_dir)
+            uploads = journal.get_uploads(args.ppa)
+            if not uploads:
+                print("No uploads to wait for.")
+                return 0
+            outcomes = launchpadtools.submit.wait_for_builds(
+                journal, uploads, timeout=args.timeout
+            )
+        if args.json is not None:
+            with open(args.json, "w") as f:
+                json.dump(outcomes, f, indent=2)
+        return int(launchpadtools.watch.has_failures(outcomes))
+
+    if argv and argv[0] == "daemon":
+        args = _parse_daemon_arguments(argv[1:])
+        with _metrics(args):
+            launchpadtools.daemon.run(
+                args.manifest,
+                interval=args.interval,
+                debounce=args.debounce,
+                max_submissions=args.max_submissions,
+                jobs=args.jobs,
+                network_jobs=args.network_jobs,
+                dry=args.dry,
+                cache_dir=args.cache_dir,
+                use_cache=not args.no_cache,
+                publication_ttl=args.publication_ttl,
+                status_port=args.status_port,
+            )
+        return 0
+
+    args = _parse_cmd_arguments(argv)
+    with _metrics(args):
+        results = launchpadtools.submit.submit(
+            args.directory,
+            args.ubuntu_releases,
+            args.ppa,
+            args.launchpad_login,
+            args.debuild_params,
+            args.version_override,
+            args.version_append_datetime,
+            args.version_append_hash,
+            args.force,
+            args.update_patches,
+            cache_dir=args.cache_dir,
+            use_cache=not args.no_cache,
+            jobs=args.jobs,
+            build_once=args.build_once,
+            publication_ttl=args.publication_ttl,
+            exclude_patterns=args.exclude,
+            work_dir=args.work_dir,
+            resume=args.resume,
+            compression=args.compression,
+            compression_level=args.compression_level,
+            compression_threads=args.compression_threads,
+            components=args.components,
+            workspace=args.workspace,
+            wait=args.wait,
+            wait_timeout=args.wait_timeout,
+            upload_jobs=args.upload_jobs,
+        )
+    # non-zero exit code if any release failed
+    return int(any(error is not None for error in results.values()))
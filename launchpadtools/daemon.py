@@ -0,0 +1,408 @@
+# -*- coding: utf-8 -*-
+#
+"""
+Long-running submission of the packages of a batch manifest (see `batch`) whenever
+their sources change:
+
+    launchpad-submit daemon packages.toml --status-port 8765
+
+The source directories are polled for changes in the stat data of the files that
+make up the tree hash, so no file is read unless something has changed. Once a
+tree has been quiet for the debounce time, its package is submitted to the
+releases that lack its tree hash. The hash cache, the publication indices, the
+SFTP connections, and the worker processes are kept between submissions, and at
+most `max_submissions` packages are submitted at the same time.
+
+`GET /` on the status port returns the queue depth and the last runs of all
+packages as JSON.
+"""
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import http.server
+import json
+import os
+import shutil
+import signal
+import tempfile
+import threading
+import time
+
+from . import batch, ignore, metrics, publications, submit, treehash, upload
+from .cache import HashCache, UploadJournal
+
+# seconds between two scans of the source directories
+DEFAULT_INTERVAL = 10.0
+# seconds a tree must not change before it is submitted
+DEFAULT_DEBOUNCE = 30.0
+
+
+def _init_worker(metrics_filename):
+    # Ctrl-C and service managers signal the whole process group. The workers
+    # leave it to the daemon to stop; a handler (unlike SIG_IGN) isn't inherited
+    # by the build tools.
+    for signum in [signal.SIGINT, signal.SIGTERM]:
+        signal.signal(signum, lambda *args: None)
+    metrics.enable(metrics_filename)
+
+
+def get_signature(directory, matcher=None):
+    """Returns a digest of the stat data of all files in `directory` that go into
+    the tree hash. Only directories are read.
+    """
+    return treehash.collect(directory, matcher=matcher).compute_signature()
+
+
+class Daemon:
+    """Keeps track of the source directories of the manifest `entries` and submits
+    their packages. `poll()` finds the packages due for submission, `start()`
+    submits them in the background.
+    """
+
+    def __init__(
+        self,
+        entries,
+        jobs=None,
+        network_jobs=4,
+        max_submissions=2,
+        debounce=DEFAULT_DEBOUNCE,
+        dry=False,
+        cache_dir=None,
+        use_cache=True,
+        publication_ttl=publications.DEFAULT_TTL,
+    ):
+        self.entries = entries
+        self.debounce = debounce
+        self.dry = dry
+        self.cache_dir = cache_dir
+        self.use_cache = use_cache
+        self.publication_ttl = publication_ttl
+
+        self.lock = threading.Lock()
+        self.signatures = [None] * len(entries)
+        # time of the last change that hasn't been submitted yet
+        self.changed = [None] * len(entries)
+        # "idle", "waiting", "queued", or "running"
+        self.states = ["idle"] * len(entries)
+        self.runs = [0] * len(entries)
+        self.last_runs = [None] * len(entries)
+        self.futures = []
+
+        # Hashing happens in this process, so the hashes stay in memory.
+        self.hash_cache = HashCache(cache_dir) if use_cache else None
+        self.hash_lock = threading.Lock()
+        self.journal = UploadJournal(cache_dir, persistent=use_cache)
+        self.indices = {}
+        self.uploaders = {}
+        # number of running submissions per PPA connection
+        self.open_uploads = {}
+
+        self.cpu_pool = ProcessPoolExecutor(
+            max_workers=jobs,
+            initializer=_init_worker,
+            initargs=(metrics.get_filename(),),
+        )
+        self.network_pool = ThreadPoolExecutor(max_workers=network_jobs)
+        self.runner = ThreadPoolExecutor(max_workers=max_submissions)
+
+    def poll(self, now=None):
+        """Scans all source directories and returns the indices of the packages to
+        submit now, i.e., those whose sources changed and have been quiet for the
+        debounce time since. All packages are due on the first call.
+        """
+        if now is None:
+            now = time.time()
+        due = []
+        for k, entry in enumerate(self.entries):
+            matcher = ignore.read_excludes(entry["directory"], entry["exclude"])
+            try:
+                signature = get_signature(entry["directory"], matcher)
+            except OSError as e:
+                # e.g., a file removed during the scan; try again next time
+                print(f"Cannot scan {entry['directory']}: {e}")
+                continue
+
+            with self.lock:
+                if signature != self.signatures[k]:
+                    # Every change restarts the debounce time, except for the
+                    # initial scan.
+                    first = self.signatures[k] is None
+                    self.changed[k] = now - self.debounce if first else now
+                    self.signatures[k] = signature
+                if self.changed[k] is None or self.states[k] in ["queued", "running"]:
+                    continue
+                if now - self.changed[k] < self.debounce:
+                    self.states[k] = "waiting"
+                    continue
+                self.states[k] = "queued"
+                self.changed[k] = None
+                due.append(k)
+        return due
+
+    def start(self, k):
+        """Submits package `k` in the background."""
+        self.futures.append(self.runner.submit(self._run, k))
+        self.futures = [f for f in self.futures if not f.done()]
+
+    def _run(self, k):
+        entry = self.entries[k]
+        tic = time.time()
+        with self.lock:
+            self.states[k] = "running"
+        report = {
+            "directory": entry["directory"],
+            "ppa": entry["ppa"],
+            "status": None,
+            "results": {},
+            "error": None,
+            "elapsed_time": None,
+        }
+        work_dir = tempfile.mkdtemp(prefix="launchpadtools-")
+        try:
+            report["status"], report["results"] = self._submit(entry, work_dir)
+        except Exception as e:
+            # Keep watching.
+            report["error"] = e
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        report["elapsed_time"] = time.time() - tic
+        batch.print_summary([report])
+        self._done(k, tic, report)
+        return report
+
+    def _done(self, k, tic, report):
+        with self.lock:
+            self.states[k] = "idle"
+            self.runs[k] += 1
+            self.last_runs[k] = {
+                "start": tic,
+                "end": tic + report["elapsed_time"],
+                "status": "failed" if batch.has_failures([report]) else report["status"],
+                "error": _format_error(report["error"]),
+                "results": {
+                    release: _format_error(error)
+                    for release, error in report["results"].items()
+                },
+            }
+
+    def _submit(self, entry, work_dir):
+        """Runs the stages of `batch` for one package. Returns the status and the
+        results per release.
+        """
+        with self.hash_lock:
+            package = batch._prepare(
+                entry, work_dir, self.cache_dir, self.use_cache, self.hash_cache
+            )
+
+        releases = entry["ubuntu_releases"]
+        on_ppa = None
+        if not entry["force"]:
+            index = self._get_index(entry, package["name"])
+            releases, on_ppa = self.network_pool.submit(
+                batch._check, index, entry, package, self.dry
+            ).result()
+        if not releases:
+            return "up-to-date", {}
+
+        log_file = os.path.join(work_dir, "build.log")
+        future = self.cpu_pool.submit(
+            submit.run_logged,
+            log_file,
+            batch._build,
+            entry,
+            package,
+            releases,
+            on_ppa,
+            work_dir,
+            self.cache_dir,
+            self.use_cache,
+            self.dry,
+        )
+        try:
+            results, uploads = future.result()
+        finally:
+            if os.path.exists(log_file):
+                with open(log_file) as f:
+                    print(f"==> {entry['directory']} <==")
+                    print(f.read())
+
+        login = entry["launchpad_login"]
+        key = (login, entry["ppa"])
+        with self.lock:
+            self.open_uploads[key] = self.open_uploads.get(key, 0) + 1
+        try:
+            uploader = self._get_uploader(login)
+            futures = [
+                (
+                    release,
+                    self.network_pool.submit(
+                        batch._upload,
+                        uploader,
+                        self.journal,
+                        entry,
+                        package,
+                        release,
+                        release_work_dir,
+                        chlog_version,
+                    ),
+                )
+                for release, release_work_dir, chlog_version in uploads
+            ]
+            for release, f in futures:
+                _, results[release] = f.result()
+        finally:
+            with self.lock:
+                self.open_uploads[key] -= 1
+                # Launchpad processes the uploads once the connection is closed.
+                if self.open_uploads[key] == 0 and login in self.uploaders:
+                    self.uploaders[login].close(entry["ppa"])
+        return "submitted", results
+
+    def _get_index(self, entry, name):
+        key = (entry["ppa"], name)
+        with self.lock:
+            if key not in self.indices:
+                self.indices[key] = publications.PublicationIndex(
+                    entry["ppa"],
+                    name,
+                    cache_dir=self.cache_dir,
+                    ttl=self.publication_ttl,
+                    persistent=self.use_cache,
+                )
+            index = self.indices[key]
+        # Ask Launchpad again once the TTL has passed.
+        index.expire()
+        return index
+
+    def _get_uploader(self, login):
+        with self.lock:
+            if login not in self.uploaders:
+                self.uploaders[login] = upload.Uploader(login)
+            return self.uploaders[login]
+
+    def status(self):
+        """Returns the queue depth and the state of all packages as a JSON-compatible
+        dictionary.
+        """
+        with self.lock:
+            packages = [
+                {
+                    "directory": entry["directory"],
+                    "ppa": entry["ppa"],
+                    "state": self.states[k],
+                    "changed": self.changed[k],
+                    "runs": self.runs[k],
+                    "last_run": self.last_runs[k],
+                }
+                for k, entry in enumerate(self.entries)
+            ]
+        return {
+            "time": time.time(),
+            "queue_depth": sum(p["state"] == "queued" for p in packages),
+            "running": sum(p["state"] == "running" for p in packages),
+            "packages": packages,
+        }
+
+    def run(self, interval=DEFAULT_INTERVAL, stop=None):
+        """Polls every `interval` seconds until `stop` (a `threading.Event`) is set.
+        """
+        if stop is None:
+            stop = threading.Event()
+        while not stop.is_set():
+            for k in self.poll():
+                self.start(k)
+            stop.wait(interval)
+
+    def close(self):
+        """Waits for the running submissions; queued ones are dropped."""
+        for future in self.futures:
+            future.cancel()
+        self.runner.shutdown()
+        self.network_pool.shutdown()
+        self.cpu_pool.shutdown()
+        for uploader in self.uploaders.values():
+            uploader.close()
+        if self.hash_cache is not None:
+            self.hash_cache.close()
+
+
+def _format_error(error):
+    if error is None:
+        return None
+    return f"{type(error).__name__}: {error}"
+
+
+class _StatusHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path not in ["/", "/status"]:
+            self.send_error(404)
+            return
+        body = json.dumps(self.server.get_status(), indent=2).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        # Don't clutter the output with every request.
+        pass
+
+
+def serve_status(daemon, port, host="127.0.0.1"):
+    """Serves `daemon.status()` on `http://host:port/` from a background thread.
+    Returns the server; stop it with `shutdown()`.
+    """
+    server = http.server.ThreadingHTTPServer((host, port), _StatusHandler)
+    server.get_status = daemon.status
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def run(
+    manifest,
+    interval=DEFAULT_INTERVAL,
+    debounce=DEFAULT_DEBOUNCE,
+    max_submissions=2,
+    jobs=None,
+    network_jobs=4,
+    dry=False,
+    cache_dir=None,
+    use_cache=True,
+    publication_ttl=publications.DEFAULT_TTL,
+    status_port=None,
+):
+    """Watches the packages of the manifest and submits them on changes until
+    interrupted (SIGINT or SIGTERM).
+    """
+    entries = batch.load_manifest(manifest)
+    if threading.current_thread() is threading.main_thread():
+        # Stop as cleanly on SIGTERM as on Ctrl-C.
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+
+    daemon = Daemon(
+        entries,
+        jobs=jobs,
+        network_jobs=network_jobs,
+        max_submissions=max_submissions,
+        debounce=debounce,
+        dry=dry,
+        cache_dir=cache_dir,
+        use_cache=use_cache,
+        publication_ttl=publication_ttl,
+    )
+    server = None
+    try:
+        if status_port is not None:
+            server = serve_status(daemon, status_port)
+            host, port = server.server_address[:2]
+            print(f"Status on http://{host}:{port}/")
+        print(f"Watching {len(entries)} package(s)...")
+        daemon.run(interval)
+    except KeyboardInterrupt:
+        print("\nStopping after the running submissions...")
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+        daemon.close()
+    return
@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+#
+"""
+Matching of gitignore-style patterns.
+"""
+import os
+import re
+
+# Patterns of paths that are left out of the submission entirely, relative to the
+# root of the source tree
+LAUNCHPADIGNORE = ".launchpadignore"
+
+
+def _translate(pattern):
+    """Translates a single gitignore glob into a regular expression string. The
+    expression is meant to be matched against slash-separated paths relative to
+    the directory the pattern belongs to.
+    """
+    anchored = "/" in pattern
+    pattern = pattern.lstrip("/")
+
+    out = ""
+    i = 0
+    n = len(pattern)
+    while i < n:
+        c = pattern[i]
+        if pattern.startswith("**", i):
+            at_start = i == 0 or pattern[i - 1] == "/"
+            j = i + 2
+            if at_start and j < n and pattern[j] == "/":
+                # `**/`: zero or more leading directories
+                out += "(?:.*/)?"
+                i = j + 1
+                continue
+            if at_start and j == n:
+                # trailing `/**`: everything inside
+                out += ".*"
+                i = j
+                continue
+            # Other consecutive asterisks are regular asterisks.
+            out += "[^/]*"
+            while i < n and pattern[i] == "*":
+                i += 1
+            continue
+        if c == "*":
+            out += "[^/]*"
+        elif c == "?":
+            out += "[^/]"
+        elif c == "\\" and i + 1 < n:
+            i += 1
+            out += re.escape(pattern[i])
+        elif c == "[":
+            j = i + 1
+            if j < n and pattern[j] in "!^":
+                j += 1
+            if j < n and pattern[j] == "]":
+                j += 1
+            while j < n and pattern[j] != "]":
+                j += 1
+            if j >= n:
+                out += "\\["
+            else:
+                stuff = pattern[i + 1 : j].replace("\\", "\\\\")
+                if stuff[0] in "!^":
+                    stuff = "^" + stuff[1:]
+                out += f"(?!/)[{stuff}]"
+                i = j
+        else:
+            out += re.escape(c)
+        i += 1
+
+    if not anchored:
+        out = "(?:.*/)?" + out
+    return out
+
+
+def _strip_trailing_spaces(line):
+    # Trailing spaces are ignored unless they are quoted with a backslash.
+    stripped = line.rstrip(" ")
+    if stripped.endswith("\\") and len(stripped) < len(line):
+        stripped += " "
+    return stripped
+
+
+class Rule:
+    def __init__(self, line):
+        self.negate = line.startswith("!")
+        if self.negate:
+            line = line[1:]
+        elif line.startswith("\\!") or line.startswith("\\#"):
+            line = line[1:]
+
+        self.dir_only = line.endswith("/")
+        line = line.rstrip("/")
+        self.pattern = line
+        self.expression = _translate(line)
+        self._regex = re.compile(self.expression + "\\Z", re.DOTALL)
+
+    def match(self, path, is_dir):
+        if self.dir_only and not is_dir:
+            return False
+        return self._regex.match(path) is not None
+
+
+def parse_lines(lines):
+    """Compiles the lines of a gitignore file into a list of rules.
+    """
+    rules = []
+    for line in lines:
+        line = _strip_trailing_spaces(line.rstrip("\n").rstrip("\r"))
+        if not line or line.startswith("#"):
+            continue
+        if line in ["!", "/"]:
+            continue
+        rules.append(Rule(line))
+    return rules
+
+
+def read_ignore_file(filename):
+    if not os.path.isfile(filename):
+        return []
+    with open(filename, "r", encoding="utf-8", errors="surrogateescape") as handle:
+        return parse_lines(handle)
+
+
+class IgnoreStack:
+    """Hierarchy of rule sets as met while walking down a directory tree, with
+    git's precedence: Patterns in deeper directories take precedence over those in
+    higher directories, and within one set the last matching pattern decides.
+
+    `base` is the slash-separated path (relative to the root of the walk) of the
+    directory the rules were read in, `""` for the root.
+    """
+
+    def __init__(self, levels=None):
+        self.levels = levels or []
+
+    def push(self, base, rules):
+        if not rules:
+            return self
+        return IgnoreStack(self.levels + [(base, rules)])
+
+    def is_ignored(self, path, is_dir):
+        for base, rules in reversed(self.levels):
+            if base:
+                if not path.startswith(base + "/"):
+                    continue
+                rel = path[len(base) + 1 :]
+            else:
+                rel = path
+            for rule in reversed(rules):
+                if rule.match(rel, is_dir):
+                    return not rule.negate
+        return False
+
+
+class Matcher:
+    """Rules of a single gitignore file, compiled for fast matching: Consecutive
+    rules of the same kind (excluding or re-including) are joined into one regular
+    expression, one for files and one for directories. A lookup therefore costs
+    as many regex matches as there are changes between `!` and plain rules, no
+    matter how many rules there are. As in git, the last matching rule decides.
+    """
+
+    def __init__(self, rules=()):
+        rules = list(rules)
+        self.patterns = [("!" if r.negate else "") + r.pattern for r in rules]
+        self._key = [
+            p + ("/" if r.dir_only else "") for p, r in zip(self.patterns, rules)
+        ]
+        self._groups = []
+        k = 0
+        while k < len(rules):
+            negate = rules[k].negate
+            group = []
+            while k < len(rules) and rules[k].negate == negate:
+                group.append(rules[k])
+                k += 1
+            self._groups.append(
+                (
+                    negate,
+                    _compile_any([r for r in group if not r.dir_only]),
+                    _compile_any(group),
+                )
+            )
+        # Lookups go from the last rule to the first.
+        self._groups.reverse()
+
+    def __bool__(self):
+        return bool(self._groups)
+
+    def match(self, path, is_dir):
+        for negate, file_regex, dir_regex in self._groups:
+            regex = dir_regex if is_dir else file_regex
+            if regex is not None and regex.match(path) is not None:
+                return not negate
+        return False
+
+    def get_key(self):
+        """Returns the rules in a JSON-compatible form, e.g., for cache keys."""
+        return self._key
+
+
+def _compile_any(rules):
+    if not rules:
+        return None
+    expression = "|".join(f"(?:{r.expression})" for r in rules)
+    return re.compile(f"(?:{expression})\\Z", re.DOTALL)
+
+
+def read_excludes(directory, patterns=()):
+    """Returns a `Matcher` for the paths (relative to `directory`) to leave out of
+    the submission: The patterns in `.launchpadignore` at the top of `directory`,
+    followed by `patterns`, which thus take precedence.
+
+    Unlike with `.gitignore`, only the file at the top is read.
+    """
+    rules = read_ignore_file(os.path.join(directory, LAUNCHPADIGNORE))
+    return Matcher(rules + parse_lines(patterns))
@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+#
+"""
+Timing and resource usage of the stages of a submission.
+
+Code to be measured runs in `with metrics.stage(name) as s:`. A stage records its
+wall time, its CPU time (of this process and of the subprocesses it waited for),
+the bytes this process read and wrote, and whatever is passed to `s.add()` or
+`s.set()`, e.g., file counts. Commands run through `check_call()` and
+`check_output()` are stages of their own.
+
+Nothing is written unless `enable()` has been called; the records then go as JSON
+lines to a file. Worker processes append to the same file.
+"""
+import contextlib
+import json
+import os
+import resource
+import subprocess
+import threading
+import time
+
+_filename = None
+_local = threading.local()
+
+
+def enable(filename):
+    """Appends the records of all stages to `filename` from now on. `None`
+    disables the output.
+    """
+    global _filename
+    _filename = None if filename is None else os.path.abspath(filename)
+    return
+
+
+def get_filename():
+    return _filename
+
+
+def _get_local(attr):
+    if not hasattr(_local, attr):
+        setattr(_local, attr, [])
+    return getattr(_local, attr)
+
+
+@contextlib.contextmanager
+def context(**fields):
+    """Adds `fields` (e.g., `package`, `release`) to the records of all stages of
+    this thread within the block.
+    """
+    contexts = _get_local("contexts")
+    contexts.append(fields)
+    try:
+        yield
+    finally:
+        contexts.pop()
+
+
+def get_context():
+    """Returns the fields of the contexts of this thread, e.g., to carry them over
+    to a worker thread.
+    """
+    fields = {}
+    for c in _get_local("contexts"):
+        fields.update(c)
+    return fields
+
+
+def _get_io():
+    """Returns the number of bytes this process has read and written so far, or
+    `None` if the platform doesn't tell.
+    """
+    try:
+        with open("/proc/self/io", "r") as handle:
+            values = dict(line.split(":") for line in handle)
+    except OSError:
+        return None
+    return int(values["rchar"]), int(values["wchar"])
+
+
+def _get_children_cpu_time():
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+class Stage:
+    def __init__(self, name, kind, fields):
+        self.name = name
+        self.kind = kind
+        self.fields = dict(fields)
+        self._start = time.perf_counter()
+        self._end = None
+
+    @property
+    def elapsed_time(self):
+        end = time.perf_counter() if self._end is None else self._end
+        return end - self._start
+
+    def add(self, key, value=1):
+        """Adds `value` to the count `key`."""
+        self.fields[key] = self.fields.get(key, 0) + value
+
+    def set(self, **fields):
+        self.fields.update(fields)
+
+
+def _write(record):
+    # A single write with O_APPEND, so lines from concurrent writers don't mix.
+    line = (json.dumps(record) + "\n").encode("utf-8")
+    fd = os.open(_filename, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, line)
+    finally:
+        os.close(fd)
+
+
+@contextlib.contextmanager
+def _measure(name, kind, fields):
+    stages = _get_local("stages")
+    parent = stages[-1].name if stages else None
+    start = time.time()
+    cpu_time = time.process_time()
+    children_cpu_time = _get_children_cpu_time()
+    io = _get_io()
+
+    s = Stage(name, kind, fields)
+    stages.append(s)
+    try:
+        yield s
+    except BaseException as e:
+        s.set(error=type(e).__name__)
+        raise
+    finally:
+        s._end = time.perf_counter()
+        stages.pop()
+        if _filename is not None:
+            record = {"kind": kind, "name": name, "parent": parent, "pid": os.getpid()}
+            for c in _get_local("contexts"):
+                record.update(c)
+            record.update(
+                {
+                    "start": start,
+                    "wall_time": s.elapsed_time,
+                    "cpu_time": time.process_time() - cpu_time,
+                    "children_cpu_time": _get_children_cpu_time() - children_cpu_time,
+                }
+            )
+            if io is not None:
+                read, written = _get_io()
+                record["read_bytes"] = read - io[0]
+                record["write_bytes"] = written - io[1]
+            record.update(s.fields)
+            _write(record)
+
+
+def stage(name, **fields):
+    """Context manager measuring the enclosed block as stage `name`. Yields a
+    `Stage` to which counts and other fields can be added.
+    """
+    return _measure(name, "stage", fields)
+
+
+def _run(function, args, kwargs):
+    with _measure(os.path.basename(args[0]), "subprocess", {}) as s:
+        s.set(args=[str(a) for a in args])
+        try:
+            return function(args, **kwargs)
+        except subprocess.CalledProcessError as e:
+            s.set(returncode=e.returncode)
+            raise
+
+
+def check_call(args, **kwargs):
+    """`subprocess.check_call()`, recorded as a stage named after the command."""
+    return _run(subprocess.check_call, args, kwargs)
+
+
+def check_output(args, **kwargs):
+    """`subprocess.check_output()`, recorded as a stage named after the command."""
+    return _run(subprocess.check_output, args, kwargs)
+
+
+def read(filename):
+    """Returns the records in `filename`."""
+    with open(filename, "r") as handle:
+        return [json.loads(line) for line in handle if line.strip()]
+
+
+def print_summary(records):
+    """Prints the number of runs and the total wall and CPU time per stage, in the
+    order in which the stages first finished.
+    """
+    totals = {}
+    for r in records:
+        key = (r["kind"], r["name"])
+        if key not in totals:
+            totals[key] = [0, 0.0, 0.0]
+        totals[key][0] += 1
+        totals[key][1] += r["wall_time"]
+        totals[key][2] += r["cpu_time"] + r["children_cpu_time"]
+
+    print("\nProfile:")
+    print("    {:<24} {:>6} {:>10} {:>10}".format("stage", "runs", "wall", "cpu"))
+    for (kind, name), (count, wall_time, cpu_time) in totals.items():
+        if kind == "subprocess":
+            name = f"$ {name}"
+        print(f"    {name:<24} {count:>6} {wall_time:>9.2f}s {cpu_time:>9.2f}s")
+    print()
+    return
@@ -0,0 +1,518 @@
+# -*- coding: utf-8 -*-
+#
+"""
+Refreshing the quilt patches of a package without quilt.
+
+`update_patches()` does in one process what `quilt push` and `quilt refresh` for
+every patch followed by `quilt pop -a` do: The patches in `debian/patches/series`
+are applied one after another, with fuzz like patch(1) does it, to an in-memory
+copy of the files they touch. Patches that only apply with fuzz or offset are
+rewritten so that they apply exactly; patches that don't apply at all are
+removed. The tree itself is left as it is.
+
+Patches with content this doesn't understand (binary diffs, renames, copies)
+raise `UnsupportedPatchError`; quilt has to deal with those.
+"""
+import difflib
+import os
+import re
+
+# Maximum fuzz, the default of patch(1)
+MAX_FUZZ = 2
+
+_CONTEXT = 3
+
+_HUNK_HEADER = re.compile(rb"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+
+# Lines that belong to the header of a file's diff rather than to the description
+_FILE_HEADER = re.compile(
+    rb"^(Index: |diff |=+\s*$|index |new file mode |deleted file mode |"
+    rb"old mode |new mode )"
+)
+_UNSUPPORTED = re.compile(
+    rb"^(GIT binary patch|Binary files |rename from |rename to |copy from |"
+    rb"copy to |similarity index )"
+)
+
+_NO_NEWLINE = b"\\ No newline at end of file\n"
+
+
+class PatchError(Exception):
+    pass
+
+
+class UnsupportedPatchError(Exception):
+    pass
+
+
+def read_series(patches_dir):
+    """Returns the patches of `patches_dir/series` as a list of tuples of name,
+    strip level (`-pN`), and whether the patch is reversed (`-R`).
+    """
+    series = os.path.join(patches_dir, "series")
+    if not os.path.isfile(series):
+        return []
+    patches = []
+    with open(series, "r") as handle:
+        for line in handle:
+            parts = line.split("#", 1)[0].split()
+            if not parts:
+                continue
+            strip = 1
+            reverse = False
+            for option in parts[1:]:
+                if option.startswith("-p") and option[2:].isdigit():
+                    strip = int(option[2:])
+                elif option == "-R":
+                    reverse = True
+                else:
+                    raise UnsupportedPatchError(
+                        f"Unknown option {option} for patch {parts[0]}"
+                    )
+            patches.append((parts[0], strip, reverse))
+    return patches
+
+
+def _split_lines(data):
+    """Splits at newlines only (not at carriage returns), keeping them."""
+    parts = data.split(b"\n")
+    lines = [part + b"\n" for part in parts[:-1]]
+    if parts[-1]:
+        lines.append(parts[-1])
+    return lines
+
+
+class _Hunk:
+    def __init__(self, old_start, new_start, lines):
+        self.old_start = old_start
+        self.new_start = new_start
+        # list of (b" ", b"-", or b"+", line)
+        self.lines = lines
+
+    def get_old(self):
+        return [line for op, line in self.lines if op != b"+"]
+
+    def get_new(self):
+        return [line for op, line in self.lines if op != b"-"]
+
+    def get_context(self):
+        """Returns the number of context lines before and after the changes."""
+        ops = [op for op, _ in self.lines]
+        prefix = 0
+        while prefix < len(ops) and ops[prefix] == b" ":
+            prefix += 1
+        suffix = 0
+        while suffix < len(ops) - prefix and ops[-1 - suffix] == b" ":
+            suffix += 1
+        return prefix, suffix
+
+    def reversed(self):
+        swap = {b" ": b" ", b"-": b"+", b"+": b"-"}
+        return _Hunk(
+            self.new_start, self.old_start, [(swap[op], line) for op, line in self.lines]
+        )
+
+
+class _FileDiff:
+    def __init__(self, header, old_name, new_name, hunks):
+        # the lines up to and including `+++ ...`
+        self.header = header
+        self.old_name = old_name
+        self.new_name = new_name
+        self.hunks = hunks
+
+
+def _get_name(line):
+    name = line[4:].rstrip(b"\r\n").split(b"\t", 1)[0]
+    if name.startswith(b'"') and name.endswith(b'"'):
+        name = name[1:-1]
+    return name.decode("utf-8", "surrogateescape")
+
+
+def _parse_hunk(lines, k, header_line):
+    out = _HUNK_HEADER.match(header_line)
+    if out is None:
+        raise PatchError(f"Malformed hunk header {header_line!r}")
+    old_start = int(out.group(1))
+    old_len = 1 if out.group(2) is None else int(out.group(2))
+    new_start = int(out.group(3))
+    new_len = 1 if out.group(4) is None else int(out.group(4))
+
+    hunk_lines = []
+    while old_len > 0 or new_len > 0:
+        if k >= len(lines):
+            raise PatchError("Unexpected end of patch in hunk")
+        line = lines[k]
+        k += 1
+        # Some editors strip the space of empty context lines.
+        op = line[:1] if line not in (b"\n", b"\r\n") else b" "
+        content = line[1:] if line not in (b"\n", b"\r\n") else line
+        if op == b" ":
+            old_len -= 1
+            new_len -= 1
+        elif op == b"-":
+            old_len -= 1
+        elif op == b"+":
+            new_len -= 1
+        else:
+            raise PatchError(f"Malformed hunk line {line!r}")
+        if old_len < 0 or new_len < 0:
+            raise PatchError("Hunk longer than its header says")
+        hunk_lines.append([op, content])
+        # The marker may follow any line, also the last one.
+        if k < len(lines) and lines[k].startswith(b"\\ "):
+            hunk_lines[-1][1] = content.rstrip(b"\n")
+            k += 1
+    return _Hunk(old_start, new_start, [tuple(x) for x in hunk_lines]), k
+
+
+def parse_patch(data):
+    """Parses a patch into its description (the lines before the first file
+    diff), the list of file diffs, and the lines after the last one.
+    """
+    lines = _split_lines(data)
+    description = None
+    files = []
+    pending = []
+    k = 0
+    while k < len(lines):
+        line = lines[k]
+        if _UNSUPPORTED.match(line) or (
+            # context diff
+            line.startswith(b"*** ")
+            and k + 1 < len(lines)
+            and lines[k + 1].startswith(b"--- ")
+        ):
+            raise UnsupportedPatchError(f"Unsupported patch content: {line!r}")
+        is_file_start = (
+            line.startswith(b"--- ")
+            and k + 2 < len(lines)
+            and lines[k + 1].startswith(b"+++ ")
+            and lines[k + 2].startswith(b"@@ ")
+        )
+        if not is_file_start:
+            if line.startswith(b"@@ "):
+                raise UnsupportedPatchError(f"Hunk without file header: {line!r}")
+            pending.append(line)
+            k += 1
+            continue
+
+        split = 0
+        if description is None:
+            # Header lines like `Index:` or `diff` directly before `---` belong to
+            # the file diff, everything else to the description.
+            split = len(pending)
+            while split > 0 and _FILE_HEADER.match(pending[split - 1]):
+                split -= 1
+            description = pending[:split]
+        header = pending[split:] + lines[k : k + 2]
+        old_name = _get_name(lines[k])
+        new_name = _get_name(lines[k + 1])
+        k += 2
+
+        hunks = []
+        while k < len(lines) and lines[k].startswith(b"@@ "):
+            hunk, k = _parse_hunk(lines, k + 1, lines[k])
+            hunks.append(hunk)
+        files.append(_FileDiff(header, old_name, new_name, hunks))
+        pending = []
+
+    if description is None:
+        description = pending
+        pending = []
+    return description, files, pending
+
+
+def _strip(name, strip):
+    if name == "/dev/null":
+        return None
+    components = [c for c in name.split("/") if c]
+    if len(components) <= strip:
+        raise PatchError(f"Cannot strip {strip} components from {name}")
+    components = components[strip:]
+    if ".." in components:
+        raise PatchError(f"Refusing path outside of the tree: {name}")
+    return "/".join(components)
+
+
+class _Tree:
+    """Files of `directory` as lists of lines, read on first access and changed
+    only in memory.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.files = {}
+
+    def get(self, path):
+        """Returns the lines of `path`, or `None` if there's no such file."""
+        if path not in self.files:
+            try:
+                with open(os.path.join(self.directory, path), "rb") as handle:
+                    self.files[path] = _split_lines(handle.read())
+            except (FileNotFoundError, NotADirectoryError, IsADirectoryError):
+                self.files[path] = None
+        return self.files[path]
+
+
+def _match(lines, pattern, position):
+    return lines[position : position + len(pattern)] == pattern
+
+
+def _locate_hunk(lines, hunk, first_guess, min_position, fuzz):
+    """Returns where the old lines of `hunk`, without `prefix_fuzz` lines at the
+    start and `suffix_fuzz` lines at the end, match in `lines`, searching outwards
+    from `first_guess`, but not before `min_position`. Follows `locate_hunk()` of
+    GNU patch. Returns a tuple of the position and the two fuzz values, or `None`.
+    """
+    old = hunk.get_old()
+    prefix_context, suffix_context = hunk.get_context()
+    context = max(prefix_context, suffix_context)
+    prefix_fuzz = fuzz + prefix_context - context
+    suffix_fuzz = fuzz + suffix_context - context
+
+    def matches(position, prefix, suffix):
+        pattern = old[prefix : len(old) - suffix]
+        return position + prefix >= min_position and _match(
+            lines, pattern, position + prefix
+        )
+
+    if prefix_fuzz < 0 and hunk.old_start <= 1:
+        # Can only match at the start of the file.
+        if suffix_fuzz < 0 and len(old) != len(lines):
+            # Can only match the entire file.
+            return None
+        if matches(0, 0, max(suffix_fuzz, 0)):
+            return 0, 0, max(suffix_fuzz, 0)
+        return None
+    prefix_fuzz = max(prefix_fuzz, 0)
+
+    if suffix_fuzz < 0:
+        # Can only match at the end of the file.
+        position = len(lines) - len(old)
+        if position >= 0 and matches(position, prefix_fuzz, 0):
+            return position, prefix_fuzz, 0
+        return None
+
+    max_offset = max(first_guess - min_position, len(lines) - first_guess)
+    for offset in range(max_offset + 1):
+        for position in [first_guess + offset, first_guess - offset]:
+            if position < 0 or position + len(old) - suffix_fuzz > len(lines):
+                continue
+            if matches(position, prefix_fuzz, suffix_fuzz):
+                return position, prefix_fuzz, suffix_fuzz
+            if offset == 0:
+                break
+    return None
+
+
+def _apply_hunks(lines, hunks, max_fuzz):
+    """Returns the patched lines and whether any hunk needed fuzz or an offset."""
+    lines = list(lines)
+    inexact = False
+    # lines added minus lines removed by the hunks so far
+    delta = 0
+    # how far off the line numbers of the hunks so far were
+    offset = 0
+    min_position = 0
+    for hunk in hunks:
+        old_len = len(hunk.get_old())
+        # Hunks that only add lines start after the line they name.
+        expected = hunk.old_start - 1 if old_len else hunk.old_start
+        first_guess = max(expected + delta + offset, 0)
+        context = max(hunk.get_context())
+        for fuzz in range(min(max_fuzz, context) + 1):
+            found = _locate_hunk(lines, hunk, first_guess, min_position, fuzz)
+            if found is not None:
+                break
+        if found is None:
+            raise PatchError(f"Hunk at line {hunk.old_start} doesn't apply")
+        position, prefix_fuzz, suffix_fuzz = found
+        if prefix_fuzz or suffix_fuzz or position != expected + delta:
+            inexact = True
+        offset = position - expected - delta
+
+        new = hunk.get_new()
+        start = position + prefix_fuzz
+        end = position + old_len - suffix_fuzz
+        replacement = new[prefix_fuzz : len(new) - suffix_fuzz]
+        lines[start:end] = replacement
+        delta += len(new) - old_len
+        min_position = start + len(replacement)
+    return lines, inexact
+
+
+def apply_patch(files, tree, strip=1, reverse=False, max_fuzz=MAX_FUZZ):
+    """Applies the file diffs of a patch to `tree`, a `_Tree`. Returns the new
+    contents as a dictionary mapping the paths to lists of lines (`None` for
+    removed files), the paths per file diff, and whether the patch applied only
+    with fuzz or offset. The tree isn't changed. Raises a `PatchError` if a hunk
+    doesn't apply.
+    """
+    result = {}
+    paths = []
+    inexact = False
+    for diff in files:
+        old_name, new_name = diff.old_name, diff.new_name
+        hunks = diff.hunks
+        if reverse:
+            old_name, new_name = new_name, old_name
+            hunks = [hunk.reversed() for hunk in hunks]
+        old_path = _strip(old_name, strip)
+        new_path = _strip(new_name, strip)
+
+        def current(path):
+            return result[path] if path in result else tree.get(path)
+
+        if old_path is None:
+            path = new_path
+        elif new_path is None or current(new_path) is not None:
+            path = old_path if new_path is None else new_path
+        else:
+            path = old_path
+        paths.append(path)
+
+        lines = current(path)
+        if lines is None:
+            if any(hunk.get_old() for hunk in hunks):
+                raise PatchError(f"File to patch not found: {path}")
+            lines = []
+        elif old_path is None and lines:
+            raise PatchError(f"File to create exists: {path}")
+        lines, hunks_inexact = _apply_hunks(lines, hunks, max_fuzz)
+        inexact = inexact or hunks_inexact
+        # Like `patch -E`, which quilt uses: empty files are removed.
+        result[path] = lines if lines else None
+    return result, paths, inexact
+
+
+def _format_range(start, length):
+    # like GNU diff
+    if length == 1:
+        return f"{start + 1}"
+    if length == 0:
+        return f"{start},0"
+    return f"{start + 1},{length}"
+
+
+def _format_lines(prefix, lines):
+    out = []
+    for line in lines:
+        out.append(prefix + line)
+        if not line.endswith(b"\n"):
+            out.append(b"\n" + _NO_NEWLINE)
+    return out
+
+
+def diff_lines(old, new, context=_CONTEXT):
+    """Returns the hunks of a unified diff of two lists of lines."""
+    matcher = difflib.SequenceMatcher(None, old, new, autojunk=False)
+    out = []
+    for group in matcher.get_grouped_opcodes(context):
+        i1, i2, j1, j2 = group[0][1], group[-1][2], group[0][3], group[-1][4]
+        head = "@@ -{} +{} @@\n".format(
+            _format_range(i1, i2 - i1), _format_range(j1, j2 - j1)
+        )
+        out.append(head.encode("ascii"))
+        for tag, a1, a2, b1, b2 in group:
+            if tag == "equal":
+                out += _format_lines(b" ", old[a1:a2])
+                continue
+            out += _format_lines(b"-", old[a1:a2])
+            out += _format_lines(b"+", new[b1:b2])
+    return out
+
+
+def refresh_patch(description, files, trailer, paths, before, after):
+    """Returns the patch regenerated from the contents `before` and `after` it,
+    with the description and the headers of the file diffs kept.
+    """
+    out = list(description)
+    done = set()
+    for diff, path in zip(files, paths):
+        if path in done:
+            # several diffs for the same file end up in one
+            continue
+        done.add(path)
+        hunks = diff_lines(before[path] or [], after[path] or [])
+        if hunks:
+            out += diff.header + hunks
+    out += trailer
+    return b"".join(out)
+
+
+def _drop_from_series(patches_dir, name):
+    series = os.path.join(patches_dir, "series")
+    with open(series, "r") as handle:
+        lines = handle.readlines()
+    with open(series, "w") as handle:
+        for line in lines:
+            parts = line.split("#", 1)[0].split()
+            if not parts or parts[0] != name:
+                handle.write(line)
+
+
+def _write_file(path, data):
+    # Replace rather than overwrite; the file might be hard-linked.
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as handle:
+        handle.write(data)
+    os.replace(tmp, path)
+
+
+def update_patches(directory, max_fuzz=MAX_FUZZ):
+    """Refreshes the patches in `directory/debian/patches` that only apply with
+    fuzz or offset and removes those that don't apply (from the series and from
+    disk). Returns the lists of refreshed and removed patches.
+
+    Raises `UnsupportedPatchError` before changing anything if a patch can't be
+    handled.
+    """
+    patches_dir = os.path.join(directory, "debian", "patches")
+    series = read_series(patches_dir)
+
+    parsed = []
+    for name, strip, reverse in series:
+        try:
+            with open(os.path.join(patches_dir, name), "rb") as handle:
+                data = handle.read()
+        except FileNotFoundError:
+            parsed.append((name, strip, reverse, None))
+            continue
+        try:
+            parsed.append((name, strip, reverse, parse_patch(data)))
+        except PatchError:
+            parsed.append((name, strip, reverse, None))
+
+    tree = _Tree(directory)
+    refreshed = []
+    removed = []
+    for name, strip, reverse, patch in parsed:
+        if patch is None:
+            removed.append(name)
+            continue
+        description, files, trailer = patch
+        try:
+            after, paths, inexact = apply_patch(
+                files, tree, strip, reverse, max_fuzz
+            )
+        except PatchError:
+            removed.append(name)
+            continue
+        before = {path: tree.get(path) for path in after}
+        tree.files.update(after)
+        if not inexact:
+            continue
+        if reverse:
+            # The patch stays a reversed one.
+            before, after = after, before
+        data = refresh_patch(description, files, trailer, paths, before, after)
+        _write_file(os.path.join(patches_dir, name), data)
+        refreshed.append(name)
+
+    for name in removed:
+        _drop_from_series(patches_dir, name)
+        path = os.path.join(patches_dir, name)
+        if os.path.isfile(path):
+            os.remove(path)
+    return refreshed, removed
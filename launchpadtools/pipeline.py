@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+#
+"""
+Two-stage pipeline for building and uploading the source packages of several
+releases.
+
+Builds keep the CPU busy and uploads the network, so the next release is built
+while the last one uploads, and a run takes about as long as the slower of the
+two stages rather than their sum. `run()` connects the stages by a bounded queue;
+once it's full, the builds wait for the uploads instead of running ahead. The
+stages are asyncio tasks, each with its own number of workers; the work itself
+happens in thread pools, since both `debuild` and the uploads block.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from . import metrics
+
+
+def _call(fields, function, *args):
+    # Worker threads don't inherit the metrics context of the caller.
+    with metrics.context(**fields):
+        return function(*args)
+
+
+async def _run(items, build, upload, build_jobs, upload_jobs, queue_size, errors):
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(maxsize=queue_size)
+    fields = metrics.get_context()
+    results = {}
+    # shared by all builders, so every item is built once
+    pending = iter(items)
+
+    build_pool = ThreadPoolExecutor(max_workers=build_jobs)
+    upload_pool = ThreadPoolExecutor(max_workers=upload_jobs)
+
+    async def builder():
+        for item in pending:
+            try:
+                built = await loop.run_in_executor(
+                    build_pool, _call, fields, build, item
+                )
+            except errors as e:
+                results[item] = e
+                continue
+            await queue.put((item, built))
+
+    async def uploader():
+        while True:
+            entry = await queue.get()
+            if entry is None:
+                return
+            item, built = entry
+            try:
+                await loop.run_in_executor(
+                    upload_pool, _call, fields, upload, item, built
+                )
+            except errors as e:
+                results[item] = e
+            else:
+                results[item] = None
+
+    async def close_queue(builders):
+        await asyncio.gather(*builders)
+        for _ in range(upload_jobs):
+            await queue.put(None)
+
+    builders = [asyncio.ensure_future(builder()) for _ in range(build_jobs)]
+    uploaders = [asyncio.ensure_future(uploader()) for _ in range(upload_jobs)]
+    tasks = builders + uploaders + [asyncio.ensure_future(close_queue(builders))]
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+        for task in done:
+            if task.exception() is not None:
+                raise task.exception()
+    except BaseException:
+        # Nothing new is started, and the running jobs are waited for, so no
+        # build or upload is left behind.
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+    finally:
+        build_pool.shutdown()
+        upload_pool.shutdown()
+    return results
+
+
+def run(items, build, upload, build_jobs=1, upload_jobs=1, queue_size=1, errors=()):
+    """Runs `build(item)` and then `upload(item, built)`, with `built` the result of
+    the build, for all `items` in a pipeline with `build_jobs` and `upload_jobs`
+    workers. At most `queue_size` built items wait for an upload.
+
+    Exceptions of the types `errors` only fail their item; any other exception
+    cancels the pipeline once the running jobs are done and is raised. Returns a
+    dictionary mapping the items, in order, to `None` on success and the exception
+    otherwise.
+    """
+    results = asyncio.run(
+        _run(items, build, upload, build_jobs, upload_jobs, queue_size, errors)
+    )
+    return {item: results[item] for item in items}
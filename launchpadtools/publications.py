@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+#
+"""
+Index of the source packages published in a PPA.
+
+The pending and published sources of a package are fetched for all series at
+once via the Launchpad web service, page by page, and then queried locally. The
+index is kept on disk; within the TTL it is used as is, after that each page is
+revalidated with a conditional request (ETag) and only fetched again if it has
+changed.
+"""
+import hashlib
+import json
+import os
+import time
+import urllib.parse
+
+from . import metrics
+from .cache import get_cache_dir
+
+API_ROOT = "https://api.launchpad.net/1.0"
+
+# Default time in seconds for which a fetched index is used without asking
+# Launchpad
+DEFAULT_TTL = 5 * 60
+
+# Publications that make up what a PPA offers
+_STATUSES = ["Pending", "Published"]
+
+_PAGE_SIZE = 300
+
+
+class LaunchpadError(Exception):
+    pass
+
+
+def _get(url, etag=None, timeout=30):
+    """Fetches a JSON document. Returns the document (`None` if it's unchanged) and
+    its ETag.
+    """
+    # The HTTP stack is imported by the first request; runs that never ask
+    # Launchpad (`--force`, `--help`, ...) don't need it.
+    import urllib.error
+    import urllib.request
+
+    headers = {"Accept": "application/json"}
+    if etag is not None:
+        headers["If-None-Match"] = etag
+    request = urllib.request.Request(url, headers=headers)
+    with metrics.stage("launchpad_get", url=url) as s:
+        try:
+            with urllib.request.urlopen(request, timeout=timeout) as response:
+                data = response.read()
+                s.set(status=response.status, received_bytes=len(data))
+                return json.loads(data), response.headers.get("ETag")
+        except urllib.error.HTTPError as e:
+            s.set(status=e.code)
+            if e.code == 304:
+                return None, etag
+            raise LaunchpadError(f"GET {url} failed: {e.code} {e.reason}")
+        except urllib.error.URLError as e:
+            raise LaunchpadError(f"GET {url} failed: {e.reason}")
+
+
+def get_series(entry):
+    """Returns the name of the series (e.g., `xenial`) of a publication."""
+    return entry["distro_series_link"].rstrip("/").rsplit("/", 1)[-1]
+
+
+class PublicationIndex:
+    """Pending and published sources of package `name` in the PPA `ppa_string`
+    (`owner/name`), for all series.
+
+    With `persistent=False`, nothing is read from or written to the cache
+    directory.
+    """
+
+    def __init__(
+        self,
+        ppa_string,
+        name,
+        api_root=API_ROOT,
+        cache_dir=None,
+        ttl=DEFAULT_TTL,
+        persistent=True,
+    ):
+        self.ppa_string = ppa_string
+        self.name = name
+        self.api_root = api_root.rstrip("/")
+        self.ttl = ttl
+
+        self.filename = None
+        if persistent:
+            if cache_dir is None:
+                cache_dir = get_cache_dir()
+            key = json.dumps([self.api_root, ppa_string, name]).encode("utf-8")
+            self.filename = os.path.join(
+                cache_dir, "publications", hashlib.sha256(key).hexdigest() + ".json"
+            )
+
+        # {"fetched": time, "sweeps": {status: [page, ...]},
+        #  "files": {self_link: [file names]}}
+        # with pages {"url": ..., "etag": ..., "next": url, "entries": [...]}
+        self._data = None
+        self._is_fresh = False
+
+    def _get_sweep_url(self, status):
+        owner, ppa_name = self.ppa_string.split("/")
+        query = urllib.parse.urlencode(
+            {
+                "ws.op": "getPublishedSources",
+                "source_name": self.name,
+                "exact_match": "true",
+                "status": status,
+                "ws.size": _PAGE_SIZE,
+            }
+        )
+        return f"{self.api_root}/~{owner}/+archive/ubuntu/{ppa_name}?{query}"
+
+    def _load(self):
+        if self.filename is None:
+            return None
+        try:
+            with open(self.filename, "r") as handle:
+                return json.load(handle)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _save(self):
+        if self.filename is None:
+            return
+        os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+        tmp = f"{self.filename}.{os.getpid()}.tmp"
+        with open(tmp, "w") as handle:
+            json.dump(self._data, handle)
+        os.replace(tmp, self.filename)
+
+    def _sweep(self, status, old):
+        """Fetches all publications with `status`, as a list of pages. The pages in
+        `old` are revalidated by ETag, and only fetched again if they have changed.
+        """
+        old_pages = {page["url"]: page for page in old or []}
+        pages = []
+        url = self._get_sweep_url(status)
+        while url:
+            page = old_pages.get(url)
+            data, etag = _get(url, page["etag"] if page else None)
+            if data is not None:
+                page = {
+                    "url": url,
+                    "etag": etag,
+                    "next": data.get("next_collection_link"),
+                    "entries": [
+                        {
+                            "version": e["source_package_version"],
+                            "series": get_series(e),
+                            "self_link": e["self_link"],
+                        }
+                        for e in data["entries"]
+                    ],
+                }
+            pages.append(page)
+            url = page["next"]
+        return pages
+
+    def refresh(self, force=False):
+        """Brings the index up to date. Unless `force` is set, an index that has
+        already been refreshed by this object or is younger than the TTL is
+        considered up to date.
+        """
+        if self._is_fresh and not force:
+            return
+        if self._data is None:
+            self._data = self._load()
+        if (
+            not force
+            and self._data is not None
+            and time.time() - self._data["fetched"] < self.ttl
+        ):
+            self._is_fresh = True
+            return
+
+        old = self._data or {"sweeps": {}, "files": {}}
+        sweeps = {
+            status: self._sweep(status, old["sweeps"].get(status))
+            for status in _STATUSES
+        }
+        # Only keep the file lists of publications that are still around.
+        links = {
+            e["self_link"]
+            for pages in sweeps.values()
+            for p in pages
+            for e in p["entries"]
+        }
+        files = {link: f for link, f in old["files"].items() if link in links}
+        self._data = {"fetched": time.time(), "sweeps": sweeps, "files": files}
+        self._is_fresh = True
+        self._save()
+
+    def expire(self):
+        """Lets the next lookup refresh the index if it is older than the TTL, for
+        objects that live longer than a run.
+        """
+        self._is_fresh = False
+        return
+
+    def get_entries(self, status=None):
+        """Returns the publications, newest first, as dictionaries with the keys
+        `version`, `series`, and `self_link`.
+        """
+        self.refresh()
+        statuses = _STATUSES if status is None else [status]
+        return [
+            e for s in statuses for p in self._data["sweeps"][s] for e in p["entries"]
+        ]
+
+    def has_tree_hash(self, series, tree_hash_short):
+        """Checks if the latest published version in `series` carries the tree hash,
+        i.e., is of the form `2.1.0~20160504184836-01b3a567-1trusty1`.
+        """
+        for entry in self.get_entries("Published"):
+            if entry["series"] == series:
+                parts = entry["version"].split("-")
+                return len(parts) >= 3 and parts[-2] == tree_hash_short
+        return False
+
+    def get_file_names(self):
+        """Returns the names of all files of the pending and published sources.
+        The file lists of publications never change, so they are fetched only once.
+        """
+        names = set()
+        changed = False
+        for entry in self.get_entries():
+            link = entry["self_link"]
+            if link not in self._data["files"]:
+                urls, _ = _get(link + "?ws.op=sourceFileUrls")
+                self._data["files"][link] = [
+                    urllib.parse.unquote(url.rsplit("/", 1)[-1]) for url in urls
+                ]
+                changed = True
+            names.update(self._data["files"][link])
+        if changed:
+            self._save()
+        return names
@@ -0,0 +1,333 @@
+# -*- coding: utf-8 -*-
+#
+"""
+Native generation of Debian source package artifacts.
+
+Source packages for different Ubuntu releases only differ in the changelog. So
+instead of running `debuild` for every release, one package can be built
+normally and serve as a template: For every other release, the debian tarball is
+created anew and the `.dsc` and `.changes` files are derived from the template's
+with updated versions, checksums, and sizes. Only signing is left to `debsign`.
+"""
+import email.utils
+import fnmatch
+import gzip
+import hashlib
+import lzma
+import os
+import re
+import subprocess
+import tarfile
+
+from .changelog import read_latest
+from .tarball import get_tarinfo
+
+# File names that dpkg-source leaves out of the debian tarball by default (see
+# --tar-ignore in dpkg-source(1)), and the leftovers of patching
+_TAR_IGNORES = [
+    "*.a",
+    "*.la",
+    "*.o",
+    "*.so",
+    ".*.sw?",
+    "*~",
+    ",,*",
+    ".[#~]*",
+    ".arch-ids",
+    ".arch-inventory",
+    ".be",
+    ".bzr",
+    ".bzr.backup",
+    ".bzr.tags",
+    ".bzrignore",
+    ".cvsignore",
+    ".deps",
+    ".git",
+    ".gitattributes",
+    ".gitignore",
+    ".gitmodules",
+    ".gitreview",
+    ".hg",
+    ".hgignore",
+    ".hgsigs",
+    ".hgtags",
+    ".mailmap",
+    ".mtn-ignore",
+    ".pc",
+    ".shelf",
+    ".svn",
+    "CVS",
+    "DEADJOE",
+    "RCS",
+    "_MTN",
+    "_darcs",
+    "{arch}",
+    "*.orig",
+    "*.rej",
+]
+
+
+def strip_signature(text):
+    """Returns the content of a clearsigned message, or the text itself if it isn't
+    signed.
+    """
+    lines = text.splitlines()
+    if not lines or lines[0] != "-----BEGIN PGP SIGNED MESSAGE-----":
+        return text
+    # skip the armor headers up to the first blank line
+    start = lines.index("") + 1
+    end = lines.index("-----BEGIN PGP SIGNATURE-----")
+    # dash-escaped lines
+    content = [line[2:] if line.startswith("- ") else line for line in lines[start:end]]
+    return "\n".join(content).strip("\n") + "\n"
+
+
+def parse_control(text):
+    """Parses a Debian control file (deb822) into a list of paragraphs, each a
+    dictionary. Multi-line values keep their continuation lines verbatim, e.g.,
+    `"\\n abc 123 foo.dsc"`.
+    """
+    paragraphs = []
+    paragraph = {}
+    key = None
+    for line in strip_signature(text).splitlines():
+        if not line.strip():
+            if paragraph:
+                paragraphs.append(paragraph)
+            paragraph = {}
+            key = None
+        elif line[0] in " \t":
+            assert key is not None, f"Continuation line without field: {line}"
+            paragraph[key] += "\n" + line
+        else:
+            key, value = line.split(":", 1)
+            paragraph[key] = value.strip()
+    if paragraph:
+        paragraphs.append(paragraph)
+    return paragraphs
+
+
+def dump_control(paragraph):
+    lines = []
+    for key, value in paragraph.items():
+        sep = "" if not value or value.startswith("\n") else " "
+        lines.append(f"{key}:{sep}{value}")
+    return "\n".join(lines) + "\n"
+
+
+def get_checksums(path):
+    md5 = hashlib.md5()
+    sha1 = hashlib.sha1()
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as handle:
+        while True:
+            chunk = handle.read(1024 * 1024)
+            if not chunk:
+                break
+            for h in [md5, sha1, sha256]:
+                h.update(chunk)
+    return {
+        "Files": md5.hexdigest(),
+        "Checksums-Sha1": sha1.hexdigest(),
+        "Checksums-Sha256": sha256.hexdigest(),
+        "size": os.path.getsize(path),
+    }
+
+
+def get_file_names(paragraph):
+    """Returns the names of the files in the `Files` list of a `.dsc` or
+    `.changes` paragraph.
+    """
+    return [line.split()[-1] for line in paragraph["Files"].split("\n") if line.strip()]
+
+
+def is_orig_tarball(filename):
+    """Checks if `filename` is an orig tarball, e.g., `foo_1.0.orig.tar.gz` or the
+    component tarball `foo_1.0.orig-docs.tar.xz`.
+    """
+    return re.search("\\.orig(-[A-Za-z0-9-]+)?\\.tar\\.[^.]+$", filename) is not None
+
+
+def replace_files(paragraph, files, drop=()):
+    """Updates the file lists (`Files`, `Checksums-*`) of a `.dsc` or `.changes`
+    paragraph. `files` maps file names in the lists to paths of their
+    replacements; those get the new name, checksum, and size. Other columns (like
+    section and priority in `.changes`) are kept. Files in `drop` are removed.
+    """
+    checksums = {old: get_checksums(path) for old, path in files.items()}
+    for field in ["Files", "Checksums-Sha1", "Checksums-Sha256"]:
+        if field not in paragraph:
+            continue
+        lines = []
+        for line in paragraph[field].split("\n"):
+            if not line.strip():
+                lines.append(line)
+                continue
+            parts = line.split()
+            filename = parts[-1]
+            if filename in drop:
+                continue
+            if filename in files:
+                c = checksums[filename]
+                parts = (
+                    [c[field], str(c["size"])]
+                    + parts[2:-1]
+                    + [os.path.basename(files[filename])]
+                )
+            lines.append(" " + " ".join(parts))
+        paragraph[field] = "\n".join(lines)
+    return paragraph
+
+
+def parse_changelog_entry(changelog):
+    """Returns the fields of the topmost changelog entry as they are needed for a
+    `.changes` file.
+    """
+    entry = read_latest(changelog)
+    changes = [f" {entry['header']}", " ."]
+    changes += [f" {line}" if line.strip() else " ." for line in entry["changes"]]
+    return {
+        "Source": entry["package"],
+        "Version": entry["version"],
+        "Distribution": " ".join(entry["distributions"]),
+        "Urgency": entry["urgency"],
+        "Changed-By": "{} <{}>".format(*entry["maintainer"]),
+        "Date": entry["date"],
+        "Changes": "\n" + "\n".join(changes),
+    }
+
+
+def _is_tar_ignored(name):
+    return any(fnmatch.fnmatchcase(name, pattern) for pattern in _TAR_IGNORES)
+
+
+def get_debian_members(orig_dir):
+    """Returns the paths in `orig_dir/debian` that `dpkg-source -b` puts into the
+    debian tarball by default, i.e., all but those in `_TAR_IGNORES`.
+    """
+    members = ["debian"]
+    for root, dirs, files in os.walk(os.path.join(orig_dir, "debian")):
+        dirs[:] = sorted(d for d in dirs if not _is_tar_ignored(d))
+        relroot = os.path.relpath(root, orig_dir)
+        names = dirs + [f for f in files if not _is_tar_ignored(f)]
+        members += [f"{relroot}/{name}" for name in sorted(names)]
+    return members
+
+
+def create_debian_tarball(orig_dir, filename, mtime=None, members=None):
+    """Creates the debian tarball (`.debian.tar.xz` or `.debian.tar.gz`) with the
+    contents of `orig_dir/debian`, like `dpkg-source -b` does for format
+    "3.0 (quilt)". `members` are the paths to include, in order; by default, those
+    of `get_debian_members()`.
+    """
+    if mtime is None:
+        # dpkg-source clamps the time stamps to the changelog date.
+        entry = parse_changelog_entry(os.path.join(orig_dir, "debian", "changelog"))
+        mtime = int(email.utils.parsedate_to_datetime(entry["Date"]).timestamp())
+    if members is None:
+        members = get_debian_members(orig_dir)
+
+    if filename.endswith(".xz"):
+        handle = lzma.open(filename, "wb", preset=6)
+    else:
+        assert filename.endswith(".gz")
+        handle = gzip.GzipFile(filename, "wb", mtime=0)
+
+    with handle, tarfile.open(
+        fileobj=handle, mode="w|", format=tarfile.GNU_FORMAT
+    ) as tar:
+        for member in members:
+            path = os.path.join(orig_dir, member)
+            info = get_tarinfo(member, path, mtime)
+            if info is None:
+                continue
+            if info.isreg():
+                with open(path, "rb") as f:
+                    tar.addfile(info, f)
+            else:
+                tar.addfile(info)
+    return
+
+
+def get_debian_tarball_ext(dsc_paragraph, name, version):
+    """Returns the extension (e.g., `.xz`) of the debian tarball of a "3.0 (quilt)"
+    source package, or `None` if the package has a different format.
+    """
+    if dsc_paragraph.get("Format") != "3.0 (quilt)":
+        return None
+    prefix = f"{name}_{version}.debian.tar"
+    for line in dsc_paragraph["Files"].split("\n"):
+        parts = line.split()
+        if parts and parts[-1].startswith(prefix):
+            return parts[-1][len(prefix) :]
+    return None
+
+
+def derive_source_package(
+    work_dir,
+    orig_dir,
+    name,
+    template_version,
+    chlog_version,
+    debsign_params=(),
+    include_orig=True,
+):
+    """Creates and signs the debian tarball, `.dsc`, and `.changes` file for
+    `chlog_version` in `work_dir`, with the `debuild -S` output for
+    `template_version` as template. The debian tarball has the same members as
+    the template's. `orig_dir/debian/changelog` must already describe
+    `chlog_version`. With `include_orig=False`, the orig tarballs are left out of
+    the `.changes` file, like `debuild -sd` does.
+    """
+    with open(os.path.join(work_dir, f"{name}_{template_version}.dsc")) as f:
+        (dsc,) = parse_control(f.read())
+    changes_file = os.path.join(work_dir, f"{name}_{template_version}_source.changes")
+    with open(changes_file) as f:
+        (changes,) = parse_control(f.read())
+
+    ext = get_debian_tarball_ext(dsc, name, template_version)
+    assert ext is not None, "Only 3.0 (quilt) source packages can be derived."
+
+    # The build of the template leaves files like `debian/files` behind, so the
+    # members are those of the template's debian tarball rather than all of
+    # `debian/`.
+    template_tarball = os.path.join(
+        work_dir, f"{name}_{template_version}.debian.tar{ext}"
+    )
+    with tarfile.open(template_tarball) as tar:
+        members = [os.path.normpath(m) for m in tar.getnames()]
+    debian_tarball = os.path.join(work_dir, f"{name}_{chlog_version}.debian.tar{ext}")
+    create_debian_tarball(orig_dir, debian_tarball, members=members)
+
+    entry = parse_changelog_entry(os.path.join(orig_dir, "debian", "changelog"))
+
+    dsc["Version"] = entry["Version"]
+    replace_files(dsc, {f"{name}_{template_version}.debian.tar{ext}": debian_tarball})
+    dsc_file = os.path.join(work_dir, f"{name}_{chlog_version}.dsc")
+    with open(dsc_file, "w") as f:
+        f.write(dump_control(dsc))
+
+    for key in ["Date", "Version", "Distribution", "Urgency", "Changed-By", "Changes"]:
+        changes[key] = entry[key]
+    # The build info describes the build of the template.
+    drop = [f"{name}_{template_version}_source.buildinfo"]
+    if not include_orig:
+        drop += [f for f in get_file_names(changes) if is_orig_tarball(f)]
+    replace_files(
+        changes,
+        {
+            f"{name}_{template_version}.dsc": dsc_file,
+            f"{name}_{template_version}.debian.tar{ext}": debian_tarball,
+        },
+        drop=drop,
+    )
+    changes_file = os.path.join(work_dir, f"{name}_{chlog_version}_source.changes")
+    with open(changes_file, "w") as f:
+        f.write(dump_control(changes))
+
+    # signs the .dsc as well and updates its checksums in the .changes
+    subprocess.check_call(
+        ["debsign"] + list(debsign_params) + [os.path.basename(changes_file)],
+        cwd=work_dir,
+    )
+    return
@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+#
+"""
+Cheap copies of source trees.
+
+Files are cloned with reflinks where the file system supports it (Btrfs, XFS,
+...). Otherwise, files that the pipeline never modifies are hard-linked, and only
+the others are copied. An existing copy can be synced like with `rsync -a
+--delete`: Only files whose stat data differs are replaced, and files no longer in
+the source are removed.
+"""
+import errno
+import fcntl
+import os
+import re
+import shutil
+import stat
+
+# ioctl request for cloning a file, from <linux/fs.h>
+FICLONE = 0x40049409
+
+# errnos that indicate that a file system can't reflink or hard-link
+_UNSUPPORTED = {
+    errno.EXDEV,
+    errno.EPERM,
+    errno.EINVAL,
+    errno.ENOTTY,
+    errno.EOPNOTSUPP,
+    errno.EMLINK,
+}
+
+
+def _is_unchanged(src, dst, src_st, dst_st):
+    # Like rsync, trust size and mtime (which copies and clones keep), and the
+    # file type and permissions.
+    if stat.S_IFMT(src_st.st_mode) != stat.S_IFMT(dst_st.st_mode):
+        return False
+    if stat.S_ISLNK(src_st.st_mode):
+        return os.readlink(src) == os.readlink(dst)
+    return (
+        src_st.st_size == dst_st.st_size
+        and src_st.st_mtime_ns == dst_st.st_mtime_ns
+        and stat.S_IMODE(src_st.st_mode) == stat.S_IMODE(dst_st.st_mode)
+    )
+
+
+def _remove(path):
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path)
+    else:
+        os.remove(path)
+
+
+class Stager:
+    def __init__(self):
+        self.can_reflink = hasattr(fcntl, "ioctl")
+        self.can_hardlink = True
+        self.counts = {"reflinked": 0, "hardlinked": 0, "copied": 0}
+
+    def _reflink(self, src, dst):
+        if not self.can_reflink:
+            return False
+        with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+            try:
+                fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+            except OSError as e:
+                if e.errno not in _UNSUPPORTED:
+                    raise
+                self.can_reflink = False
+        if not self.can_reflink:
+            os.remove(dst)
+            return False
+        shutil.copystat(src, dst)
+        self.counts["reflinked"] += 1
+        return True
+
+    def _hardlink(self, src, dst):
+        if not self.can_hardlink:
+            return False
+        try:
+            os.link(src, dst)
+        except OSError as e:
+            if e.errno not in _UNSUPPORTED:
+                raise
+            self.can_hardlink = False
+            return False
+        self.counts["hardlinked"] += 1
+        return True
+
+    def _copy(self, src, dst):
+        # shutil uses copy_file_range/sendfile where available, so the data doesn't
+        # pass through user space.
+        shutil.copy2(src, dst, follow_symlinks=False)
+        self.counts["copied"] += 1
+
+    def stage_file(self, src, dst, modified):
+        if os.path.islink(src):
+            os.symlink(os.readlink(src), dst)
+            return
+        if self._reflink(src, dst):
+            return
+        if not modified and self._hardlink(src, dst):
+            return
+        self._copy(src, dst)
+
+    def stage(self, source, target, excludes, matcher, is_modified, relpath=""):
+        os.makedirs(os.path.join(target, relpath), exist_ok=True)
+        with os.scandir(os.path.join(source, relpath)) as it:
+            entries = list(it)
+        for entry in entries:
+            path = relpath + "/" + entry.name if relpath else entry.name
+            if entry.name == ".git" or path in excludes:
+                continue
+            is_dir = entry.is_dir(follow_symlinks=False)
+            # Excluded directories are pruned here, so their contents are never
+            # even listed.
+            if matcher and matcher.match(path, is_dir):
+                continue
+            if is_dir:
+                self.stage(source, target, excludes, matcher, is_modified, path)
+            else:
+                self.stage_file(
+                    entry.path, os.path.join(target, path), is_modified(path)
+                )
+        shutil.copystat(os.path.join(source, relpath), os.path.join(target, relpath))
+
+    def sync(self, source, target, excludes, matcher, is_modified, relpath=""):
+        """Like `stage()`, but `target` may hold an earlier copy. Files with the
+        same stat data are kept, everything else in `target` is replaced or
+        removed.
+        """
+        target_dir = os.path.join(target, relpath)
+        if os.path.islink(target_dir) or (
+            os.path.exists(target_dir) and not os.path.isdir(target_dir)
+        ):
+            os.remove(target_dir)
+        os.makedirs(target_dir, exist_ok=True)
+        with os.scandir(target_dir) as it:
+            existing = {entry.name: entry for entry in it}
+        with os.scandir(os.path.join(source, relpath)) as it:
+            entries = list(it)
+        for entry in entries:
+            path = relpath + "/" + entry.name if relpath else entry.name
+            if entry.name == ".git" or path in excludes:
+                continue
+            is_dir = entry.is_dir(follow_symlinks=False)
+            if matcher and matcher.match(path, is_dir):
+                continue
+            old = existing.pop(entry.name, None)
+            if is_dir:
+                if old is not None and not old.is_dir(follow_symlinks=False):
+                    os.remove(old.path)
+                self.sync(source, target, excludes, matcher, is_modified, path)
+                continue
+            if old is not None:
+                src_st = entry.stat(follow_symlinks=False)
+                dst_st = old.stat(follow_symlinks=False)
+                # A file hard-linked earlier must become a copy once a new patch
+                # touches it.
+                linked = os.path.samestat(src_st, dst_st)
+                unchanged = _is_unchanged(entry.path, old.path, src_st, dst_st)
+                if unchanged and not (linked and is_modified(path)):
+                    self.counts["unchanged"] += 1
+                    continue
+                _remove(old.path)
+            self.stage_file(entry.path, os.path.join(target, path), is_modified(path))
+        # whatever is left is gone from the source, or excluded now
+        for old in existing.values():
+            _remove(old.path)
+            self.counts["deleted"] += 1
+        shutil.copystat(os.path.join(source, relpath), target_dir)
+
+
+def _get_patch_strip_level(options):
+    out = re.search("-p *([0-9]+)", options)
+    return int(out.group(1)) if out else 1
+
+
+def get_patched_files(directory):
+    """Returns the set of paths (relative to `directory`) that the quilt patches in
+    `debian/patches/series` touch.
+    """
+    patches_dir = os.path.join(directory, "debian", "patches")
+    series = os.path.join(patches_dir, "series")
+    if not os.path.isfile(series):
+        return set()
+
+    paths = set()
+    with open(series, "r") as handle:
+        lines = handle.readlines()
+    for line in lines:
+        line = line.split("#", 1)[0].strip()
+        if not line:
+            continue
+        parts = line.split(None, 1)
+        strip = _get_patch_strip_level(parts[1] if len(parts) > 1 else "")
+        patch = os.path.join(patches_dir, parts[0])
+        if not os.path.isfile(patch):
+            continue
+        with open(patch, "r", errors="replace") as handle:
+            for patch_line in handle:
+                if not patch_line.startswith(("--- ", "+++ ")):
+                    continue
+                path = patch_line[4:].split("\t", 1)[0].strip()
+                if path == "/dev/null":
+                    continue
+                components = path.split("/")[strip:]
+                if components:
+                    paths.add("/".join(components))
+    return paths
+
+
+def stage_tree(source, target, excludes=(), modified=("debian",), matcher=None):
+    """Replicates `source` in `target`, skipping `.git` directories (like
+    dpkg-source does), the paths in `excludes`, and the paths that the
+    `ignore.Matcher` `matcher` matches. The files in `modified` (and
+    everything below directories in `modified`) are copied or reflinked, but never
+    hard-linked, since the pipeline changes them. The same holds for all files
+    touched by the quilt patches.
+
+    Returns a dictionary with the number of files reflinked, hard-linked, and
+    copied.
+    """
+    excludes = set(excludes)
+    modified = set(modified) | get_patched_files(source)
+
+    def is_modified(path):
+        while path:
+            if path in modified:
+                return True
+            path = path.rsplit("/", 1)[0] if "/" in path else ""
+        return False
+
+    stager = Stager()
+    stager.stage(source, target, excludes, matcher, is_modified)
+    return stager.counts
+
+
+def sync_tree(source, target, excludes=(), modified=("debian",), matcher=None):
+    """Makes `target`, which may hold an earlier copy of `source`, a copy like
+    `stage_tree()` does, touching only what changed: Files whose size, mtime,
+    and permissions are unchanged are kept; others are staged anew. Files that
+    aren't in the source (or are excluded now) are deleted.
+
+    Returns the counts of `stage_tree()` plus the number of files unchanged and
+    deleted.
+    """
+    excludes = set(excludes)
+    modified = set(modified) | get_patched_files(source)
+
+    def is_modified(path):
+        while path:
+            if path in modified:
+                return True
+            path = path.rsplit("/", 1)[0] if "/" in path else ""
+        return False
+
+    stager = Stager()
+    stager.counts.update(unchanged=0, deleted=0)
+    stager.sync(source, target, excludes, matcher, is_modified)
+    return stager.counts
@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+#
+"""
+Single pass over a source tree that computes the Git tree hash and writes the
+orig tarball at the same time, reading every file only once.
+"""
+import hashlib
+import os
+import tarfile
+import time
+
+from . import treehash
+from .ignore import IgnoreStack, read_ignore_file
+from .tarball import (
+    Compression,
+    MemberHash,
+    get_default_mtime,
+    get_tarinfo,
+    normalize_excludes,
+)
+
+
+class _HashingReader:
+    """File wrapper feeding everything read through it into a Git blob hasher.
+    """
+
+    def __init__(self, handle, size):
+        self.handle = handle
+        self.sha = hashlib.sha1(b"blob %d\0" % size)
+
+    def read(self, size=-1):
+        data = self.handle.read(size)
+        self.sha.update(data)
+        return data
+
+
+def _walk(directory, excludes, matcher, ignore_stack, git_node, tar_node, relpath=""):
+    """Walks `directory` in tarball order, i.e., sorted and with directories
+    before their contents. Builds two `treehash.Directory` trees along the way:
+    `git_node` with the files Git would track, and `tar_node` (`None` for paths
+    excluded from the tarball) with the files that go into the tarball. Paths
+    that `matcher` matches are in neither.
+
+    Yields `(relpath, path, git_file, tar_file)` tuples where the latter two are
+    the `treehash.File`s of the entry in the respective trees, or `None`.
+    """
+    if ignore_stack is not None:
+        ignore_stack = ignore_stack.push(
+            relpath, read_ignore_file(os.path.join(directory, relpath, ".gitignore"))
+        )
+
+    with os.scandir(os.path.join(directory, relpath)) as it:
+        entries = sorted(it, key=lambda e: e.name)
+
+    for entry in entries:
+        if entry.name == ".git":
+            continue
+        path = relpath + "/" + entry.name if relpath else entry.name
+        is_dir = entry.is_dir(follow_symlinks=False)
+        if matcher and matcher.match(path, is_dir):
+            continue
+        tracked = ignore_stack is not None and not ignore_stack.is_ignored(path, is_dir)
+        in_tar = tar_node is not None and path not in excludes
+        if not tracked and not in_tar:
+            continue
+
+        if is_dir:
+            git_sub = treehash.Directory(path) if tracked else None
+            tar_sub = treehash.Directory(path) if in_tar else None
+            if in_tar:
+                yield path, entry.path, None, None
+            yield from _walk(
+                directory,
+                excludes,
+                matcher,
+                ignore_stack if tracked else None,
+                git_sub,
+                tar_sub,
+                path,
+            )
+            if git_sub is not None:
+                git_node.dirs.append(git_sub)
+            if tar_sub is not None:
+                tar_node.dirs.append(tar_sub)
+            continue
+
+        st = entry.stat(follow_symlinks=False)
+        mode = treehash.file_mode(st)
+        git_file = None
+        tar_file = None
+        if mode is not None:
+            if tracked:
+                git_file = treehash.File(path, entry, st, mode)
+                git_node.files.append(git_file)
+            if in_tar:
+                tar_file = treehash.File(path, entry, st, mode)
+                tar_node.files.append(tar_file)
+        if git_file is not None or tar_file is not None or in_tar:
+            yield path, entry.path, git_file, tar_file
+
+
+def hash_and_create_tarball(
+    directory,
+    tarball,
+    prefix,
+    excludes=None,
+    cache=None,
+    mtime=None,
+    level=6,
+    max_workers=None,
+    matcher=None,
+    compression=None,
+    block_cache=None,
+):
+    """Writes the same tarball as `tarball.create_tarball()` and computes the Git
+    tree hash of `directory` like `treehash.get_tree_hash()`. Every file is read
+    once; each chunk goes to both the blob hasher and the compressor. Files
+    excluded from the tarball (e.g., `debian/`) are only hashed. Paths that the
+    `ignore.Matcher` `matcher` matches are neither hashed nor archived.
+
+    Returns the tree hash and the content hash, i.e., the `tarball.MemberHash` of
+    the tarball (see `tarball.get_content_hash()`).
+
+    If a `HashCache` is given, it is updated with the computed hashes.
+    """
+    excludes = normalize_excludes(excludes)
+    if mtime is None:
+        mtime = get_default_mtime()
+    racy_ns = time.time_ns() - treehash.RACY_NS
+    if compression is None:
+        compression = Compression("gz", level, max_workers)
+
+    git_root = treehash.Directory("")
+    tar_root = treehash.Directory("")
+    members = MemberHash()
+    with open(tarball, "wb") as fh, compression.open(
+        fh, block_cache
+    ) as gz, tarfile.open(fileobj=gz, mode="w|", format=tarfile.GNU_FORMAT) as tar:
+        info = get_tarinfo(prefix, directory, mtime)
+        tar.addfile(info)
+        members.update("", info)
+        for relpath, path, git_file, tar_file in _walk(
+            directory, excludes, matcher, IgnoreStack(), git_root, tar_root
+        ):
+            info = None
+            if tar_file is not None or git_file is None:
+                info = get_tarinfo(prefix + "/" + relpath, path, mtime)
+            if info is not None and info.isreg():
+                with open(path, "rb") as handle:
+                    reader = _HashingReader(handle, info.size)
+                    tar.addfile(info, reader)
+                digest = reader.sha.digest()
+            else:
+                if info is not None:
+                    tar.addfile(info)
+                f = git_file or tar_file
+                digest = treehash.hash_entry(f) if f is not None else None
+            for f in [git_file, tar_file]:
+                if f is not None:
+                    f.digest = digest
+            if info is not None:
+                members.update(relpath, info, digest if info.isreg() else None)
+
+    tree_hash = git_root.compute_digest()
+    if cache is not None:
+        key = os.path.realpath(directory)
+        git_root.compute_signature()
+        treehash.store_in_cache(
+            cache, key, treehash.get_variant(matcher=matcher), git_root, racy_ns
+        )
+        # The tree of the tarball isn't hashed, so this only stores its files.
+        treehash.store_in_cache(cache, key, None, tar_root, racy_ns)
+        cache.flush()
+    return tree_hash.hex(), members.hexdigest()
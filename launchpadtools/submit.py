@@ -1,28 +1,67 @@
 # -*- coding: utf-8 -*-
 #
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import contextlib
 import datetime
-from distutils.dir_util import copy_tree
 import os
 import re
 import shutil
 import subprocess
-import time
+import sys
 import tempfile
 
-import git
-from launchpadlib.launchpad import Launchpad
+from . import tarball as tarball_module
+from . import (
+    changelog,
+    checkpoint,
+    ignore,
+    metrics,
+    patches,
+    pipeline,
+    publications,
+    source,
+    stream,
+    treehash,
+    upload,
+    watch,
+)
+from . import workspace as workspace_module
+from .cache import HashCache, OrigStore, UploadJournal
+from .staging import stage_tree, sync_tree
+
+# Paths kept out of the orig tarball
+_ORIG_EXCLUDES = ["./debian"]
+# Valid names of component tarballs, cf. dpkg-source(1)
+_COMPONENT_RE = re.compile("[A-Za-z0-9][A-Za-z0-9-]*")
 
 
 class DputException(Exception):
     pass
 
 
-def _get_info_from_changelog(changelog):
-    with open(changelog, "r") as handle:
-        first_line = handle.readline()
-    search = re.search("^( *[^ ]+) *\\(([^\\)]+)\\).*", first_line, re.IGNORECASE)
-    assert search, "Could not extract name from changelog."
-    return search.group(1), search.group(2)
+class ComponentError(Exception):
+    pass
+
+
+# Errors that fail a single release, but not the others
+_RELEASE_ERRORS = (DputException, subprocess.CalledProcessError)
+
+
+def _check_components(directory, components):
+    """Checks that the `components` are top-level directories of `directory` that
+    can be component tarballs.
+    """
+    for component in components:
+        if not _COMPONENT_RE.fullmatch(component) or component == "debian":
+            raise ComponentError(f"Invalid component name `{component}`.")
+        if not os.path.isdir(os.path.join(directory, component)):
+            raise ComponentError(f"{directory} has no directory `{component}`.")
+    return
+
+
+def _get_orig_excludes(components=()):
+    # The components go into tarballs of their own.
+    return _ORIG_EXCLUDES + [f"./{component}" for component in components]
 
 
 def _parse_package_version(version):
@@ -49,26 +88,23 @@ def _parse_package_version(version):
     return epoch, upstream, debian, ubuntu
 
 
-def _get_tree_hash(directory):
+def _get_tree_hash(directory, cache=None, matcher=None):
     """Returns Git tree hash of a directory.
     """
-    try:
-        repo = git.Repo(directory)
-    except git.InvalidGitRepositoryError:
-        repo = git.Repo.init(directory)
-
-    # The add step can take really long if many files need to be added.  Use git's own
-    # `git add -A` rather than GitPython's repo.index.add('*') since the latter takes a
-    # really long time if the repo is large, even if it's already almost completely
-    # checked in.
-    repo.git.add("-A")
-    repo.index.commit("launchpadtools commit")
-    tree_hash = repo.tree().hexsha
+    return treehash.get_tree_hash(directory, cache=cache, matcher=matcher)
 
-    # clean up
-    shutil.rmtree(os.path.join(directory, ".git"))
 
-    return tree_hash
+def _get_orig_key(content_hash, prefix, compression=None):
+    # Everything that determines the bytes of the orig tarball; `content_hash` is
+    # the `tarball.MemberHash` of its members.
+    if compression is None:
+        compression = tarball_module.Compression()
+    return {
+        "content_hash": content_hash,
+        "prefix": prefix,
+        **compression.get_key(),
+        "mtime": tarball_module.get_default_mtime(),
+    }
 
 
 def _get_filesize(path):
@@ -85,7 +121,9 @@ def _sizeof_fmt(num, suffix="B"):
     return f"{num:.1f}Yi{suffix}"
 
 
-def _create_tarball(directory, tarball, prefix, excludes=None):
+def _create_tarball(
+    directory, tarball, prefix, excludes=None, compression=None, block_cache=None
+):
     if excludes is None:
         excludes = []
 
@@ -93,52 +131,761 @@ def _create_tarball(directory, tarball, prefix, excludes=None):
 
     if os.path.isfile(tarball):
         os.remove(tarball)
-    # We need to make sure that the same content ends up with a tar archive that has the
-    # same checksums. Unfortunately, by default, gzip contains time stamps. Stripping
-    # them helps <http://serverfault.com/a/110244/132462>.
-    # Also, replace the leading `repo_dir` by `prefix`.
-    repo_dir_without_leading_slash = directory[1:] if directory[0] == "/" else directory
-    transform = "s/^{}/{}/".format(
-        repo_dir_without_leading_slash.replace("/", "\\/"), prefix
-    )
-    cmd = [
-        "tar",
-        "--transform",
-        transform,
-        "-czf",
+    # The same content must end up in a tar archive with the same checksums, so
+    # time stamps and owners are normalized.
+    tarball_module.create_tarball(
+        directory,
         tarball,
-        # "--use-compress-program",
-        # "'gzip -n'",
-    ]
-    for exclude in excludes:
-        cmd.append(f"--exclude={exclude}")
-    cmd.append(directory)
-
-    subprocess.check_call(cmd)
+        prefix,
+        excludes=excludes,
+        compression=compression,
+        block_cache=block_cache,
+    )
+    return
+
+
+def _update_orig_journal(journal, ppa_string, orig_tarball, on_ppa):
+    """Updates the journal entry of the orig tarball with what the PPA says: It
+    has the tarball if a pending or published source package contains a file of
+    that name (Launchpad doesn't accept different content under the same name
+    anyway). A journal entry alone only means that the upload went through, not
+    that Launchpad accepted it.
+    """
+    filename = os.path.basename(orig_tarball)
+    if on_ppa:
+        print(f"The PPA already has {filename}.\n")
+        journal.put(ppa_string, filename, journal.get_sha256(orig_tarball))
+    else:
+        journal.discard(ppa_string, filename)
+    return
+
+
+def _ppa_has_origs(journal, ppa_string, orig_tarballs):
+    return journal is not None and all(
+        journal.contains(ppa_string, orig_tarball) for orig_tarball in orig_tarballs
+    )
+
+
+def _record_origs(journal, ppa_string, changes_file):
+    """Records the orig tarballs of a successful upload in the journal.
+    """
+    if journal is None:
+        return
+    with open(changes_file, "r") as handle:
+        (changes,) = source.parse_control(handle.read())
+    for line in changes.get("Checksums-Sha256", "").split("\n"):
+        parts = line.split()
+        if parts and source.is_orig_tarball(parts[-1]):
+            journal.put(ppa_string, parts[-1], parts[0])
+    return
+
+
+def _get_versions(directory, version_override=None, version_append_datetime=False):
+    """Returns the package name and the epoch, upstream, debian, and ubuntu
+    version to submit.
+    """
+    entry = changelog.read_latest(os.path.join(directory, "debian", "changelog"))
+    name = entry["package"]
+    version = entry["version"]
+
+    # Dissect version in upstream, debian/ubuntu parts.
+    epoch, upstream_version, debian_version, ubuntu_version = _parse_package_version(
+        version
+    )
+
+    if version_override:
+        upstream_version = version_override
+        debian_version = "1"
+        ubuntu_version = "1"
+
+    if version_append_datetime:
+        dt = datetime.datetime.now().strftime("%Y%m%d%H%M")
+        upstream_version += f"-{dt}"
+
+    return name, epoch, upstream_version, debian_version, ubuntu_version
+
+
+def _get_orig_tarball_name(
+    work_dir, name, upstream_version, compression=None, component=None
+):
+    ext = "gz" if compression is None else compression.codec
+    orig = "orig" if component is None else f"orig-{component}"
+    return os.path.join(work_dir, f"{name}_{upstream_version}.{orig}.tar.{ext}")
+
+
+def _get_compression(
+    directory, name, upstream_version, compression, level, threads, journal, matcher
+):
+    """Returns the `tarball.Compression` of the orig tarball. With `compression`
+    `auto`, it's the one that `tarball.autotune()` finds the quickest to create
+    and upload at the bandwidth measured in earlier uploads. The pick is kept
+    for the upstream version.
+    """
+    if compression != "auto":
+        return tarball_module.Compression(compression, level, threads)
+    picked = journal.get_compression(name, upstream_version)
+    if picked is not None:
+        return tarball_module.Compression(*picked, threads)
+
+    bandwidth = journal.get_bandwidth()
+    print(f"\nTuning compression for {_sizeof_fmt(bandwidth)}/s upload...")
+    with metrics.stage("autotune") as s:
+        best, estimates = tarball_module.autotune(
+            directory, bandwidth, threads, excludes=_ORIG_EXCLUDES, matcher=matcher
+        )
+        s.set(compression=best.codec, level=best.level)
+    for candidate, seconds in estimates:
+        print(f"    {candidate!r}: {seconds:.1f}s")
+    print(f"done ({best!r}, took {s.elapsed_time:.1f}s).")
+    journal.put_compression(name, upstream_version, best.codec, best.level)
+    return best
+
+
+def _hash_source(
+    directory,
+    work_dir,
+    name,
+    upstream_version,
+    single_pass=False,
+    cache_dir=None,
+    use_cache=True,
+    matcher=None,
+    cache=None,
+    compression=None,
+    components=(),
+    workspace=None,
+):
+    """Computes the tree hash of `directory`. With `single_pass`, the orig tarball
+    (without the `components`) is created in `work_dir` at the same time, with the
+    `tarball.Compression` `compression`, unless the store has it already. Paths
+    that the `ignore.Matcher` `matcher` matches are left out of everything. An
+    open `HashCache` can be passed as `cache`; it is left open. The tarball reuses
+    the compressed blocks of the last one in the `workspace.Workspace`
+    `workspace`.
+
+    Returns the short tree hash and the orig tarball (`None` if it hasn't been
+    created).
+    """
+    close_cache = cache is None
+    if cache is None and use_cache:
+        cache = HashCache(cache_dir)
+
+    excludes = _get_orig_excludes(components)
+    prefix = name + "-" + upstream_version
+    if single_pass and cache is not None:
+        # Only ask the store if that doesn't take reading any file.
+        content_hash = tarball_module.get_content_hash(
+            directory, excludes, matcher, cache, cached_only=True
+        )
+        key = _get_orig_key(content_hash, prefix, compression)
+        if content_hash is not None and OrigStore(cache_dir).has(key):
+            single_pass = False
+
+    orig_tarball = None
+    if single_pass:
+        # The tree hash isn't needed before the tarball is created, so both can
+        # be done in a single pass over the source.
+        orig_tarball = _get_orig_tarball_name(
+            work_dir, name, upstream_version, compression
+        )
+        block_cache = _get_block_cache(workspace, compression)
+        print("\nComputing tree hash and creating tarball...")
+        with metrics.stage("hash", single_pass=True) as s:
+            tree_hash, content_hash = stream.hash_and_create_tarball(
+                directory,
+                orig_tarball,
+                prefix,
+                excludes=excludes,
+                cache=cache,
+                matcher=matcher,
+                compression=compression,
+                block_cache=block_cache,
+            )
+            tree_hash_short = tree_hash[:8]
+            _keep_blocks(block_cache, orig_tarball, s)
+            if use_cache:
+                OrigStore(cache_dir).put(
+                    _get_orig_key(content_hash, prefix, compression), orig_tarball
+                )
+            s.set(tarball_bytes=os.path.getsize(orig_tarball))
+        print(
+            "done ({}, {}{}, took {:.1f}s).".format(
+                tree_hash_short,
+                _get_filesize(orig_tarball),
+                _get_reuse_note(block_cache),
+                s.elapsed_time,
+            )
+        )
+    else:
+        print("\nComputing tree hash...")
+        with metrics.stage("hash", single_pass=False) as s:
+            # Hash the source rather than a copy; the cache can only recognize
+            # unchanged files by their inode in the original location.
+            tree_hash_short = _get_tree_hash(directory, cache, matcher)[:8]
+        print(f"done ({tree_hash_short}, took {s.elapsed_time:.1f}s).")
+
+    if cache is not None and close_cache:
+        cache.close()
+    return tree_hash_short, orig_tarball
+
+
+def _stage(directory, orig_dir, do_update_patches=False, matcher=None, sync=False):
+    print("\nSyncing workspace..." if sync else "\nCopying to temporary directory...")
+    with metrics.stage("stage", sync=sync) as s:
+        # Excluded paths are never copied, so they can't end up in the tarball
+        # or the source package either.
+        if sync:
+            counts = sync_tree(directory, orig_dir, matcher=matcher)
+        else:
+            counts = stage_tree(directory, orig_dir, matcher=matcher)
+        s.set(**counts)
+    assert os.path.isdir(os.path.join(orig_dir, "debian"))
+    summary = "{} reflinked, {} hard-linked, {} copied".format(
+        counts["reflinked"], counts["hardlinked"], counts["copied"]
+    )
+    if sync:
+        summary = "{} unchanged, {}, {} deleted".format(
+            counts["unchanged"], summary, counts["deleted"]
+        )
+    print(f"done ({summary}, took {s.elapsed_time:.1f}s).\n")
+    if do_update_patches:
+        _update_patches(orig_dir)
+    return
+
+
+def _get_block_cache(workspace, compression, component=None):
+    if workspace is None or (compression is not None and compression.codec != "gz"):
+        return None
+    return workspace.get_block_cache(component)
+
+
+def _keep_blocks(block_cache, tarball, stage):
+    if block_cache is None:
+        return
+    block_cache.save(tarball)
+    stage.set(blocks_reused=block_cache.hits, blocks_compressed=block_cache.misses)
+    return
+
+
+def _get_reuse_note(block_cache):
+    if block_cache is None or not block_cache.hits:
+        return ""
+    total = block_cache.hits + block_cache.misses
+    return f", {block_cache.hits} of {total} blocks reused"
+
+
+def _create_orig_tarball(
+    orig_dir,
+    work_dir,
+    name,
+    upstream_version,
+    content_hash,
+    cache_dir,
+    use_cache,
+    compression=None,
+    component=None,
+    components=(),
+    workspace=None,
+):
+    """Creates the orig tarball (without the Debian folder and the `components`)
+    in `work_dir`, or takes it from the store. With `component`, it's the
+    component tarball of that subdirectory instead. `content_hash` is the
+    `tarball.get_content_hash()` of what goes into the tarball. Gzip tarballs
+    reuse the compressed blocks of the last tarball in the `workspace.Workspace`
+    `workspace`.
+    """
+    orig_tarball = _get_orig_tarball_name(
+        work_dir, name, upstream_version, compression, component
+    )
+    filename = os.path.basename(orig_tarball)
+    if component is None:
+        directory = orig_dir
+        prefix = name + "-" + upstream_version
+        excludes = _get_orig_excludes(components)
+    else:
+        # dpkg-source renames the top directory of a component to the component,
+        # so the prefix doesn't need the version. The tarball of an unchanged
+        # component can thus be reused for a new version.
+        directory = os.path.join(orig_dir, component)
+        prefix = component
+        excludes = []
+    store = OrigStore(cache_dir) if use_cache else None
+    key = (
+        _get_orig_key(content_hash, prefix, compression) if store is not None else None
+    )
+    with metrics.stage("tarball", component=component) as s:
+        if store is not None and store.get(key, orig_tarball):
+            s.set(reused=True, tarball_bytes=os.path.getsize(orig_tarball))
+            print(f"Reusing stored {filename} ({_get_filesize(orig_tarball)}).\n")
+            return orig_tarball
+
+        # one write, as component tarballs are created concurrently
+        compression_name = repr(compression or tarball_module.Compression())
+        print(f"Creating {filename} ({compression_name})...\n", end="")
+        block_cache = _get_block_cache(workspace, compression, component)
+        _create_tarball(
+            directory,
+            orig_tarball,
+            prefix,
+            excludes=excludes,
+            compression=compression,
+            block_cache=block_cache,
+        )
+        _keep_blocks(block_cache, orig_tarball, s)
+        if store is not None:
+            store.put(key, orig_tarball)
+        s.set(reused=False, tarball_bytes=os.path.getsize(orig_tarball))
+    print(
+        "done ({}, {}{}, took {:.1f}s).\n".format(
+            filename,
+            _get_filesize(orig_tarball),
+            _get_reuse_note(block_cache),
+            s.elapsed_time,
+        )
+    )
+    return orig_tarball
+
+
+def _create_orig_tarballs(
+    directory,
+    orig_dir,
+    work_dir,
+    name,
+    upstream_version,
+    cache_dir,
+    use_cache,
+    compression=None,
+    components=(),
+    orig_tarball=None,
+    workspace=None,
+):
+    """Creates the orig tarball and the component tarballs of `components` from
+    `orig_dir`, the staged copy of `directory`, concurrently (see
+    `_create_orig_tarball()`). Each tarball is stored under the content hash of
+    its staged files, so only changed components are created anew.
+    `orig_tarball` is the orig tarball if it exists already.
+
+    Returns the paths of the orig tarball and the component tarballs.
+    """
+    tarballs = ([] if orig_tarball else [None]) + list(components)
+    content_hashes = {}
+    if use_cache:
+        # The files are hashed where they are tarred from, so the key can't miss
+        # changes by the staging; hard links to the source come from the cache.
+        with HashCache(cache_dir) as cache:
+            for component in tarballs:
+                subdir = component or ""
+                content_hashes[component] = tarball_module.get_content_hash(
+                    os.path.join(orig_dir, subdir),
+                    excludes=[] if component else _get_orig_excludes(components),
+                    cache=cache,
+                    source=(directory, subdir),
+                )
+
+    args = (orig_dir, work_dir, name, upstream_version)
+    fields = metrics.get_context()
+
+    def create(component=None):
+        with metrics.context(**fields):
+            return _create_orig_tarball(
+                *args,
+                content_hashes.get(component),
+                cache_dir,
+                use_cache,
+                compression,
+                component=component,
+                components=components,
+                workspace=workspace,
+            )
+
+    with ThreadPoolExecutor(max_workers=len(components) or 1) as executor:
+        futures = [executor.submit(create, component) for component in components]
+        if orig_tarball is None:
+            orig_tarball = create()
+        return [orig_tarball] + [future.result() for future in futures]
+
+
+@contextlib.contextmanager
+def _open_work_dir(work_dir=None, workspace=None):
+    """Yields `work_dir`, the directory of the locked `workspace.Workspace`
+    `workspace`, or a temporary directory that is removed afterwards.
+    """
+    if workspace is not None:
+        with workspace.lock():
+            workspace.clean()
+            yield workspace.directory
+        return
+    if work_dir is not None:
+        os.makedirs(work_dir, exist_ok=True)
+        yield os.path.abspath(work_dir)
+        return
+    with tempfile.TemporaryDirectory() as tmp:
+        yield tmp
+
+
+def _open_checkpoints(work_dir, resume):
+    """Returns the `checkpoint.StageJournal` of the kept `work_dir`. Unless the
+    submission is resumed, the work directory is emptied first.
+    """
+    checkpoints = checkpoint.StageJournal(work_dir)
+    if not (resume and checkpoints.is_started()):
+        checkpoints.reset()
+    return checkpoints
+
+
+def _resume(checkpoints, key, upstream_version):
+    """Continues the journal of the submission `key` if there is one. Returns the
+    upstream version to use.
+    """
+    if not checkpoints.open(key):
+        checkpoints.put("hashed", upstream_version=upstream_version)
+        return upstream_version
+    print(f"\nResuming the submission in {checkpoints.work_dir}:")
+    for line in checkpoints.get_summary():
+        print(f"    {line}")
+    # The date in the version must not change between runs.
+    return checkpoints.get("hashed")["upstream_version"]
+
+
+def _stage_checkpointed(checkpoints, directory, orig_dir, do_update_patches, matcher):
+    if checkpoints.get("staged") is not None and os.path.isdir(orig_dir):
+        print("\nReusing the copy in the work directory.")
+        return
+    # left over from an interrupted run
+    shutil.rmtree(orig_dir, ignore_errors=True)
+    _stage(directory, orig_dir, do_update_patches, matcher)
+    checkpoints.put("staged")
+    return
+
+
+def _get_checkpoint_tarballs(checkpoints):
+    tarballed = checkpoints.get("tarballed")
+    if tarballed is None:
+        return None
+    print("Reusing {} from the work directory.\n".format(", ".join(tarballed["files"])))
+    return [os.path.join(checkpoints.work_dir, p) for p in tarballed["files"]]
+
+
+def _record_failures(checkpoints, results):
+    failed = [release for release, error in results.items() if error is not None]
+    for release in failed:
+        checkpoints.fail(release, results[release])
+    if failed:
+        print("Run again with --resume to retry the failed releases.\n")
     return
 
 
-def _release_has_same_hash(name, tree_hash_short, ppa, ubuntu_release):
-    # Check if this version has already been published.
-    published_in_series = ppa.getPublishedSources(
-        source_name=name,
-        status="Published",
-        distro_series=(f"https://api.launchpad.net/1.0/ubuntu/{ubuntu_release}"),
+def _get_build(checkpoints, release):
+    """Returns the checkpoint of the source package of `release` if it's still in
+    the work directory, `None` otherwise.
+    """
+    if checkpoints is None:
+        return None
+    built = checkpoints.get("built", release)
+    if built is not None:
+        print(f"\nReusing the source package for {release} from the work directory.")
+    return built
+
+
+def _put_build(checkpoints, release, release_work_dir, name, chlog_version):
+    if checkpoints is None:
+        return
+    changes_file = os.path.join(
+        release_work_dir, f"{name}_{chlog_version}_source.changes"
+    )
+    checkpoints.put(
+        "built",
+        release,
+        files=upload.get_upload_files(changes_file),
+        chlog_version=chlog_version,
+        work_dir=os.path.relpath(release_work_dir, checkpoints.work_dir),
+    )
+    return
+
+
+def _record_upload(journal, ppa_string, name, release, chlog_version):
+    """Records an upload for watching its builds, and returns it."""
+    uploaded = {
+        "ppa": ppa_string,
+        "name": name,
+        "version": chlog_version,
+        "series": release,
+    }
+    journal.put_upload(uploaded)
+    return uploaded
+
+
+def wait_for_builds(journal, uploads, results=None, **kwargs):
+    """Watches the builds of `uploads` (see `watch.wait()`, which gets the keyword
+    arguments) and forgets those with an outcome in the journal. The releases that
+    haven't been built are set to a `watch.BuildError` in `results`. Returns the
+    outcomes.
+    """
+    print("\nWaiting for Launchpad to build {} upload(s)...".format(len(uploads)))
+    with metrics.stage("wait", uploads=len(uploads)):
+        outcomes = watch.wait(uploads, **kwargs)
+    watch.print_summary(outcomes)
+    journal.discard_uploads([o for o in outcomes if o["status"] != "timed out"])
+    if results is not None:
+        for outcome in outcomes:
+            if outcome["status"] != "built":
+                results[outcome["series"]] = watch.BuildError(outcome)
+    return outcomes
+
+
+def _get_submit_all(build_once, jobs):
+    if build_once:
+        return _submit_build_once
+    if jobs > 1:
+        return _submit_parallel
+    return _submit_sequential
+
+
+def read_package(
+    directory,
+    version_override=None,
+    version_append_datetime=False,
+    version_append_hash=False,
+    exclude_patterns=(),
+    components=(),
+):
+    """Reads the name and the versions of the package in `directory`. This is the
+    first of the stages that `submit()`, `batch`, and `daemon` take a package
+    through: `read_package()`, `hash_package()`, `check_package()` (unless the
+    submission is forced), `build_package()`, and `upload_package()`.
+
+    Returns the package as a dictionary that the other stages take.
+    """
+    _check_components(directory, components)
+    name, epoch, upstream_version, debian_version, ubuntu_version = _get_versions(
+        directory, version_override, version_append_datetime
+    )
+    return {
+        "directory": directory,
+        "name": name,
+        "epoch": epoch,
+        "upstream_version": upstream_version,
+        "debian_version": debian_version,
+        "ubuntu_version": ubuntu_version,
+        "version_append_hash": version_append_hash,
+        "components": list(components),
+        # Paths to leave out of the tree hash, the orig tarball, and the source
+        # package, from `.launchpadignore` and `exclude_patterns`
+        "matcher": ignore.read_excludes(directory, exclude_patterns),
+    }
+
+
+def hash_package(
+    package,
+    work_dir,
+    journal,
+    compression="gz",
+    compression_level=None,
+    compression_threads=None,
+    single_pass=False,
+    cache_dir=None,
+    use_cache=True,
+    hash_cache=None,
+    workspace=None,
+):
+    """Picks the compression of the orig tarball (see `_get_compression()`) and
+    computes the tree hash of the package, with `single_pass` creating the orig
+    tarball in `work_dir` at the same time (see `_hash_source()`).
+
+    Returns the package with the keys `compression`, `tree_hash_short`, and
+    `orig_tarball` added.
+    """
+    directory = package["directory"]
+    name = package["name"]
+    upstream_version = package["upstream_version"]
+    compression = _get_compression(
+        directory,
+        name,
+        upstream_version,
+        compression,
+        compression_level,
+        compression_threads,
+        journal,
+        package["matcher"],
+    )
+    tree_hash_short, orig_tarball = _hash_source(
+        directory,
+        work_dir,
+        name,
+        upstream_version,
+        single_pass=single_pass and not package["version_append_hash"],
+        cache_dir=cache_dir,
+        use_cache=use_cache,
+        matcher=package["matcher"],
+        cache=hash_cache,
+        compression=compression,
+        components=package["components"],
+        workspace=workspace,
+    )
+    # Use the `-` as a separator (instead of `~` as it's often seen) to make sure
+    # that ${UBUNTU_RELEASE}x isn't part of the name. This makes it possible to
+    # increment `x` and have launchpad recognize it as a new version.
+    if package["version_append_hash"]:
+        upstream_version += f"-{tree_hash_short}"
+    return {
+        **package,
+        "upstream_version": upstream_version,
+        "compression": compression,
+        "tree_hash_short": tree_hash_short,
+        "orig_tarball": orig_tarball,
+    }
+
+
+def check_package(package, index, ubuntu_releases, dry=False):
+    """Returns the releases among `ubuntu_releases` that the
+    `publications.PublicationIndex` `index` lacks the tree hash for, and the
+    names of the orig and component tarballs the PPA has (`None` if that doesn't
+    matter).
+    """
+    with metrics.stage("publications"):
+        releases = [
+            release
+            for release in ubuntu_releases
+            if not index.has_tree_hash(release, package["tree_hash_short"])
+        ]
+        on_ppa = None
+        if releases and not dry:
+            file_names = index.get_file_names()
+            on_ppa = []
+            for component in [None] + package["components"]:
+                filename = _get_orig_tarball_name(
+                    "",
+                    package["name"],
+                    package["upstream_version"],
+                    package["compression"],
+                    component,
+                )
+                if filename in file_names:
+                    on_ppa.append(filename)
+    return releases, on_ppa
+
+
+def build_package(
+    package,
+    work_dir,
+    releases,
+    ppa_string,
+    launchpad_login_name,
+    journal,
+    upload_release,
+    on_ppa=None,
+    debuild_params="",
+    do_update_patches=False,
+    build_once=False,
+    jobs=1,
+    upload_jobs=1,
+    dry=False,
+    cache_dir=None,
+    use_cache=True,
+    workspace=None,
+    checkpoints=None,
+):
+    """Copies the source to `work_dir` (or syncs the `workspace`), creates the orig
+    tarballs, and builds the source packages for `releases`. Each one is handed to
+    `upload_release(release, work_dir, chlog_version)` once it's built, see
+    `_submit_sequential()`. `on_ppa` is what `check_package()` returns; with
+    `None`, the orig tarballs are uploaded again. Stages that the
+    `checkpoint.StageJournal` `checkpoints` has are skipped.
+
+    Returns a dictionary mapping the releases to `None` on success and the
+    exception otherwise.
+    """
+    directory = package["directory"]
+    name = package["name"]
+    upstream_version = package["upstream_version"]
+    matcher = package["matcher"]
+
+    orig_dir = os.path.join(work_dir, "orig")
+    if checkpoints is None:
+        _stage(directory, orig_dir, do_update_patches, matcher, workspace is not None)
+    else:
+        _stage_checkpointed(
+            checkpoints, directory, orig_dir, do_update_patches, matcher
+        )
+
+    orig_tarballs = None
+    if checkpoints is not None:
+        orig_tarballs = _get_checkpoint_tarballs(checkpoints)
+    if orig_tarballs is None:
+        orig_tarballs = _create_orig_tarballs(
+            directory,
+            orig_dir,
+            work_dir,
+            name,
+            upstream_version,
+            cache_dir,
+            use_cache,
+            package["compression"],
+            package["components"],
+            package["orig_tarball"],
+            workspace,
+        )
+        if checkpoints is not None:
+            checkpoints.put("tarballed", files=orig_tarballs)
+
+    # Without a look at the PPA (forced submissions), the journal may still list
+    # origs that Launchpad rejected, so none of them are left out of the upload.
+    if on_ppa is None and not dry:
+        on_ppa = []
+    if on_ppa is not None:
+        for orig_tarball in orig_tarballs:
+            on = os.path.basename(orig_tarball) in on_ppa
+            _update_orig_journal(journal, ppa_string, orig_tarball, on)
+
+    submit_all = _get_submit_all(build_once, jobs)
+    return submit_all(
+        work_dir,
+        orig_tarballs,
+        orig_dir,
+        releases,
+        jobs,
+        name,
+        upstream_version,
+        package["debian_version"],
+        package["ubuntu_version"],
+        package["epoch"],
+        ppa_string,
+        launchpad_login_name,
+        debuild_params,
+        dry,
+        journal,
+        upload_release,
+        checkpoints=checkpoints,
+        upload_jobs=upload_jobs,
     )
 
-    has_same_hash = False
-    # Expect a package version of the form
-    # 2.1.0~20160504184836-01b3a567-trusty1
-    if published_in_series.entries:
-        # The source_package_versions have the form
-        #
-        #   4.3.1-developer~20161001024503-3ea99bea-1trusty1
-        #
-        # Split those at `-` and take the second-to-last, namely the hash.
-        parts = published_in_series.entries[0]["source_package_version"].split("-")
-        has_same_hash = len(parts) >= 3 and parts[-2] == tree_hash_short
 
-    return has_same_hash
+def upload_package(
+    uploader,
+    journal,
+    package,
+    ppa_string,
+    launchpad_login_name,
+    release,
+    work_dir,
+    chlog_version,
+):
+    """Uploads the source package that `build_package()` has built for `release`
+    in `work_dir`, via the `upload.Uploader` `uploader` or dput. Returns the
+    upload as recorded for watching its builds (see `watch`).
+    """
+    name = package["name"]
+    with metrics.context(package=name, release=release):
+        _upload(
+            uploader,
+            journal,
+            work_dir,
+            name,
+            chlog_version,
+            ppa_string,
+            launchpad_login_name,
+        )
+    return _record_upload(journal, ppa_string, name, release, chlog_version)
 
 
 def submit(
@@ -153,111 +900,492 @@ def submit(
     force=False,
     do_update_patches=False,
     dry=False,
+    cache_dir=None,
+    use_cache=True,
+    jobs=1,
+    build_once=False,
+    publication_ttl=publications.DEFAULT_TTL,
+    exclude_patterns=(),
+    work_dir=None,
+    resume=False,
+    compression="gz",
+    compression_level=None,
+    compression_threads=None,
+    components=(),
+    workspace=None,
+    wait=False,
+    wait_timeout=None,
+    upload_jobs=1,
 ):
+    """Builds the source packages of `directory` for `ubuntu_releases` and uploads
+    them to `ppa_string` as `launchpad_login_name`. Releases that have the tree
+    hash published already are skipped unless `force` is set; with `dry`, only the
+    tarballs and changelogs are created.
+
+    The releases are built in up to `jobs` processes, or with `build_once`, by
+    running `debuild` for the first one only. Each is uploaded while the next ones
+    are built, in up to `upload_jobs` threads. The orig tarball is compressed with
+    `compression` (`gz`, `xz`, `zst`, or `auto`, see `_get_compression()`), and the
+    top-level directories `components` go into component tarballs of their own.
+
+    The work happens in a temporary directory, unless `work_dir` is given. That one
+    is kept, with the completed stages recorded (see `checkpoint`), so that with
+    `resume`, a submission that failed or was interrupted picks up where it
+    stopped. A `workspace` is a kept work directory that is synced with
+    `directory` instead of being filled from scratch (see `workspace`). With
+    `wait`, the builds on Launchpad are watched until they have finished or
+    `wait_timeout` seconds have passed (see `watch`).
+
+    Returns a dictionary mapping the releases to `None` on success and the
+    exception otherwise; releases that failed to build map to a `watch.BuildError`.
+    """
     assert os.path.isdir(os.path.join(directory, "debian")), "debian/ directory missing"
+    assert (
+        work_dir is None or workspace is None
+    ), "work_dir and workspace exclude each other"
+    package = read_package(
+        directory,
+        version_override,
+        version_append_datetime,
+        version_append_hash,
+        exclude_patterns,
+        components,
+    )
 
-    # create temporary working directory
-    with tempfile.TemporaryDirectory() as work_dir:
-        orig_dir = os.path.join(work_dir, "orig")
+    with metrics.context(package=package["name"]), metrics.stage("submit"):
+        journal = UploadJournal(cache_dir, persistent=use_cache)
+
+        # create temporary working directory, unless one is given
+        keep_work_dir = work_dir is not None
+        if workspace is not None:
+            workspace = workspace_module.Workspace(workspace)
+        with _open_work_dir(work_dir, workspace) as work_dir:
+            checkpoints = _open_checkpoints(work_dir, resume) if keep_work_dir else None
+            resuming = checkpoints is not None and checkpoints.is_started()
+
+            package = hash_package(
+                package,
+                work_dir,
+                journal,
+                compression,
+                compression_level,
+                compression_threads,
+                single_pass=force and not resuming,
+                cache_dir=cache_dir,
+                use_cache=use_cache,
+                workspace=workspace,
+            )
 
-        print("Copying to temporary directory...")
-        tic = time.time()
-        copy_tree(directory, orig_dir)
-        # remove git folder
-        shutil.rmtree(os.path.join(orig_dir, ".git"))
-        debian_dir = os.path.join(orig_dir, "debian")
-        assert os.path.isdir(debian_dir)
-        elapsed_time = time.time() - tic
-        print(f"done (took {elapsed_time:.1f}s).")
+            if checkpoints is not None:
+                # Anything that changes the packages starts the journal over.
+                key = {
+                    "directory": os.path.realpath(directory),
+                    "tree_hash": package["tree_hash_short"],
+                    "ppa": ppa_string,
+                    "version_override": version_override,
+                    "version_append_datetime": version_append_datetime,
+                    "version_append_hash": version_append_hash,
+                    "update_patches": do_update_patches,
+                    "debuild_params": debuild_params,
+                    "exclude_patterns": list(exclude_patterns),
+                    "components": list(components),
+                    **package["compression"].get_key(),
+                }
+                upstream_version = _resume(
+                    checkpoints, key, package["upstream_version"]
+                )
+                package = {**package, "upstream_version": upstream_version}
+
+            # Check which ubuntu series we need to submit to. This happens before
+            # anything is copied, so runs without changes are cheap.
+            on_ppa = None
+            if force:
+                submit_releases = ubuntu_releases
+            else:
+                # Check if this version has already been published.
+                print("\nChecking for tree hash on PPA...")
+                index = publications.PublicationIndex(
+                    ppa_string,
+                    package["name"],
+                    cache_dir=cache_dir,
+                    ttl=publication_ttl,
+                    persistent=use_cache,
+                )
+                submit_releases, on_ppa = check_package(
+                    package, index, ubuntu_releases, dry
+                )
+                print("done.")
+
+            if not submit_releases:
+                print("\nEverything up-to-date. No submissions necessary.\n")
+                return {}
+
+            print("\nSubmitting to {}.".format(", ".join(submit_releases)))
+
+            # The SFTP connection stays open for all releases; Launchpad processes the
+            # uploads once it's closed.
+            uploads = []
+            with upload.Uploader(launchpad_login_name) as uploader:
+
+                def upload_release(release, release_work_dir, chlog_version):
+                    if checkpoints is not None and checkpoints.get("uploaded", release):
+                        print(f"\n{release} has been uploaded already.")
+                        return
+                    uploaded = upload_package(
+                        uploader,
+                        journal,
+                        package,
+                        ppa_string,
+                        launchpad_login_name,
+                        release,
+                        release_work_dir,
+                        chlog_version,
+                    )
+                    uploads.append(uploaded)
+                    if checkpoints is not None:
+                        checkpoints.put("uploaded", release)
+
+                results = build_package(
+                    package,
+                    work_dir,
+                    submit_releases,
+                    ppa_string,
+                    launchpad_login_name,
+                    journal,
+                    upload_release,
+                    on_ppa=on_ppa,
+                    debuild_params=debuild_params,
+                    do_update_patches=do_update_patches,
+                    build_once=build_once,
+                    jobs=jobs,
+                    upload_jobs=upload_jobs,
+                    dry=dry,
+                    cache_dir=cache_dir,
+                    use_cache=use_cache,
+                    workspace=workspace,
+                    checkpoints=checkpoints,
+                )
 
-        name, version = _get_info_from_changelog(os.path.join(debian_dir, "changelog"))
+            if wait and uploads:
+                wait_for_builds(journal, uploads, results, timeout=wait_timeout)
+            _print_results(results)
+            if checkpoints is not None:
+                _record_failures(checkpoints, results)
+    return results
 
-        print("\nComputing tree hash...")
-        tic = time.time()
-        tree_hash_short = _get_tree_hash(orig_dir)[:8]
-        elapsed_time = time.time() - tic
-        print(f"done ({tree_hash_short}, took {elapsed_time:.1f}s).")
-
-        # check which ubuntu series we need to submit to
-        if force:
-            submit_releases = ubuntu_releases
+
+def _print_results(results):
+    print("\nResults:")
+    for release, error in results.items():
+        if error is None:
+            print(f"    {release}: success")
         else:
-            # Check if this version has already been published.
-            print("\nChecking for tree hash on PPA...")
-            launchpad = Launchpad.login_anonymously("foo", "production", None)
-            ppa_owner, ppa_name = tuple(ppa_string.split("/"))
-            owner = launchpad.people[ppa_owner]
-            ppa = owner.getPPAByName(name=ppa_name)
-
-            submit_releases = [
-                release
-                for release in ubuntu_releases
-                if not _release_has_same_hash(name, tree_hash_short, ppa, release)
-            ]
-            print("done.")
-
-        if not submit_releases:
-            print("\nEverything up-to-date. No submissions necessary.\n")
-            return
-
-        print("\nSubmitting to {}.\n".format(", ".join(submit_releases)))
-
-        # Dissect version in upstream, debian/ubuntu parts.
-        epoch, upstream_version, debian_version, ubuntu_version = _parse_package_version(
-            version
-        )
+            print(f"    {release}: FAILED ({type(error).__name__}: {error})")
+    print()
 
-        if do_update_patches:
-            _update_patches(orig_dir)
 
-        if version_override:
-            upstream_version = version_override
-            debian_version = "1"
-            ubuntu_version = "1"
+def _submit_sequential(
+    work_dir,
+    orig_tarballs,
+    orig_dir,
+    releases,
+    jobs,
+    name,
+    upstream_version,
+    debian_version,
+    ubuntu_version,
+    epoch,
+    ppa_string,
+    launchpad_login_name,
+    debuild_params,
+    dry,
+    journal=None,
+    upload_release=None,
+    checkpoints=None,
+    upload_jobs=1,
+):
+    """Builds the releases one after another in `orig_dir`; each is uploaded while
+    the next one is built, see `pipeline`. Uploads go through
+    `upload_release(release, work_dir, chlog_version)`, in up to `upload_jobs`
+    threads. Source packages that the `checkpoint.StageJournal` `checkpoints` has
+    are not built again. Returns a dictionary mapping the releases to `None` on
+    success and the exception otherwise.
+    """
 
-        if version_append_datetime:
-            dt = datetime.datetime.now().strftime("%Y%m%d%H%M")
-            upstream_version += f"-{dt}"
+    def build(ubuntu_release):
+        built = _get_build(checkpoints, ubuntu_release)
+        if built is not None:
+            return built["chlog_version"]
+        # The orig tarball is only uploaded until the PPA has it.
+        include_orig = not _ppa_has_origs(journal, ppa_string, orig_tarballs)
+        chlog_version = _submit(
+            work_dir,
+            orig_tarballs,
+            orig_dir,
+            name,
+            upstream_version,
+            debian_version,
+            ubuntu_version,
+            ubuntu_release,
+            epoch,
+            ppa_string,
+            launchpad_login_name,
+            debuild_params,
+            dry,
+            include_orig,
+        )
+        if not dry:
+            _put_build(checkpoints, ubuntu_release, work_dir, name, chlog_version)
+        return chlog_version
 
-        # Use the `-` as a separator (instead of `~` as it's often seen) to make sure that
-        # ${UBUNTU_RELEASE}x isn't part of the name. This makes it possible to increment `x`
-        # and have launchpad recognize it as a new version.
-        if version_append_hash:
-            upstream_version += f"-{tree_hash_short}"
+    def upload(ubuntu_release, chlog_version):
+        if not dry:
+            upload_release(ubuntu_release, work_dir, chlog_version)
 
-        # Create orig tarball (without the Debian folder).
-        orig_tarball = os.path.join(work_dir, f"{name}_{upstream_version}.orig.tar.gz")
-        prefix = name + "-" + upstream_version
-        print("Creating tarball...")
-        tic = time.time()
-        _create_tarball(orig_dir, orig_tarball, prefix, excludes=["./debian"])
-        elapsed_time = time.time() - tic
-        print(
-            "done ({}, took {:.1f}s).\n".format(
-                _get_filesize(orig_tarball), elapsed_time
-            )
+    # All builds happen in `orig_dir`, so one at a time.
+    return pipeline.run(
+        releases, build, upload, upload_jobs=upload_jobs, errors=_RELEASE_ERRORS
+    )
+
+
+def _submit_build_once(
+    work_dir,
+    orig_tarballs,
+    orig_dir,
+    releases,
+    jobs,
+    name,
+    upstream_version,
+    debian_version,
+    ubuntu_version,
+    epoch,
+    ppa_string,
+    launchpad_login_name,
+    debuild_params,
+    dry,
+    journal=None,
+    upload_release=None,
+    checkpoints=None,
+    upload_jobs=1,
+):
+    """Like `_submit_sequential()`, but `debuild` (and with it lintian) only runs
+    for the first release. The source packages of all others are derived from
+    its output, see `source.derive_source_package()`.
+    """
+    first = releases[0]
+    template_version, slot_version = _get_chlog_version(
+        upstream_version, debian_version, ubuntu_version, first, epoch
+    )
+    _create_changelog(orig_dir, name, slot_version, first)
+    if dry:
+        return _submit_sequential(
+            work_dir,
+            orig_tarballs,
+            orig_dir,
+            releases,
+            jobs,
+            name,
+            upstream_version,
+            debian_version,
+            ubuntu_version,
+            epoch,
+            ppa_string,
+            launchpad_login_name,
+            debuild_params,
+            dry,
+            journal,
+            upload_release,
+            checkpoints,
+            upload_jobs,
         )
 
-        for ubuntu_release in submit_releases:
-            try:
-                _submit(
-                    work_dir,
-                    [orig_tarball],
+    if _get_build(checkpoints, first) is None:
+        try:
+            with metrics.context(release=first):
+                _debuild(
                     orig_dir,
-                    name,
-                    upstream_version,
-                    debian_version,
-                    ubuntu_version,
-                    ubuntu_release,
-                    epoch,
-                    ppa_string,
-                    launchpad_login_name,
                     debuild_params,
-                    dry,
+                    not _ppa_has_origs(journal, ppa_string, orig_tarballs),
                 )
-            except DputException:
-                pass
-    return
+        except subprocess.CalledProcessError as e:
+            # Nothing to derive from
+            return {release: e for release in releases}
+        _put_build(checkpoints, first, work_dir, name, template_version)
+
+    with open(os.path.join(work_dir, f"{name}_{template_version}.dsc")) as f:
+        (dsc,) = source.parse_control(f.read())
+    if source.get_debian_tarball_ext(dsc, name, template_version) is None:
+        print("Not a 3.0 (quilt) source package, building all releases.")
+        derive = False
+    else:
+        derive = True
+
+    def build(ubuntu_release):
+        chlog_version, slot_version = _get_chlog_version(
+            upstream_version, debian_version, ubuntu_version, ubuntu_release, epoch
+        )
+        if ubuntu_release == first or _get_build(checkpoints, ubuntu_release):
+            return chlog_version
+        include_orig = not _ppa_has_origs(journal, ppa_string, orig_tarballs)
+        with metrics.context(release=ubuntu_release):
+            _create_changelog(orig_dir, name, slot_version, ubuntu_release)
+            if derive:
+                with metrics.stage("derive"):
+                    source.derive_source_package(
+                        work_dir,
+                        orig_dir,
+                        name,
+                        template_version,
+                        chlog_version,
+                        _get_debsign_params(debuild_params),
+                        include_orig,
+                    )
+            else:
+                _debuild(orig_dir, debuild_params, include_orig)
+        _put_build(checkpoints, ubuntu_release, work_dir, name, chlog_version)
+        return chlog_version
+
+    def upload(ubuntu_release, chlog_version):
+        upload_release(ubuntu_release, work_dir, chlog_version)
+
+    return pipeline.run(
+        releases, build, upload, upload_jobs=upload_jobs, errors=_RELEASE_ERRORS
+    )
+
+
+def _get_debsign_params(debuild_params):
+    # The key selection is the only debuild option that matters for debsign.
+    return [p for p in debuild_params.split() if p.startswith("-k")]
+
+
+def _stage_release(work_dir, orig_dir, orig_tarballs, release):
+    """Gives a release its own working directory with a copy of `orig_dir` in which
+    only `debian/` (and the patched files) are actual copies, and links to the
+    `orig_tarballs`.
+    """
+    release_dir = os.path.join(work_dir, release)
+    # left over from an interrupted run in a kept work directory
+    shutil.rmtree(release_dir, ignore_errors=True)
+    os.makedirs(release_dir)
+    stage_tree(orig_dir, os.path.join(release_dir, os.path.basename(orig_dir)))
+    for orig_tarball in orig_tarballs:
+        dest = os.path.join(release_dir, os.path.basename(orig_tarball))
+        try:
+            os.link(orig_tarball, dest)
+        except OSError:
+            shutil.copy2(orig_tarball, dest)
+    return release_dir
+
+
+def run_logged(log_file, function, *args):
+    """Runs `function(*args)` with all output, including that of subprocesses,
+    redirected to `log_file`, and returns its result.
+    """
+    sys.stdout.flush()
+    sys.stderr.flush()
+    saved = [os.dup(1), os.dup(2)]
+    with open(log_file, "w") as log:
+        os.dup2(log.fileno(), 1)
+        os.dup2(log.fileno(), 2)
+        try:
+            return function(*args)
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            for fd, saved_fd in zip([1, 2], saved):
+                os.dup2(saved_fd, fd)
+                os.close(saved_fd)
+
+
+def _submit_parallel(
+    work_dir,
+    orig_tarballs,
+    orig_dir,
+    releases,
+    jobs,
+    name,
+    upstream_version,
+    debian_version,
+    ubuntu_version,
+    epoch,
+    ppa_string,
+    launchpad_login_name,
+    debuild_params,
+    dry,
+    journal=None,
+    upload_release=None,
+    checkpoints=None,
+    upload_jobs=1,
+):
+    """Like `_submit_sequential()`, but the packages are built in a pool of `jobs`
+    processes, each release in its own working directory. The output of each
+    build is printed in one piece once it's done. Uploads happen in this process
+    so they can share the uploader's connection.
+    """
+    # All builds start before the first upload is done, so only origs the PPA had
+    # beforehand can be left out. Within the run, the uploader's connection sends
+    # the orig only once anyway.
+    include_orig = not _ppa_has_origs(journal, ppa_string, orig_tarballs)
+    with ProcessPoolExecutor(
+        max_workers=jobs,
+        initializer=metrics.enable,
+        initargs=(metrics.get_filename(),),
+    ) as executor:
+
+        def build(ubuntu_release):
+            """Returns the working directory and the changelog version."""
+            built = _get_build(checkpoints, ubuntu_release)
+            if built is not None:
+                release_dir = os.path.join(work_dir, built["work_dir"])
+                return os.path.normpath(release_dir), built["chlog_version"]
+            release_dir = _stage_release(
+                work_dir, orig_dir, orig_tarballs, ubuntu_release
+            )
+            args = (
+                release_dir,
+                [os.path.join(release_dir, os.path.basename(t)) for t in orig_tarballs],
+                os.path.join(release_dir, os.path.basename(orig_dir)),
+                name,
+                upstream_version,
+                debian_version,
+                ubuntu_version,
+                ubuntu_release,
+                epoch,
+                ppa_string,
+                launchpad_login_name,
+                debuild_params,
+                dry,
+                include_orig,
+            )
+            log_file = os.path.join(work_dir, f"{ubuntu_release}.log")
+            future = executor.submit(run_logged, log_file, _submit, *args)
+            try:
+                chlog_version = future.result()
+            finally:
+                with open(log_file) as f:
+                    print(f"==> {ubuntu_release} <==\n{f.read()}")
+            if not dry:
+                _put_build(
+                    checkpoints, ubuntu_release, release_dir, name, chlog_version
+                )
+            return release_dir, chlog_version
+
+        def upload(ubuntu_release, built):
+            if not dry:
+                upload_release(ubuntu_release, *built)
+
+        # Each build waits for its process in a thread. The queue holds as many
+        # packages as there are build processes, so a slow upload doesn't hold up
+        # the builds right away.
+        return pipeline.run(
+            releases,
+            build,
+            upload,
+            build_jobs=jobs,
+            upload_jobs=upload_jobs,
+            queue_size=jobs,
+            errors=_RELEASE_ERRORS,
+        )
 
 
 def _submit(
@@ -274,18 +1402,16 @@ def _submit(
     launchpad_login_name,
     debuild_params="",
     dry=False,
+    include_orig=True,
 ):
-    # quick workaround
-    # TODO fix
-    assert len(orig_tarballs) == 1
-    orig_tarball = orig_tarballs[0]
-
-    # Assert tarball at
-    #     /work_dir/trilinos_4.3.1.2~20121123-01b3a567.orig.tar.gz.
+    # Assert the tarballs at, e.g.,
+    #     /work_dir/trilinos_4.3.1.2~20121123-01b3a567.orig.tar.gz,
+    #     /work_dir/trilinos_4.3.1.2~20121123-01b3a567.orig-docs.tar.gz.
     #
-    _, ext = os.path.splitext(orig_tarball)
-    tarball_dest = f"{name}_{upstream_version}.orig.tar{ext}"
-    assert os.path.isfile(os.path.join(work_dir, tarball_dest))
+    for orig_tarball in orig_tarballs:
+        filename = os.path.basename(orig_tarball)
+        assert filename.startswith(f"{name}_{upstream_version}.orig")
+        assert os.path.isfile(os.path.join(work_dir, filename))
 
     # Get last component of `orig_dir`, cf.
     # <http://stackoverflow.com/a/3925147/353337>.
@@ -295,6 +1421,22 @@ def _submit(
     debian_dir = os.path.join(work_dir, prefix, "debian")
     assert os.path.isdir(debian_dir)
 
+    chlog_version, slot_version = _get_chlog_version(
+        upstream_version, debian_version, ubuntu_version, ubuntu_release, slot
+    )
+    with metrics.context(package=name, release=ubuntu_release):
+        _create_changelog(orig_dir, name, slot_version, ubuntu_release)
+        if not dry:
+            _debuild(orig_dir, debuild_params, include_orig)
+    return chlog_version
+
+
+def _get_chlog_version(
+    upstream_version, debian_version, ubuntu_version, ubuntu_release, slot
+):
+    """Returns the version for the changelog of `ubuntu_release`, without and with
+    epoch.
+    """
     # We cannot use "-ubuntu1" as a suffix here since we'd like to submit for multiple
     # ubuntu releases. If the version strings were exactly the same, the following error
     # is produced on upload:
@@ -315,6 +1457,10 @@ def _submit(
     if slot:
         slot_version = slot + ":" + chlog_version
 
+    return chlog_version, slot_version
+
+
+def _create_changelog(orig_dir, name, slot_version, ubuntu_release):
     # From `man dpkg-genchanges`:
     # By default, or if specified, the original source will be included only if the
     # upstream version number (the version without epoch and without Debian revision)
@@ -326,31 +1472,23 @@ def _submit(
     # Unable to find matplotlib_2.0.0~beta4.orig.tar.gz in upload or distribution.
     # ```
     # Hence, remove old changelog and create it anew.
-    os.remove(os.path.join(work_dir, prefix, "debian", "changelog"))
-    subprocess.check_call(
-        [
-            "dch",
-            "--create",
-            "--package",
-            name,
-            # '-b',  # force
-            "-v",
-            slot_version,
-            "--distribution",
-            ubuntu_release,
-            "launchpad-submit update",
-        ],
-        cwd=os.path.join(work_dir, prefix),
+    changelog.write(
+        os.path.join(orig_dir, "debian", "changelog"),
+        name,
+        slot_version,
+        ubuntu_release,
     )
+    return
 
-    if dry:
-        return
 
+def _debuild(orig_dir, debuild_params="", include_orig=True):
     # Call debuild, the actual workhorse
-    subprocess.check_call(
+    metrics.check_call(
         [
             "debuild",
             debuild_params,
+            # leave the orig tarball out of the upload if the PPA already has it
+            "-sa" if include_orig else "-sd",
             "-S",  # build source package only
             # build dependencies are only needed on launchpad, not locally
             "--no-check-builddeps",
@@ -358,24 +1496,48 @@ def _submit(
             "-EvIL",
             "+pedantic",
         ],
-        cwd=os.path.join(work_dir, prefix),
+        cwd=orig_dir,
     )
+    return
+
 
+def _upload(
+    uploader, journal, work_dir, name, chlog_version, ppa_string, launchpad_login_name
+):
     # Submit to launchpad.
     print()
     print(f"Uploading to PPA {ppa_string}...")
     print()
-    for filename in [
-        # f"{name}_{chlog_version}.debian.tar.xz",
-        f"{name}_{chlog_version}.dsc",
-        f"{name}_{chlog_version}_source.build",
-        f"{name}_{chlog_version}_source.changes",
-        f"{name}_{upstream_version}.orig.tar.gz",
-    ]:
-        size_str = _get_filesize(os.path.join(work_dir, filename))
-        print(f"    {filename}: {size_str}")
+    changes_file = os.path.join(work_dir, f"{name}_{chlog_version}_source.changes")
+    for path in upload.get_upload_files(changes_file):
+        print(f"    {os.path.basename(path)}: {_get_filesize(path)}")
     print()
 
+    with metrics.stage("upload", ppa=ppa_string) as s:
+        if uploader is not None:
+            try:
+                sent = uploader.upload(ppa_string, changes_file)
+            except upload.UploadError as e:
+                print(f"SFTP upload failed ({e}), falling back to dput.")
+            else:
+                s.set(method="sftp", sent_bytes=sent)
+                if journal is not None:
+                    journal.record_bandwidth(sent, s.elapsed_time)
+                print(
+                    "done ({} sent, took {:.1f}s).".format(
+                        _sizeof_fmt(sent), s.elapsed_time
+                    )
+                )
+                _record_origs(journal, ppa_string, changes_file)
+                return
+
+        s.set(method="dput")
+        _dput(work_dir, name, chlog_version, ppa_string, launchpad_login_name)
+    _record_origs(journal, ppa_string, changes_file)
+    return
+
+
+def _dput(work_dir, name, chlog_version, ppa_string, launchpad_login_name):
     # Alternative upload from Ubuntu:
     # ```
     # subprocess.check_call([
@@ -398,16 +1560,14 @@ def _submit(
     success = False
     for method, login_name in configs:
         with open(dput_config, "w") as f:
-            f.write(
-                f"""[{name}-nightly]
+            f.write(f"""[{name}-nightly]
 fqdn = ppa.launchpad.net
 method = {method}
 incoming = ~{ppa_string}/ubuntu/
 login = {login_name}
-allow_unsigned_uploads = 0"""
-            )
+allow_unsigned_uploads = 0""")
         try:
-            subprocess.check_call(
+            metrics.check_call(
                 [
                     "dput",
                     "-c",
@@ -415,7 +1575,7 @@ allow_unsigned_uploads = 0"""
                     f"{name}-nightly",
                     f"{name}_{chlog_version}_source.changes",
                 ],
-                os.chdir(work_dir),
+                cwd=work_dir,
             )
         except subprocess.CalledProcessError as exception:
             print("Command:")
@@ -436,52 +1596,67 @@ allow_unsigned_uploads = 0"""
 
 def _update_patches(directory):
     """debuild's patch apply doesn't allow fuzz, but fuzz is often what happens
-    when applying a Debian patch to the master branch. `patch` itself is more
-    robust, so use that here to update the Debian patches.
+    when applying a Debian patch to the master branch. So apply the patches with
+    fuzz here and refresh them, see `patches.update_patches()`. quilt is only used
+    for patches that can't be handled natively.
     """
     print("Updating patches...")
+    with metrics.stage("update_patches") as s:
+        try:
+            refreshed, removed = patches.update_patches(directory)
+        except patches.UnsupportedPatchError as e:
+            print(f"{e}, falling back to quilt.")
+            _update_quilt_patches(directory)
+        else:
+            for name in refreshed:
+                print(f"Refreshed patch {name}.")
+            for name in removed:
+                print(f"Deleted patch {name}.")
+            s.set(refreshed=len(refreshed), removed=len(removed))
+
+    # Remove the ubuntu.series file since it's not handled by quilt.
+    ubuntu_series = os.path.join(directory, "debian", "patches", "ubuntu.series")
+    if os.path.isfile(ubuntu_series):
+        os.remove(ubuntu_series)
+    return
+
+
+def _update_quilt_patches(directory):
+    # Keep PATH and the like; quilt must be found.
+    env = dict(os.environ, QUILT_PATCHES="debian/patches")
 
     # We need the number of patches so we don't call `quilt push` too often.
-    out = subprocess.check_output(
-        ["quilt", "series"], env={"QUILT_PATCHES": "debian/patches"}, cwd=directory
-    )
+    out = metrics.check_output(["quilt", "series"], env=env, cwd=directory)
     all_patches = out.decode("utf-8").split("\n")[:-1]
 
     for patch in all_patches:
         try:
-            subprocess.check_call(
+            metrics.check_call(
                 ["quilt", "push"],
-                env={"QUILT_PATCHES": "debian/patches"},
+                env=env,
                 cwd=directory,
             )
-            subprocess.check_call(
+            metrics.check_call(
                 ["quilt", "refresh"],
-                env={"QUILT_PATCHES": "debian/patches"},
+                env=env,
                 cwd=directory,
             )
         except subprocess.CalledProcessError:
             # If applied and refreshing the patch didn't work, remove it.
             print("Deleting patch {patch}...")
-            subprocess.check_call(
+            metrics.check_call(
                 ["quilt", "delete", "-nr"],
-                env={"QUILT_PATCHES": "debian/patches"},
+                env=env,
                 cwd=directory,
             )
 
     # undo all patches; only the changes in the debian/patches/ remain.
-    out = subprocess.check_output(
-        ["quilt", "series"], env={"QUILT_PATCHES": "debian/patches"}, cwd=directory
-    )
+    out = metrics.check_output(["quilt", "series"], env=env, cwd=directory)
     all_patches = out.decode("utf-8").split("\n")[:-1]
     if all_patches:
-        subprocess.check_call(
+        metrics.check_call(
             ["quilt", "pop", "-a"],
-            env={"QUILT_PATCHES": "debian/patches"},
+            env=env,
             cwd=directory,
         )
-
-    # Remove the ubuntu.series file since it's not handled by quilt.
-    ubuntu_series = os.path.join(directory, "debian", "patches", "ubuntu.series")
-    if os.path.isfile(ubuntu_series):
-        os.remove(ubuntu_series)
     return
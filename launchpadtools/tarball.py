@@ -0,0 +1,674 @@
+# -*- coding: utf-8 -*-
+#
+"""
+Reproducible tarballs with parallel gzip, xz, or zstd compression.
+
+Identical content always gives identical archives: Entries are sorted, and
+timestamps, owners, and permissions are normalized. The gzip compression works
+like pigz: The data is split into blocks which are compressed concurrently, each
+with the tail of the previous block as dictionary, and the results are
+concatenated into one standard gzip member. The xz compression works like `xz
+-T`: Blocks are compressed independently and concurrently and make up one xz
+stream. zstd compression runs the `zstd` executable with its worker threads.
+
+Since every gzip block only depends on its input and the dictionary, a
+`GzipBlockCache` can provide the compressed blocks of an earlier tarball, so only
+the blocks that changed are compressed again.
+"""
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+import hashlib
+import json
+import lzma
+import os
+import shutil
+import stat
+import struct
+import subprocess
+import tarfile
+import tempfile
+import time
+import zlib
+
+from . import treehash
+
+BLOCK_SIZE = 128 * 1024
+DICT_SIZE = 32 * 1024
+# Uncompressed size of the xz blocks; like `xz -T`, three times the dictionary
+# size of the default preset
+XZ_BLOCK_SIZE = 24 * 1024 * 1024
+
+# Compressions (and file name extensions) with their default levels
+DEFAULT_LEVELS = {"gz": 6, "xz": 6, "zst": 3}
+_MAX_LEVELS = {"gz": 9, "xz": 9, "zst": 19}
+
+
+class CompressionError(Exception):
+    pass
+
+
+def _compress_block(data, zdict, level, last):
+    if zdict:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15, 9, zdict=zdict)
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15, 9)
+    # A sync flush ends the block on a byte boundary so that the compressed blocks
+    # can simply be concatenated.
+    return compressor.compress(data) + compressor.flush(
+        zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH
+    )
+
+
+class GzipBlockCache:
+    """The compressed blocks of the gzip tarball `previous` by a digest of their
+    input, the dictionary, and the level, as listed in the index
+    `previous.blocks.json`. `ParallelGzipWriter` takes blocks from here instead of
+    compressing them, and records the blocks it writes; `save()` keeps the new
+    tarball and its index as the next `previous`.
+
+    The blocks are cut at fixed offsets of the tar stream. A file that changes its
+    size shifts all data after it (unless the change is absorbed by the padding
+    to 512 bytes), so no later block is found here anymore.
+    """
+
+    def __init__(self, previous):
+        self.previous = previous
+        self.index_filename = previous + ".blocks.json"
+        self.blocks = {}
+        self.new_blocks = {}
+        self.hits = 0
+        self.misses = 0
+        try:
+            with open(self.index_filename) as handle:
+                index = json.load(handle)
+            if os.path.getsize(previous) == index["size"]:
+                self.blocks = index["blocks"]
+        except (OSError, ValueError, KeyError):
+            # no (usable) earlier tarball; compress everything
+            pass
+        self._handle = None
+
+    @staticmethod
+    def get_key(block, zdict, level, last):
+        sha = hashlib.sha256(struct.pack("<BBI", level, last, len(zdict)))
+        sha.update(zdict)
+        sha.update(block)
+        return sha.hexdigest()
+
+    def get(self, key):
+        """Returns the compressed block for `key`, or `None`."""
+        if key not in self.blocks:
+            self.misses += 1
+            return None
+        offset, length = self.blocks[key]
+        if self._handle is None:
+            self._handle = open(self.previous, "rb")
+        data = os.pread(self._handle.fileno(), length, offset)
+        if len(data) != length:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return data
+
+    def put(self, key, offset, length):
+        self.new_blocks[key] = [offset, length]
+
+    def close(self):
+        if self._handle is not None:
+            self._handle.close()
+            self._handle = None
+
+    def save(self, tarball):
+        """Keeps `tarball`, which must have been written with this cache, for the
+        next tarball.
+        """
+        self.close()
+        # Drop the index first so that it never describes the wrong file.
+        if os.path.exists(self.index_filename):
+            os.remove(self.index_filename)
+        tmp = f"{self.previous}.{os.getpid()}.tmp"
+        try:
+            os.link(tarball, tmp)
+        except OSError:
+            shutil.copyfile(tarball, tmp)
+        os.replace(tmp, self.previous)
+        index = {"size": os.path.getsize(self.previous), "blocks": self.new_blocks}
+        with open(tmp, "w") as handle:
+            json.dump(index, handle)
+        os.replace(tmp, self.index_filename)
+        self.blocks = self.new_blocks
+        self.new_blocks = {}
+        return
+
+
+class ParallelGzipWriter:
+    """Write-only file object producing a gzip stream. The output only depends on
+    the input data, the compression level, and the block size, not on the number
+    of workers. Blocks found in the `GzipBlockCache` `block_cache` aren't
+    compressed again.
+    """
+
+    def __init__(
+        self,
+        fileobj,
+        level=6,
+        max_workers=None,
+        block_size=BLOCK_SIZE,
+        block_cache=None,
+    ):
+        self.fileobj = fileobj
+        self.level = level
+        self.block_size = block_size
+        self.block_cache = block_cache
+        if max_workers is None:
+            max_workers = os.cpu_count() or 1
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.max_pending = 2 * max_workers
+        self.pending = deque()
+        self.buffer = bytearray()
+        self.zdict = b""
+        self.crc = 0
+        self.size = 0
+        self.closed = False
+        # gzip header without time stamp and file name, OS "Unix" like `gzip -n`
+        xfl = 2 if level == 9 else (4 if level == 1 else 0)
+        self.fileobj.write(struct.pack("<BBBBIBB", 0x1F, 0x8B, 8, 0, 0, xfl, 3))
+        self.offset = 10
+
+    def write(self, data):
+        self.buffer += data
+        self.crc = zlib.crc32(data, self.crc)
+        self.size += len(data)
+        while len(self.buffer) > self.block_size:
+            self._submit(bytes(self.buffer[: self.block_size]), last=False)
+            del self.buffer[: self.block_size]
+        return len(data)
+
+    def _submit(self, block, last):
+        key = None
+        data = None
+        if self.block_cache is not None:
+            key = self.block_cache.get_key(block, self.zdict, self.level, last)
+            data = self.block_cache.get(key)
+        if data is None:
+            future = self.executor.submit(
+                _compress_block, block, self.zdict, self.level, last
+            )
+        else:
+            future = Future()
+            future.set_result(data)
+        self.pending.append((key, future))
+        self.zdict = block[-DICT_SIZE:]
+        while len(self.pending) > self.max_pending:
+            self._write_pending()
+
+    def _write_pending(self):
+        key, future = self.pending.popleft()
+        data = future.result()
+        if key is not None:
+            self.block_cache.put(key, self.offset, len(data))
+        self.fileobj.write(data)
+        self.offset += len(data)
+
+    def close(self):
+        if self.closed:
+            return
+        self._submit(bytes(self.buffer), last=True)
+        self.buffer = bytearray()
+        while self.pending:
+            self._write_pending()
+        self.executor.shutdown()
+        self.fileobj.write(struct.pack("<II", self.crc, self.size & 0xFFFFFFFF))
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def _encode_varint(value):
+    out = bytearray()
+    while value >= 0x80:
+        out.append(value & 0x7F | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def _decode_varint(data, pos):
+    value = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+def _compress_xz_block(data, preset):
+    """Compresses `data` into a single xz block. Returns the block and its
+    unpadded and uncompressed sizes for the index.
+    """
+    stream = lzma.compress(
+        data, format=lzma.FORMAT_XZ, check=lzma.CHECK_CRC64, preset=preset
+    )
+    # stream header (12 bytes), block, index, stream footer (12 bytes)
+    index_size = (struct.unpack("<I", stream[-8:-4])[0] + 1) * 4
+    index = stream[-12 - index_size : -12]
+    count, pos = _decode_varint(index, 1)
+    assert count == 1
+    unpadded_size, pos = _decode_varint(index, pos)
+    uncompressed_size, _ = _decode_varint(index, pos)
+    return stream[12 : -12 - index_size], unpadded_size, uncompressed_size
+
+
+class ParallelXzWriter:
+    """Write-only file object producing an xz stream of independently compressed
+    blocks, like `xz -T`. The output only depends on the input data and the
+    preset, not on the number of workers.
+    """
+
+    # stream flags: CRC64 check
+    _FLAGS = b"\x00\x04"
+
+    def __init__(self, fileobj, level=6, max_workers=None, block_size=XZ_BLOCK_SIZE):
+        self.fileobj = fileobj
+        self.level = level
+        self.block_size = block_size
+        if max_workers is None:
+            max_workers = os.cpu_count() or 1
+        # lzma releases the GIL, so threads are enough.
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.max_pending = max_workers
+        self.pending = deque()
+        self.buffer = bytearray()
+        self.records = []
+        self.closed = False
+        self.fileobj.write(
+            b"\xfd7zXZ\x00" + self._FLAGS + struct.pack("<I", zlib.crc32(self._FLAGS))
+        )
+
+    def write(self, data):
+        self.buffer += data
+        while len(self.buffer) >= self.block_size:
+            self._submit(bytes(self.buffer[: self.block_size]))
+            del self.buffer[: self.block_size]
+        return len(data)
+
+    def _submit(self, block):
+        self.pending.append(self.executor.submit(_compress_xz_block, block, self.level))
+        while len(self.pending) > self.max_pending:
+            self._write_block(self.pending.popleft().result())
+
+    def _write_block(self, result):
+        block, unpadded_size, uncompressed_size = result
+        self.fileobj.write(block)
+        self.records.append((unpadded_size, uncompressed_size))
+
+    def close(self):
+        if self.closed:
+            return
+        if self.buffer:
+            self._submit(bytes(self.buffer))
+        self.buffer = bytearray()
+        while self.pending:
+            self._write_block(self.pending.popleft().result())
+        self.executor.shutdown()
+
+        index = bytearray(b"\x00" + _encode_varint(len(self.records)))
+        for unpadded_size, uncompressed_size in self.records:
+            index += _encode_varint(unpadded_size) + _encode_varint(uncompressed_size)
+        index += b"\x00" * (-len(index) % 4)
+        index += struct.pack("<I", zlib.crc32(index))
+        self.fileobj.write(index)
+
+        backward_size = struct.pack("<I", len(index) // 4 - 1)
+        footer = backward_size + self._FLAGS
+        self.fileobj.write(struct.pack("<I", zlib.crc32(footer)) + footer + b"YZ")
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class ZstdWriter:
+    """Write-only file object piping into `zstd` with `max_workers` threads. The
+    output doesn't depend on the number of threads.
+    """
+
+    def __init__(self, fileobj, level=3, max_workers=None):
+        executable = shutil.which("zstd")
+        if executable is None:
+            raise CompressionError("zstd compression needs the `zstd` executable.")
+        if max_workers is None:
+            max_workers = os.cpu_count() or 1
+        fileobj.flush()
+        self.process = subprocess.Popen(
+            [executable, "-q", "-c", f"-{level}", f"-T{max_workers}"],
+            stdin=subprocess.PIPE,
+            stdout=fileobj,
+        )
+        self.closed = False
+
+    def write(self, data):
+        self.process.stdin.write(data)
+        return len(data)
+
+    def close(self):
+        if self.closed:
+            return
+        self.process.stdin.close()
+        if self.process.wait() != 0:
+            raise CompressionError(
+                f"zstd failed with exit code {self.process.returncode}."
+            )
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+_WRITERS = {"gz": ParallelGzipWriter, "xz": ParallelXzWriter, "zst": ZstdWriter}
+
+
+class Compression:
+    """Compression of a tarball: `codec` (which is also the file name extension)
+    is one of `gz`, `xz`, and `zst`, `level` defaults to the codec's default, and
+    `threads` to the number of CPUs.
+    """
+
+    def __init__(self, codec="gz", level=None, threads=None):
+        if codec not in DEFAULT_LEVELS:
+            raise CompressionError(f"Unknown compression `{codec}`.")
+        if level is None:
+            level = DEFAULT_LEVELS[codec]
+        if not 1 <= level <= _MAX_LEVELS[codec]:
+            raise CompressionError(
+                f"The {codec} level must be between 1 and {_MAX_LEVELS[codec]}."
+            )
+        self.codec = codec
+        self.level = level
+        self.threads = threads
+
+    def __repr__(self):
+        return f"{self.codec} -{self.level}"
+
+    def open(self, fileobj, block_cache=None):
+        """Returns a write-only file object compressing into `fileobj`. The
+        `GzipBlockCache` `block_cache` is only used for gzip.
+        """
+        if self.codec == "gz" and block_cache is not None:
+            return ParallelGzipWriter(
+                fileobj,
+                level=self.level,
+                max_workers=self.threads,
+                block_cache=block_cache,
+            )
+        return _WRITERS[self.codec](fileobj, level=self.level, max_workers=self.threads)
+
+    def get_key(self):
+        # Everything that determines the compressed bytes; not the threads
+        return {"compression": self.codec, "level": self.level}
+
+
+def get_default_mtime():
+    return int(os.environ.get("SOURCE_DATE_EPOCH", 0))
+
+
+def _walk(directory, excludes, matcher, relpath=""):
+    # Yields sorted `(relpath, path)` tuples of everything below `directory`, parent
+    # directories before their contents. Like in staging and dpkg-source, `.git`
+    # is left out.
+    with os.scandir(os.path.join(directory, relpath)) as it:
+        entries = sorted(it, key=lambda e: e.name)
+    for entry in entries:
+        path = relpath + "/" + entry.name if relpath else entry.name
+        if entry.name == ".git" or path in excludes:
+            continue
+        is_dir = entry.is_dir(follow_symlinks=False)
+        if matcher and matcher.match(path, is_dir):
+            continue
+        yield path, entry.path
+        if is_dir:
+            yield from _walk(directory, excludes, matcher, path)
+
+
+def get_tarinfo(arcname, path, mtime, st=None):
+    """Returns a normalized `TarInfo` for the file at `path`: Owner is root, the
+    time stamp is `mtime`, and permissions only depend on whether the file is
+    executable, like in Git. `st` is the `os.lstat()` of `path` if it's known.
+    """
+    if st is None:
+        st = os.lstat(path)
+    info = tarfile.TarInfo(arcname)
+    info.mtime = mtime
+    info.uid = info.gid = 0
+    info.uname = info.gname = ""
+    if stat.S_ISDIR(st.st_mode):
+        info.type = tarfile.DIRTYPE
+        info.mode = 0o755
+    elif stat.S_ISLNK(st.st_mode):
+        info.type = tarfile.SYMTYPE
+        info.linkname = os.readlink(path)
+        info.mode = 0o777
+    elif stat.S_ISREG(st.st_mode):
+        info.type = tarfile.REGTYPE
+        info.size = st.st_size
+        info.mode = 0o755 if st.st_mode & stat.S_IXUSR else 0o644
+    else:
+        return None
+    return info
+
+
+def normalize_excludes(excludes):
+    return {e[2:] if e.startswith("./") else e for e in (excludes or [])}
+
+
+class MemberHash:
+    """Digest of the members of a tarball, added in order with their paths below
+    the prefix: type, (normalized) mode, link target, size, and the Git blob hash
+    of regular files. Unlike a Git tree hash, it covers directories, empty ones
+    included, and so determines the tarball up to prefix, mtime, and compression.
+    """
+
+    def __init__(self):
+        self.sha = hashlib.sha256()
+
+    def update(self, relpath, info, digest=None):
+        entry = [
+            relpath,
+            info.type.decode("ascii"),
+            info.mode,
+            info.linkname,
+            info.size,
+            None if digest is None else digest.hex(),
+        ]
+        self.sha.update(json.dumps(entry).encode("ascii") + b"\n")
+
+    def hexdigest(self):
+        return self.sha.hexdigest()
+
+
+def get_content_hash(
+    directory,
+    excludes=None,
+    matcher=None,
+    cache=None,
+    cached_only=False,
+    source=None,
+    max_workers=None,
+):
+    """Returns the `MemberHash` of the tarball that `create_tarball()` creates of
+    `directory` with `excludes` and `matcher`. Files are hashed on a thread pool.
+
+    With a `HashCache`, files whose hashes are cached aren't read; with
+    `cached_only`, no file is read, and `None` is returned if any hash isn't
+    cached. If `directory` is a staged copy of the subdirectory `relpath` of
+    `root` (see `staging`), `source` is `(root, relpath)`: Files hard-linked to
+    the original are then found among its cached hashes as well. The hashes of
+    the files in such copies aren't cached, only those of other directories.
+    """
+    excludes = normalize_excludes(excludes)
+    key = os.path.realpath(directory)
+    if source is not None:
+        source_key = os.path.realpath(source[0])
+        source_prefix = source[1] + "/" if source[1] else ""
+    # Files modified shortly before they were read might be modified again without
+    # a change in mtime; don't cache those.
+    racy_ns = time.time_ns() - treehash.RACY_NS
+
+    members = [("", get_tarinfo("", directory, 0), None)]
+    new = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for relpath, path in _walk(directory, excludes, matcher):
+            st = os.lstat(path)
+            info = get_tarinfo(relpath, path, 0, st)
+            if info is None:
+                continue
+            digest = None
+            if info.isreg():
+                stat_key = (st.st_size, st.st_mtime_ns, st.st_ino)
+                if cache is not None:
+                    digest = cache.get_blob(key, relpath, stat_key)
+                    if digest is None and source is not None:
+                        digest = cache.get_blob(
+                            source_key, source_prefix + relpath, stat_key
+                        )
+                if digest is None:
+                    if cached_only:
+                        return None
+                    digest = executor.submit(treehash.hash_file, path, st.st_size)
+                    if st.st_mtime_ns < racy_ns:
+                        new.append((relpath, stat_key, digest))
+            members.append((relpath, info, digest))
+
+        member_hash = MemberHash()
+        for relpath, info, digest in members:
+            if isinstance(digest, Future):
+                digest = digest.result()
+            member_hash.update(relpath, info, digest)
+
+    if cache is not None and source is None and new:
+        for relpath, stat_key, digest in new:
+            cache.put_blob(key, relpath, stat_key, digest.result())
+        cache.flush()
+    return member_hash.hexdigest()
+
+
+def create_tarball(
+    directory,
+    tarball,
+    prefix,
+    excludes=None,
+    mtime=None,
+    level=6,
+    max_workers=None,
+    matcher=None,
+    compression=None,
+    block_cache=None,
+):
+    """Creates a reproducible tarball of the contents of `directory` with all paths
+    starting with `prefix/`. `excludes` are paths relative to `directory`; paths
+    that the `ignore.Matcher` `matcher` matches are left out as well. `mtime`
+    defaults to `$SOURCE_DATE_EPOCH` or 0. The tarball is compressed with the
+    `Compression` `compression`, or with gzip at `level` with `max_workers`, reusing
+    the blocks in the `GzipBlockCache` `block_cache`.
+    """
+    excludes = normalize_excludes(excludes)
+    if mtime is None:
+        mtime = get_default_mtime()
+    if compression is None:
+        compression = Compression("gz", level, max_workers)
+
+    with open(tarball, "wb") as f, compression.open(f, block_cache) as gz, tarfile.open(
+        fileobj=gz, mode="w|", format=tarfile.GNU_FORMAT
+    ) as tar:
+        tar.addfile(get_tarinfo(prefix, directory, mtime))
+        for relpath, path in _walk(directory, excludes, matcher):
+            info = get_tarinfo(prefix + "/" + relpath, path, mtime)
+            if info is None:
+                continue
+            if info.isreg():
+                with open(path, "rb") as handle:
+                    tar.addfile(info, handle)
+            else:
+                tar.addfile(info)
+    return
+
+
+# Compressions that `autotune()` considers
+AUTOTUNE_CANDIDATES = [
+    ("gz", 6),
+    ("gz", 9),
+    ("xz", 2),
+    ("xz", 6),
+    ("zst", 3),
+    ("zst", 12),
+]
+
+
+def _read_sample(directory, excludes, matcher, sample_bytes, chunk_size=64 * 1024):
+    # Returns the total size of the files that go into the tarball and a sample
+    # of their content: the beginnings of the files in tarball order.
+    total = 0
+    sample = bytearray()
+    for _, path in _walk(directory, normalize_excludes(excludes), matcher):
+        if not os.path.isfile(path) or os.path.islink(path):
+            continue
+        total += os.path.getsize(path)
+        if len(sample) < sample_bytes:
+            with open(path, "rb") as handle:
+                sample += handle.read(min(chunk_size, sample_bytes - len(sample)))
+    return total, bytes(sample)
+
+
+def autotune(
+    directory,
+    bandwidth,
+    threads=None,
+    excludes=None,
+    matcher=None,
+    candidates=AUTOTUNE_CANDIDATES,
+    sample_bytes=4 * 1024 * 1024,
+):
+    """Picks the compression for a tarball of `directory` that minimizes the time
+    for compressing it and uploading it at `bandwidth` (bytes per second). The
+    speed and the ratio of every candidate are measured on a sample of the files;
+    zstd is only considered if it's installed.
+
+    Returns the best `Compression` and the list of `(compression, estimated
+    seconds)` for all candidates measured.
+    """
+    if threads is None:
+        threads = os.cpu_count() or 1
+    total, sample = _read_sample(directory, excludes, matcher, sample_bytes)
+    estimates = []
+    for codec, level in candidates:
+        if codec == "zst" and shutil.which("zstd") is None:
+            continue
+        # one thread, so the speed per thread is measured
+        measured = Compression(codec, level, threads=1)
+        with tempfile.TemporaryFile() as f:
+            tic = time.perf_counter()
+            with measured.open(f) as writer:
+                writer.write(sample)
+            elapsed = max(time.perf_counter() - tic, 1.0e-6)
+            ratio = f.tell() / max(len(sample), 1)
+        # Blocks are compressed concurrently, so large trees are compressed with
+        # all threads.
+        blocks = 1 + total // (XZ_BLOCK_SIZE if codec == "xz" else BLOCK_SIZE)
+        speed = len(sample) / elapsed * min(threads, blocks)
+        seconds = total / speed + total * ratio / bandwidth
+        estimates.append((Compression(codec, level, threads), seconds))
+    best = min(estimates, key=lambda item: item[1])[0]
+    return best, estimates
@@ -0,0 +1,320 @@
+# -*- coding: utf-8 -*-
+#
+"""
+Computation of Git tree hashes without a Git repository.
+
+The objects are hashed the same way `git add -A && git write-tree` would hash
+them, but nothing is ever written to disk.
+"""
+from concurrent.futures import Future, ThreadPoolExecutor
+import hashlib
+import json
+import os
+import stat
+import time
+
+from .ignore import IgnoreStack, read_ignore_file
+
+MODE_FILE = b"100644"
+MODE_EXECUTABLE = b"100755"
+MODE_SYMLINK = b"120000"
+MODE_TREE = b"40000"
+
+# Files larger than this are read in chunks of this size.
+CHUNK_SIZE = 1024 * 1024
+
+# Files modified less than this many nanoseconds before hashing aren't cached.
+RACY_NS = 2 * 10 ** 9
+
+
+def hash_blob(data):
+    """Returns the binary Git blob hash of a byte string.
+    """
+    sha = hashlib.sha1(b"blob %d\0" % len(data))
+    sha.update(data)
+    return sha.digest()
+
+
+def hash_file(path, size=None):
+    """Returns the binary Git blob hash of a regular file. Large files are streamed.
+    """
+    if size is None:
+        size = os.path.getsize(path)
+    sha = hashlib.sha1(b"blob %d\0" % size)
+    with open(path, "rb") as handle:
+        while True:
+            chunk = handle.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            sha.update(chunk)
+    return sha.digest()
+
+
+def hash_tree(entries):
+    """Returns the binary Git tree hash for a list of `(name, mode, digest)`
+    tuples, `name` being bytes.
+    """
+    # Git sorts tree entries as if directory names had a trailing slash.
+    def key(entry):
+        name, mode, _ = entry
+        return name + b"/" if mode == MODE_TREE else name
+
+    body = b"".join(
+        mode + b" " + name + b"\0" + digest
+        for name, mode, digest in sorted(entries, key=key)
+    )
+    sha = hashlib.sha1(b"tree %d\0" % len(body))
+    sha.update(body)
+    return sha.digest()
+
+
+def file_mode(st):
+    """Returns the Git mode for the `os.stat_result` of a non-directory, or `None`
+    if Git doesn't track this kind of file.
+    """
+    if stat.S_ISLNK(st.st_mode):
+        return MODE_SYMLINK
+    if stat.S_ISREG(st.st_mode):
+        return MODE_EXECUTABLE if st.st_mode & stat.S_IXUSR else MODE_FILE
+    return None
+
+
+def scan(
+    directory,
+    ignore_stack=None,
+    relpath="",
+    excludes=(),
+    honor_gitignore=True,
+    matcher=None,
+):
+    """Walks `directory` the way `git add -A` does: `.git` entries are skipped and
+    `.gitignore` files are honored. Yields `(relpath, entry, st)` tuples for all
+    files and symlinks as well as `(relpath, None, None)` after all contents of a
+    directory, the root included. `relpath` is slash-separated.
+
+    Paths in `excludes` and those the `ignore.Matcher` `matcher` matches are
+    skipped as well; excluded directories aren't entered. With
+    `honor_gitignore=False`, all other files are included, just like in the orig
+    tarball.
+
+    Note that nested repositories are treated as plain directories.
+    """
+    if ignore_stack is None:
+        ignore_stack = IgnoreStack()
+    if honor_gitignore:
+        ignore_stack = ignore_stack.push(
+            relpath, read_ignore_file(os.path.join(directory, relpath, ".gitignore"))
+        )
+
+    with os.scandir(os.path.join(directory, relpath)) as it:
+        entries = sorted(it, key=lambda e: e.name)
+
+    for entry in entries:
+        if entry.name == ".git":
+            continue
+        path = relpath + "/" + entry.name if relpath else entry.name
+        if path in excludes:
+            continue
+        is_dir = entry.is_dir(follow_symlinks=False)
+        if matcher and matcher.match(path, is_dir):
+            continue
+        if ignore_stack.is_ignored(path, is_dir):
+            continue
+        if is_dir:
+            yield from scan(
+                directory, ignore_stack, path, excludes, honor_gitignore, matcher
+            )
+        else:
+            yield path, entry, entry.stat(follow_symlinks=False)
+
+    yield relpath, None, None
+
+
+class File:
+    __slots__ = ("name", "relpath", "path", "st", "mode", "digest")
+
+    def __init__(self, relpath, entry, st, mode):
+        self.name = os.fsencode(entry.name)
+        self.relpath = relpath
+        self.path = entry.path
+        self.st = st
+        self.mode = mode
+        self.digest = None
+
+    def stat_key(self):
+        return (self.st.st_size, self.st.st_mtime_ns, self.st.st_ino)
+
+
+class Directory:
+    __slots__ = ("name", "relpath", "files", "dirs", "signature", "digest")
+
+    def __init__(self, relpath):
+        self.name = os.fsencode(relpath.rsplit("/", 1)[-1])
+        self.relpath = relpath
+        self.files = []
+        self.dirs = []
+        self.signature = None
+        self.digest = None
+
+    def walk(self):
+        """Yields all files in this directory and below.
+        """
+        yield from self.files
+        for d in self.dirs:
+            yield from d.walk()
+
+    def compute_signature(self):
+        """Computes a digest of the stat data of everything in and below this
+        directory. If it hasn't changed, the tree hash hasn't changed either.
+        """
+        sha = hashlib.sha1()
+        for f in self.files:
+            sha.update(b"%s %s %d %d %d\0" % ((f.name, f.mode) + f.stat_key()))
+        for d in self.dirs:
+            sha.update(d.name + b"\0" + d.compute_signature())
+        self.signature = sha.digest()
+        return self.signature
+
+    def compute_digest(self):
+        """Computes the tree hash from the digests of the contents. Returns `None`
+        for directories without any files, which Git doesn't track.
+        """
+        if self.digest is not None:
+            return self.digest
+        entries = [(f.name, f.mode, _result(f.digest)) for f in self.files]
+        for d in self.dirs:
+            digest = d.compute_digest()
+            if digest is not None:
+                entries.append((d.name, MODE_TREE, digest))
+        if entries or not self.relpath:
+            self.digest = hash_tree(entries)
+        return self.digest
+
+
+def _result(digest):
+    return digest.result() if isinstance(digest, Future) else digest
+
+
+def collect(directory, excludes=(), honor_gitignore=True, matcher=None):
+    """Walks `directory` and returns the root `Directory` of the tracked files.
+    The arguments are passed on to `scan()`.
+    """
+    # Stack of directories currently being walked
+    stack = [Directory("")]
+    scanner = scan(
+        directory, excludes=excludes, honor_gitignore=honor_gitignore, matcher=matcher
+    )
+    for relpath, entry, st in scanner:
+        if entry is not None:
+            mode = file_mode(st)
+            if mode is None:
+                continue
+            # Directories are reported after their contents, so missing levels
+            # need to be filled in from the path.
+            parent = relpath.rsplit("/", 1)[0] if "/" in relpath else ""
+            _descend(stack, parent)
+            stack[-1].files.append(File(relpath, entry, st, mode))
+            continue
+
+        # A directory is complete.
+        _descend(stack, relpath)
+        if len(stack) == 1:
+            return stack[0]
+        d = stack.pop()
+        stack[-1].dirs.append(d)
+
+    raise RuntimeError("unreachable")
+
+
+def _descend(stack, relpath):
+    while stack[-1].relpath != relpath:
+        current = stack[-1].relpath
+        rest = relpath[len(current) + 1 :] if current else relpath
+        name = rest.split("/", 1)[0]
+        stack.append(Directory(current + "/" + name if current else name))
+
+
+def hash_entry(f):
+    """Returns the blob digest of a `File`.
+    """
+    if f.mode == MODE_SYMLINK:
+        return hash_blob(os.fsencode(os.readlink(f.path)))
+    return hash_file(f.path, f.st.st_size)
+
+
+def get_variant(excludes=(), honor_gitignore=True, matcher=None):
+    """Returns a short string that identifies the selection of files `scan()` makes
+    with these arguments. Tree hashes of different selections are cached apart.
+    """
+    key = [honor_gitignore, sorted(excludes), matcher.get_key() if matcher else []]
+    return hashlib.sha1(json.dumps(key).encode("utf-8")).hexdigest()[:16]
+
+
+def get_tree_hash(
+    directory,
+    max_workers=None,
+    cache=None,
+    excludes=(),
+    honor_gitignore=True,
+    cached_only=False,
+    matcher=None,
+):
+    """Returns the Git tree hash of `directory` as hex string. File contents are
+    hashed on a thread pool. `excludes`, `honor_gitignore`, and `matcher` are
+    passed on to `scan()`.
+
+    If a `HashCache` is given, only files whose stat data has changed are read.
+    With `cached_only`, no file is read at all; if anything isn't in the cache,
+    `None` is returned.
+    """
+    root = collect(directory, excludes, honor_gitignore, matcher)
+    if cache is None:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for f in root.walk():
+                f.digest = executor.submit(hash_entry, f)
+            return root.compute_digest().hex()
+
+    key = os.path.realpath(directory)
+    variant = get_variant(excludes, honor_gitignore, matcher)
+    # Files modified shortly before they were read might be modified again without
+    # a change in mtime; don't cache those.
+    racy_ns = time.time_ns() - RACY_NS
+    root.compute_signature()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        todo = [root]
+        while todo:
+            d = todo.pop()
+            d.digest = cache.get_tree(key, variant, d.relpath, d.signature)
+            if d.digest is not None:
+                continue
+            for f in d.files:
+                f.digest = cache.get_blob(key, f.relpath, f.stat_key())
+                if f.digest is None:
+                    if cached_only:
+                        return None
+                    f.digest = executor.submit(hash_entry, f)
+            todo.extend(d.dirs)
+        digest = root.compute_digest()
+
+    store_in_cache(cache, key, variant, root, racy_ns)
+    cache.flush()
+    return digest.hex()
+
+
+def store_in_cache(cache, key, variant, d, racy_ns):
+    """Puts all digests in and below `d` into the cache, the tree hashes under
+    `variant`. Returns `False` if anything was racy.
+    """
+    clean = True
+    for f in d.files:
+        if f.digest is None:
+            continue
+        if f.st.st_mtime_ns >= racy_ns:
+            clean = False
+            continue
+        cache.put_blob(key, f.relpath, f.stat_key(), _result(f.digest))
+    for sub in d.dirs:
+        clean = store_in_cache(cache, key, variant, sub, racy_ns) and clean
+    if clean and d.digest is not None:
+        cache.put_tree(key, variant, d.relpath, d.signature, d.digest)
+    return clean
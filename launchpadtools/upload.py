@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+#
+"""
+SFTP uploads to Launchpad PPAs.
+
+One authenticated SSH connection is kept per PPA and reused for all uploads of a
+run. The files of an upload are transferred concurrently, each over its own SFTP
+channel of that connection, and the `.changes` file goes last. Failed transfers
+are retried with exponential backoff, and resume where they stopped. Files that
+were on the server before are overwritten, since there's no telling what they
+contain.
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from . import metrics
+from .source import get_file_names, parse_control
+
+HOST = "ppa.launchpad.net"
+CHUNK_SIZE = 256 * 1024
+
+
+class UploadError(Exception):
+    pass
+
+
+def _paramiko():
+    # paramiko takes longer to import than all of launchpadtools, so it's only
+    # imported once a connection is made (or fails).
+    import paramiko
+
+    return paramiko
+
+
+def connect(host, port, username):
+    """Opens an SSH connection with the user's keys or agent, respecting the
+    `IdentityFile` from `~/.ssh/config`. The host must be in the known hosts.
+    """
+    paramiko = _paramiko()
+    key_filename = None
+    config_file = os.path.expanduser("~/.ssh/config")
+    if os.path.isfile(config_file):
+        options = paramiko.SSHConfig.from_path(config_file).lookup(host)
+        key_filename = options.get("identityfile")
+
+    client = paramiko.SSHClient()
+    client.load_system_host_keys()
+    client.set_missing_host_key_policy(paramiko.RejectPolicy())
+    client.connect(
+        host, port=port, username=username, key_filename=key_filename, timeout=30
+    )
+    return client
+
+
+def get_upload_files(changes_file):
+    """Returns the files of an upload, i.e., the ones listed in the `.changes` file,
+    followed by the `.changes` file itself.
+    """
+    directory = os.path.dirname(changes_file)
+    with open(changes_file, "r") as handle:
+        (changes,) = parse_control(handle.read())
+    files = [os.path.join(directory, f) for f in get_file_names(changes)]
+    return files + [changes_file]
+
+
+def _is_alive(session):
+    transport = session.get_transport()
+    return transport is not None and transport.is_active()
+
+
+class Uploader:
+    """Uploads source packages to PPAs via SFTP.
+
+    `client_factory(host, port, username)` must return a connected
+    `paramiko.SSHClient` or an object with the same `open_sftp()`,
+    `get_transport()`, and `close()` methods.
+    """
+
+    def __init__(
+        self,
+        login,
+        host=HOST,
+        port=22,
+        max_workers=4,
+        retries=3,
+        backoff=1.0,
+        client_factory=connect,
+    ):
+        self.login = login
+        self.host = host
+        self.port = port
+        self.max_workers = max_workers
+        self.retries = retries
+        self.backoff = backoff
+        self.client_factory = client_factory
+        self._sessions = {}
+        # The local files (size and mtime) of the remote files written so far
+        self._written = {}
+        self._lock = threading.Lock()
+        # Set if connecting is hopeless, e.g., because authentication failed
+        self._fatal = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self, ppa_string=None):
+        """Closes the connection for `ppa_string`, or all connections. Launchpad
+        processes the uploads of a connection once it is closed.
+        """
+        with self._lock:
+            for key in list(self._sessions):
+                if ppa_string is None or key == ppa_string:
+                    self._sessions.pop(key).close()
+
+    def _get_session(self, ppa_string):
+        with self._lock:
+            if self._fatal is not None:
+                raise UploadError(f"Cannot connect to {self.host}: {self._fatal}")
+            session = self._sessions.get(ppa_string)
+            if session is None:
+                try:
+                    session = self.client_factory(self.host, self.port, self.login)
+                except (
+                    _paramiko().AuthenticationException,
+                    _paramiko().BadHostKeyException,
+                ) as e:
+                    self._fatal = e
+                    raise UploadError(f"Cannot connect to {self.host}: {e}")
+                self._sessions[ppa_string] = session
+            return session
+
+    def _drop_session(self, ppa_string, session):
+        with self._lock:
+            if self._sessions.get(ppa_string) is session and not _is_alive(session):
+                del self._sessions[ppa_string]
+                session.close()
+
+    def _transfer(self, sftp, path, remote_path):
+        """Copies `path` to `remote_path`. If this uploader has written the remote
+        file from the same local file before, the transfer is resumed, or skipped if
+        it's complete. Returns the number of bytes sent.
+        """
+        stat = os.stat(path)
+        local = (stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            resume = self._written.get(remote_path) == local
+            self._written[remote_path] = local
+
+        offset = 0
+        if resume:
+            try:
+                offset = sftp.stat(remote_path).st_size
+            except FileNotFoundError:
+                pass
+            if offset == stat.st_size:
+                return 0
+            if offset > stat.st_size:
+                # not a prefix of this file
+                offset = 0
+
+        with open(path, "rb") as handle, sftp.open(
+            remote_path, "ab" if offset else "wb"
+        ) as remote:
+            # don't wait for the acknowledgement of every write
+            remote.set_pipelined(True)
+            handle.seek(offset)
+            while True:
+                chunk = handle.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                remote.write(chunk)
+        return stat.st_size - offset
+
+    def put(self, ppa_string, path):
+        """Uploads a single file to the incoming directory of `ppa_string`
+        (`owner/name`). Returns the number of bytes sent.
+        """
+        filename = os.path.basename(path)
+        remote_path = f"~{ppa_string}/ubuntu/{filename}"
+        with metrics.stage("sftp_put", file=filename) as s:
+            for attempt in range(self.retries + 1):
+                s.set(attempts=attempt + 1)
+                session = None
+                try:
+                    session = self._get_session(ppa_string)
+                    sftp = session.open_sftp()
+                    try:
+                        sent = self._transfer(sftp, path, remote_path)
+                    finally:
+                        sftp.close()
+                    s.set(sent_bytes=sent)
+                    return sent
+                except (OSError, EOFError, _paramiko().SSHException) as e:
+                    error = e
+                    if session is not None:
+                        self._drop_session(ppa_string, session)
+                if attempt < self.retries:
+                    time.sleep(self.backoff * 2**attempt)
+            if session is None:
+                # Not even connecting worked; don't try again for the other files.
+                with self._lock:
+                    self._fatal = error
+            raise UploadError(f"Uploading {filename} failed: {error}")
+
+    def upload(self, ppa_string, changes_file):
+        """Uploads the files listed in `changes_file` and then the file itself.
+        Returns the number of bytes sent.
+        """
+        files = get_upload_files(changes_file)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            sent = sum(executor.map(lambda f: self.put(ppa_string, f), files[:-1]))
+        return sent + self.put(ppa_string, files[-1])
@@ -0,0 +1,305 @@
+# -*- coding: utf-8 -*-
+#
+"""
+Watching the builds of uploaded source packages.
+
+After an upload, Launchpad first has to accept the source package, which makes it
+show up as a publication in the PPA, and then builds it for each architecture.
+`Watcher` follows any number of uploads to any number of PPAs in one asyncio event
+loop with a task per PPA. Each poll of a PPA costs one request per package that
+still lacks a publication, and a single `getBuildSummariesForSourceIds` request
+for the build states of all its accepted uploads. All requests are conditional
+(ETag), so asking again about unchanged states is cheap. The poll interval grows
+while nothing changes and drops back once something does.
+
+An upload is a dictionary with the keys `ppa`, `name`, `version` (without epoch),
+and `series`. The outcome of an upload is a copy of it with the additional keys
+
+  * `status`: `"built"`, `"failed"` (failed to build on at least one
+    architecture), `"not accepted"` (no publication within the accept timeout,
+    usually a rejection that Launchpad only reports by email), or `"timed out"`,
+  * `web_link`: the publication's web page (`None` if not accepted),
+  * `builds`: a list of dictionaries with the keys `arch`, `state`, `web_link`,
+    and `log_url`, one per architecture.
+"""
+import asyncio
+import time
+import urllib.parse
+
+from .publications import API_ROOT, LaunchpadError, _get, get_series
+
+# seconds between two polls of a PPA, at first and at most
+DEFAULT_MIN_INTERVAL = 30.0
+DEFAULT_MAX_INTERVAL = 600.0
+# factor by which the interval grows after a poll without news
+DEFAULT_BACKOFF = 1.5
+# seconds after which an upload without publication is considered rejected
+DEFAULT_ACCEPT_TIMEOUT = 30 * 60
+
+# final states of uploads
+FINAL = ["built", "failed", "not accepted", "timed out"]
+
+# `BuildSetStatus` of the build summaries
+_SUMMARY_STATES = {
+    "FULLYBUILT": "built",
+    "FULLYBUILT_PENDING": "built",
+    "FAILEDTOBUILD": "failed",
+    "NEEDSBUILD": "building",
+    "BUILDING": "building",
+}
+
+_PAGE_SIZE = 75
+
+
+class BuildError(Exception):
+    """An upload that hasn't been built; `outcome` has the details."""
+
+    def __init__(self, outcome):
+        if outcome["status"] == "failed":
+            archs = [
+                b["arch"]
+                for b in outcome["builds"]
+                if b["state"] != "Successfully built"
+            ]
+            message = "failed to build on {}".format(", ".join(archs) or "?")
+        elif outcome["status"] == "not accepted":
+            message = "not accepted by Launchpad; see the rejection email"
+        else:
+            message = "timed out waiting for the builds"
+        super().__init__(message)
+        self.outcome = outcome
+
+
+def _strip_epoch(version):
+    return version.split(":", 1)[-1]
+
+
+def _get_source_id(self_link):
+    return self_link.rstrip("/").rsplit("/", 1)[-1]
+
+
+class Watcher:
+    """Polls Launchpad at `api_root` for the outcomes of uploads, see `watch()`.
+    With `timeout` (in seconds), uploads that aren't built by then are given up.
+    """
+
+    def __init__(
+        self,
+        api_root=API_ROOT,
+        min_interval=DEFAULT_MIN_INTERVAL,
+        max_interval=DEFAULT_MAX_INTERVAL,
+        backoff=DEFAULT_BACKOFF,
+        accept_timeout=DEFAULT_ACCEPT_TIMEOUT,
+        timeout=None,
+    ):
+        self.api_root = api_root.rstrip("/")
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.accept_timeout = accept_timeout
+        self.timeout = timeout
+        # url -> (ETag, document) of the last answers
+        self._documents = {}
+        self.requests = 0
+
+    async def _get(self, url):
+        """Fetches a JSON document; if it's unchanged, the last answer is returned."""
+        etag, document = self._documents.get(url, (None, None))
+        loop = asyncio.get_running_loop()
+        # urllib blocks, so the requests run in the default executor.
+        new_document, etag = await loop.run_in_executor(None, _get, url, etag)
+        self.requests += 1
+        if new_document is not None:
+            document = new_document
+            self._documents[url] = (etag, document)
+        return document
+
+    def _get_ppa_url(self, ppa_string):
+        owner, ppa_name = ppa_string.split("/")
+        return f"{self.api_root}/~{owner}/+archive/ubuntu/{ppa_name}"
+
+    async def _find_publications(self, ppa_string, name, outcomes):
+        """Sets the publication of the `outcomes` of package `name` that have one
+        by now. Returns `True` if any was found.
+        """
+        query = urllib.parse.urlencode(
+            {
+                "ws.op": "getPublishedSources",
+                "source_name": name,
+                "exact_match": "true",
+                "order_by_date": "true",
+                "ws.size": _PAGE_SIZE,
+            }
+        )
+        page = await self._get(f"{self._get_ppa_url(ppa_string)}?{query}")
+        # the newest first; the uploads of this run are on the first page
+        publications = {
+            (_strip_epoch(e["source_package_version"]), get_series(e)): e
+            for e in reversed(page["entries"])
+        }
+        found = False
+        for outcome in outcomes:
+            entry = publications.get((outcome["version"], outcome["series"]))
+            if entry is not None:
+                outcome["status"] = "building"
+                outcome["web_link"] = entry.get("web_link")
+                outcome["_self_link"] = entry["self_link"]
+                found = True
+        return found
+
+    async def _get_builds(self, outcome):
+        collection = await self._get(outcome["_self_link"] + "?ws.op=getBuilds")
+        outcome["builds"] = [
+            {
+                "arch": build.get("arch_tag"),
+                "state": build.get("buildstate"),
+                "web_link": build.get("web_link"),
+                "log_url": build.get("build_log_url"),
+            }
+            for build in collection["entries"]
+        ]
+
+    async def _update_builds(self, ppa_string, outcomes):
+        """Updates the build states of the accepted `outcomes` with one request.
+        Returns `True` if any has changed.
+        """
+        ids = {_get_source_id(o["_self_link"]): o for o in outcomes}
+        query = urllib.parse.urlencode(
+            {"ws.op": "getBuildSummariesForSourceIds", "source_ids": sorted(ids)},
+            doseq=True,
+        )
+        summaries = await self._get(f"{self._get_ppa_url(ppa_string)}?{query}")
+        changed = False
+        finished = []
+        for source_id, outcome in ids.items():
+            summary = summaries.get(source_id)
+            if summary is None or summary["status"] == outcome.get("_summary"):
+                continue
+            # e.g., from NEEDSBUILD to BUILDING; worth a closer look soon
+            changed = True
+            outcome["_summary"] = summary["status"]
+            outcome["status"] = _SUMMARY_STATES.get(summary["status"], "building")
+            if outcome["status"] in FINAL:
+                finished.append(outcome)
+        # The per-architecture details are only fetched once.
+        await asyncio.gather(*[self._get_builds(o) for o in finished])
+        return changed
+
+    async def _poll(self, ppa_string, outcomes, start):
+        """Polls the PPA once. Returns `True` if anything has changed."""
+        waiting = {}
+        for outcome in outcomes:
+            if outcome["status"] == "waiting":
+                waiting.setdefault(outcome["name"], []).append(outcome)
+        found = await asyncio.gather(
+            *[
+                self._find_publications(ppa_string, name, group)
+                for name, group in waiting.items()
+            ]
+        )
+        changed = any(found)
+
+        building = [o for o in outcomes if o["status"] == "building"]
+        if building:
+            changed = await self._update_builds(ppa_string, building) or changed
+
+        now = time.time()
+        for outcome in outcomes:
+            if outcome["status"] == "waiting" and now - start > self.accept_timeout:
+                outcome["status"] = "not accepted"
+                changed = True
+        return changed
+
+    async def _watch_ppa(self, ppa_string, outcomes, start):
+        interval = self.min_interval
+        while True:
+            before = [o["status"] for o in outcomes]
+            try:
+                changed = await self._poll(ppa_string, outcomes, start)
+            except LaunchpadError as e:
+                # Launchpad has hiccups; ask again later.
+                print(f"Polling {ppa_string} failed ({e}); retrying.")
+                changed = False
+            for status, outcome in zip(before, outcomes):
+                if outcome["status"] in FINAL and status not in FINAL:
+                    _print_outcome(outcome)
+            if all(o["status"] in FINAL for o in outcomes):
+                return
+            interval = (
+                self.min_interval
+                if changed
+                else min(interval * self.backoff, self.max_interval)
+            )
+            if self.timeout is not None:
+                remaining = start + self.timeout - time.time()
+                if remaining <= 0:
+                    for outcome in outcomes:
+                        if outcome["status"] not in FINAL:
+                            outcome["status"] = "timed out"
+                    return
+                interval = min(interval, remaining)
+            await asyncio.sleep(interval)
+
+    async def watch(self, uploads):
+        """Waits until all `uploads` have an outcome. Returns the outcomes in the
+        order of the uploads.
+        """
+        start = time.time()
+        outcomes = [
+            dict(upload, status="waiting", web_link=None, builds=[])
+            for upload in uploads
+        ]
+        ppas = {}
+        for outcome in outcomes:
+            ppas.setdefault(outcome["ppa"], []).append(outcome)
+        await asyncio.gather(
+            *[self._watch_ppa(ppa, group, start) for ppa, group in ppas.items()]
+        )
+        for outcome in outcomes:
+            outcome.pop("_self_link", None)
+            outcome.pop("_summary", None)
+        return outcomes
+
+
+def _print_outcome(outcome):
+    print(
+        "{} {} ({}) in {}: {}".format(
+            outcome["name"],
+            outcome["version"],
+            outcome["series"],
+            outcome["ppa"],
+            outcome["status"],
+        )
+    )
+
+
+def wait(uploads, **kwargs):
+    """Waits for the outcomes of `uploads`; see `Watcher` for the keyword
+    arguments. Returns the outcomes in the order of the uploads.
+    """
+    if not uploads:
+        return []
+    return asyncio.run(Watcher(**kwargs).watch(uploads))
+
+
+def print_summary(outcomes):
+    print("\nBuilds:")
+    for outcome in outcomes:
+        print(
+            "    {} {} ({}): {}".format(
+                outcome["name"],
+                outcome["version"],
+                outcome["series"],
+                outcome["status"],
+            )
+        )
+        for build in outcome["builds"]:
+            line = f"        {build['arch']}: {build['state']}"
+            if outcome["status"] == "failed" and build["log_url"]:
+                line += f" ({build['log_url']})"
+            print(line)
+    return
+
+
+def has_failures(outcomes):
+    return any(outcome["status"] != "built" for outcome in outcomes)
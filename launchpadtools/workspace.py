@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+#
+"""
+Persistent work directory of a package that is kept up to date incrementally.
+
+The copy of the source in `orig/` is synced with the source like `rsync -a
+--delete` (see `staging.sync_tree()`) instead of being staged from scratch, and
+the gzip blocks of the last orig tarballs are kept in `.launchpadtools/`, so that
+tarballing only compresses the blocks that have changed. Behind a file that
+changed its size, that is all of them (see `tarball.GzipBlockCache`). Everything
+else in the workspace is cleared at the start of each run.
+
+A lock file keeps concurrent runs from using the same workspace; a second run
+waits for the first.
+"""
+import contextlib
+import fcntl
+import os
+import shutil
+
+from . import tarball
+
+# directory with the lock and the kept tarballs
+STATE_DIR = ".launchpadtools"
+ORIG_DIR = "orig"
+
+
+class WorkspaceError(Exception):
+    pass
+
+
+class Workspace:
+    """The workspace in `directory`; use it only while holding `lock()`."""
+
+    def __init__(self, directory):
+        self.directory = os.path.abspath(directory)
+        self.state_dir = os.path.join(self.directory, STATE_DIR)
+        self.orig_dir = os.path.join(self.directory, ORIG_DIR)
+
+    @contextlib.contextmanager
+    def lock(self):
+        """Holds the lock of the workspace while in the context. Directories that
+        aren't workspaces are only used if they are empty.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        if not os.path.isdir(self.state_dir):
+            if os.listdir(self.directory):
+                raise WorkspaceError(
+                    f"{self.directory} is neither empty nor a launchpadtools "
+                    "workspace."
+                )
+            os.makedirs(self.state_dir, exist_ok=True)
+        with open(os.path.join(self.state_dir, "lock"), "w") as handle:
+            try:
+                fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                print(f"\nWaiting for another run to release {self.directory}...")
+                fcntl.flock(handle, fcntl.LOCK_EX)
+            try:
+                yield self
+            finally:
+                fcntl.flock(handle, fcntl.LOCK_UN)
+
+    def clean(self):
+        """Removes everything but the synced copy and the state, i.e., the
+        outputs of the last run.
+        """
+        for name in os.listdir(self.directory):
+            if name in [STATE_DIR, ORIG_DIR]:
+                continue
+            path = os.path.join(self.directory, name)
+            if os.path.isdir(path) and not os.path.islink(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+        return
+
+    def get_block_cache(self, component=None):
+        """Returns the `tarball.GzipBlockCache` of the orig tarball, or the
+        component tarball of `component`.
+        """
+        name = "orig.tar.gz" if component is None else f"orig-{component}.tar.gz"
+        return tarball.GzipBlockCache(os.path.join(self.state_dir, name))
@@ -27,7 +27,7 @@ setup(
     url="https://github.com/nschloe/launchpadtools",
     license=about["__license__"],
     platforms="any",
-    install_requires=["GitPython", "launchpadlib", "paramiko"],
+    install_requires=["paramiko", "toml; python_version < '3.11'"],
     classifiers=[
         about["__status__"],
         about["__license__"],
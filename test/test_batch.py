@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+#
+import os
+import tempfile
+
+import pytest
+
+import launchpadtools
+
+MANIFEST = """
+launchpad_login = "john"
+ubuntu_releases = ["bionic", "focal"]
+
+[[package]]
+directory = "foo"
+ppa = "john/foo-nightly"
+version_append_hash = true
+
+[[package]]
+directory = "/src/bar"
+ppa = "john/bar-nightly"
+ubuntu_releases = ["focal"]
+"""
+
+
+def test_manifest():
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, "manifest.toml")
+        with open(filename, "w") as f:
+            f.write(MANIFEST)
+        foo, bar = launchpadtools.batch.load_manifest(filename)
+
+        assert foo["directory"] == os.path.join(directory, "foo")
+        assert foo["ubuntu_releases"] == ["bionic", "focal"]
+        assert foo["launchpad_login"] == "john"
+        assert foo["version_append_hash"]
+        assert not foo["force"]
+        assert foo["debuild_params"] == ""
+
+        assert bar["directory"] == "/src/bar"
+        assert bar["ubuntu_releases"] == ["focal"]
+        assert not bar["version_append_hash"]
+
+        with open(filename, "w") as f:
+            f.write(MANIFEST.replace("ppa = ", "pap = ", 1))
+        with pytest.raises(launchpadtools.batch.ManifestError):
+            launchpadtools.batch.load_manifest(filename)
+
+        with open(filename, "w") as f:
+            f.write(MANIFEST.replace('launchpad_login = "john"', ""))
+        with pytest.raises(launchpadtools.batch.ManifestError):
+            launchpadtools.batch.load_manifest(filename)
+
+        with open(filename, "w") as f:
+            f.write(
+                MANIFEST.replace(
+                    "version_append_hash = true",
+                    'compression = "auto"\ncompression_level = 9',
+                )
+            )
+        with pytest.raises(launchpadtools.batch.ManifestError):
+            launchpadtools.batch.load_manifest(filename)
+    return
+
+
+STUBS = os.path.join(os.path.dirname(__file__), "..", "benchmarks", "stubs")
+
+
+class _FakeUploader:
+    """Records the uploads instead of sending them."""
+
+    uploads = []
+
+    def __init__(self, login):
+        self.login = login
+
+    def upload(self, ppa_string, changes_file):
+        self.uploads.append((self.login, ppa_string, os.path.basename(changes_file)))
+        return os.path.getsize(changes_file)
+
+    def close(self, ppa_string=None):
+        return
+
+
+def test_run(monkeypatch):
+    monkeypatch.setenv("PATH", os.path.abspath(STUBS) + os.pathsep + os.environ["PATH"])
+    monkeypatch.setenv("DEBEMAIL", "Max Mustermann <max@example.com>")
+    monkeypatch.setattr(launchpadtools.upload, "Uploader", _FakeUploader)
+    monkeypatch.setattr(_FakeUploader, "uploads", [])
+    with tempfile.TemporaryDirectory() as directory:
+        package = os.path.join(directory, "foo")
+        os.makedirs(os.path.join(package, "debian"))
+        os.makedirs(os.path.join(package, "src"))
+        with open(os.path.join(package, "src", "main.c"), "w") as f:
+            f.write("int main() { return 0; }\n")
+        with open(os.path.join(package, "debian", "changelog"), "w") as f:
+            f.write(
+                "foo (1.0-1) unstable; urgency=medium\n\n  * Initial release.\n\n"
+                " -- Max Mustermann <max@example.com>  "
+                "Sat, 17 Oct 2026 12:00:00 +0000\n"
+            )
+        filename = os.path.join(directory, "manifest.toml")
+        with open(filename, "w") as f:
+            f.write(
+                'launchpad_login = "john"\n'
+                'ubuntu_releases = ["bionic", "focal"]\n'
+                "force = true\n\n"
+                "[[package]]\n"
+                'directory = "foo"\n'
+                'ppa = "john/foo-nightly"\n'
+            )
+
+        (report,) = launchpadtools.batch.run(
+            filename, jobs=1, cache_dir=directory, use_cache=False
+        )
+        assert report["error"] is None
+        assert report["status"] == "submitted"
+        assert report["results"] == {"bionic": None, "focal": None}
+        assert sorted(_FakeUploader.uploads) == [
+            ("john", "john/foo-nightly", "foo_1.0-1bionic1_source.changes"),
+            ("john", "john/foo-nightly", "foo_1.0-1focal1_source.changes"),
+        ]
+    return
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+#
+import multiprocessing
+import os
+import tempfile
+
+import launchpadtools
+
+
+def test_orig_store():
+    with tempfile.TemporaryDirectory() as directory:
+        store = launchpadtools.cache.OrigStore(
+            os.path.join(directory, "cache"), max_bytes=1500
+        )
+        keys = [{"content_hash": str(k), "prefix": "foo-1.0"} for k in range(3)]
+        for k, key in enumerate(keys):
+            tarball = os.path.join(directory, f"{k}.tar.gz")
+            with open(tarball, "wb") as f:
+                f.write(bytes([k]) * 1000)
+            store.put(key, tarball)
+
+        dest = os.path.join(directory, "out.tar.gz")
+        assert not store.get(keys[0], dest)
+        assert not store.get(keys[1], dest)
+        assert store.get(keys[2], dest)
+        with open(dest, "rb") as f:
+            assert f.read() == b"\x02" * 1000
+    return
+
+
+def test_upload_journal():
+    with tempfile.TemporaryDirectory() as directory:
+        cache_dir = os.path.join(directory, "cache")
+        tarball = os.path.join(directory, "foo_1.0.orig.tar.gz")
+        with open(tarball, "wb") as f:
+            f.write(b"abc")
+
+        journal = launchpadtools.cache.UploadJournal(cache_dir, max_entries=2)
+        assert not journal.contains("john/nightly", tarball)
+        journal.put("john/nightly", "foo_1.0.orig.tar.gz", journal.get_sha256(tarball))
+        journal.put("john/nightly", "foo_0.9.orig.tar.gz", "1234")
+        journal.put("john/nightly", "foo_0.8.orig.tar.gz", "5678")
+
+        journal = launchpadtools.cache.UploadJournal(cache_dir)
+        # evicted
+        assert not journal.contains("john/nightly", tarball)
+        journal.put("john/nightly", "foo_1.0.orig.tar.gz", journal.get_sha256(tarball))
+        assert journal.contains("john/nightly", tarball)
+        assert not journal.contains("jane/nightly", tarball)
+
+        # different content under the same name
+        with open(tarball, "wb") as f:
+            f.write(b"abcd")
+        assert not journal.contains("john/nightly", tarball)
+    return
+
+
+def _put_entries(cache_dir, k):
+    journal = launchpadtools.cache.UploadJournal(cache_dir)
+    for i in range(20):
+        journal.put("john/nightly", f"foo_{k}.{i}.orig.tar.gz", "1234")
+
+
+def test_upload_journal_processes():
+    with tempfile.TemporaryDirectory() as cache_dir:
+        processes = [
+            multiprocessing.Process(target=_put_entries, args=(cache_dir, k))
+            for k in range(4)
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+            assert process.exitcode == 0
+        journal = launchpadtools.cache.UploadJournal(cache_dir)
+        assert len(journal._entries["john/nightly"]) == 80
+    return
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+#
+import os
+import tempfile
+
+import pytest
+
+import launchpadtools
+
+CHANGELOG = """foo (1:2.0-1) unstable experimental; urgency=high, binary-only=yes
+
+  * Second release.
+    - with details
+
+ -- Jane Doe <jane@example.com>  Mon, 02 Jan 2017 10:00:00 +0100
+
+foo (1.0-1) unstable; urgency=low
+
+  * Initial release.
+
+ -- John Doe <john@example.com>  Sun, 01 Jan 2017 10:00:00 +0000
+
+Local variables:
+mode: debian-changelog
+End:
+"""
+
+
+def test_parse():
+    new, old = launchpadtools.changelog.parse(CHANGELOG)
+    assert new["package"] == "foo"
+    assert new["version"] == "1:2.0-1"
+    assert new["distributions"] == ["unstable", "experimental"]
+    assert new["urgency"] == "high"
+    assert new["fields"] == {"urgency": "high", "binary-only": "yes"}
+    assert new["changes"] == ["  * Second release.", "    - with details"]
+    assert new["maintainer"] == ("Jane Doe", "jane@example.com")
+    assert new["date"] == "Mon, 02 Jan 2017 10:00:00 +0100"
+    assert old["version"] == "1.0-1"
+
+    with pytest.raises(launchpadtools.changelog.ChangelogError):
+        launchpadtools.changelog.parse("foo 1.0-1 unstable; urgency=low\n")
+    with pytest.raises(launchpadtools.changelog.ChangelogError):
+        launchpadtools.changelog.parse(CHANGELOG.split("\n -- Jane")[0])
+    return
+
+
+def test_write(monkeypatch):
+    monkeypatch.setenv("DEBEMAIL", "Max Mustermann <max@example.com>")
+    monkeypatch.delenv("DEBFULLNAME", raising=False)
+    assert launchpadtools.changelog.get_maintainer() == (
+        "Max Mustermann",
+        "max@example.com",
+    )
+    monkeypatch.setenv("DEBFULLNAME", "Erika Mustermann")
+    assert launchpadtools.changelog.get_maintainer() == (
+        "Erika Mustermann",
+        "max@example.com",
+    )
+
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, "changelog")
+        launchpadtools.changelog.write(
+            filename,
+            "foo",
+            "1:2.0-1bionic1",
+            "bionic",
+            date="Mon, 02 Jan 2017 10:00:00 +0100",
+        )
+        with open(filename) as f:
+            assert f.read() == (
+                "foo (1:2.0-1bionic1) bionic; urgency=medium\n"
+                "\n"
+                "  * launchpad-submit update\n"
+                "\n"
+                " -- Erika Mustermann <max@example.com>  "
+                "Mon, 02 Jan 2017 10:00:00 +0100\n"
+            )
+
+        entry = launchpadtools.changelog.read_latest(filename)
+        assert entry["version"] == "1:2.0-1bionic1"
+        assert entry["distributions"] == ["bionic"]
+        assert entry["changes"] == ["  * launchpad-submit update"]
+    return
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+#
+import os
+import tempfile
+
+import pytest
+
+import launchpadtools
+
+
+def test_journal():
+    with tempfile.TemporaryDirectory() as tmp:
+        work_dir = os.path.join(tmp, "work")
+        journal = launchpadtools.checkpoint.StageJournal(work_dir)
+        journal.reset()
+        assert not journal.open({"tree_hash": "abc"})
+
+        changes = os.path.join(work_dir, "foo_1.0_source.changes")
+        with open(changes, "w") as f:
+            f.write("Files:\n")
+        journal.put("built", "focal", files=[changes], chlog_version="1.0")
+        journal.put("uploaded", "focal")
+        journal.fail("jammy", RuntimeError("upload failed"))
+        assert journal.get("built", "focal")["chlog_version"] == "1.0"
+        assert journal.get_summary() == [
+            "focal: uploaded",
+            "jammy: not built, then failed (RuntimeError: upload failed)",
+        ]
+
+        # A new process continues where the last one stopped...
+        journal = launchpadtools.checkpoint.StageJournal(work_dir)
+        assert journal.is_started()
+        assert journal.open({"tree_hash": "abc"})
+        assert journal.get("uploaded", "focal") is not None
+
+        # ...unless the files have changed,
+        with open(changes, "a") as f:
+            f.write("changed\n")
+        assert journal.get("built", "focal") is None
+        # and rebuilding means uploading again.
+        journal.put("built", "focal", files=[changes], chlog_version="1.0")
+        assert journal.get("uploaded", "focal") is None
+
+        # Other submissions start over.
+        assert not journal.open({"tree_hash": "def"})
+        assert os.listdir(work_dir) == [launchpadtools.checkpoint.FILENAME]
+    return
+
+
+def test_foreign_directory():
+    with tempfile.TemporaryDirectory() as work_dir:
+        with open(os.path.join(work_dir, "precious.txt"), "w") as f:
+            f.write("don't delete me\n")
+        journal = launchpadtools.checkpoint.StageJournal(work_dir)
+        with pytest.raises(launchpadtools.checkpoint.CheckpointError):
+            journal.reset()
+        assert os.listdir(work_dir) == ["precious.txt"]
+    return
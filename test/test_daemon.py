@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+#
+import json
+import os
+import tempfile
+import urllib.request
+
+import launchpadtools
+
+MANIFEST = """
+launchpad_login = "john"
+ubuntu_releases = ["focal"]
+
+[[package]]
+directory = "foo"
+ppa = "john/foo-nightly"
+
+[[package]]
+directory = "bar"
+ppa = "john/bar-nightly"
+exclude = ["build/"]
+"""
+
+
+def _write(directory, relpath, content):
+    path = os.path.join(directory, relpath)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(content)
+    # distinct mtimes without sleeping
+    os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 10 ** 9))
+
+
+def test_poll():
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, "manifest.toml")
+        with open(filename, "w") as f:
+            f.write(MANIFEST)
+        for name in ["foo", "bar"]:
+            _write(directory, f"{name}/src/main.c", "int main;\n")
+        entries = launchpadtools.batch.load_manifest(filename)
+
+        daemon = launchpadtools.daemon.Daemon(
+            entries, debounce=5, cache_dir=directory, use_cache=False
+        )
+        try:
+            # Everything is due at first.
+            assert daemon.poll(now=100) == [0, 1]
+            assert daemon.poll(now=101) == []
+            status = daemon.status()
+            assert status["queue_depth"] == 2
+            report = {
+                "status": "up-to-date",
+                "results": {},
+                "error": None,
+                "elapsed_time": 1.0,
+            }
+            for k in [0, 1]:
+                daemon._done(k, 100, report)
+
+            assert daemon.poll(now=110) == []
+            _write(directory, "foo/src/main.c", "int main2;\n")
+            _write(directory, "bar/build/main.o", "ELF\n")
+            # changes are submitted after the debounce time
+            assert daemon.poll(now=111) == []
+            assert daemon.states == ["waiting", "idle"]
+            _write(directory, "foo/src/util.c", "int util;\n")
+            assert daemon.poll(now=115) == []
+            assert daemon.poll(now=120) == [0]
+
+            server = launchpadtools.daemon.serve_status(daemon, 0)
+            try:
+                host, port = server.server_address[:2]
+                with urllib.request.urlopen(f"http://{host}:{port}/") as response:
+                    status = json.loads(response.read())
+            finally:
+                server.shutdown()
+                server.server_close()
+            assert status["queue_depth"] == 1
+            assert [p["state"] for p in status["packages"]] == ["queued", "idle"]
+            assert status["packages"][1]["runs"] == 1
+            assert status["packages"][1]["last_run"]["status"] == "up-to-date"
+        finally:
+            daemon.close()
+    return
+
+
+STUBS = os.path.join(os.path.dirname(__file__), "..", "benchmarks", "stubs")
+
+
+class _FakeUploader:
+    """Records the uploads instead of sending them."""
+
+    uploads = []
+
+    def __init__(self, login):
+        self.login = login
+
+    def upload(self, ppa_string, changes_file):
+        self.uploads.append((self.login, ppa_string, os.path.basename(changes_file)))
+        return os.path.getsize(changes_file)
+
+    def close(self, ppa_string=None):
+        return
+
+
+def test_submit(monkeypatch):
+    monkeypatch.setenv("PATH", os.path.abspath(STUBS) + os.pathsep + os.environ["PATH"])
+    monkeypatch.setenv("DEBEMAIL", "Max Mustermann <max@example.com>")
+    monkeypatch.setattr(launchpadtools.upload, "Uploader", _FakeUploader)
+    monkeypatch.setattr(_FakeUploader, "uploads", [])
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, "manifest.toml")
+        with open(filename, "w") as f:
+            f.write(
+                MANIFEST.replace(
+                    'ubuntu_releases = ["focal"]',
+                    'ubuntu_releases = ["bionic", "focal"]\nforce = true',
+                )
+            )
+        _write(directory, "foo/src/main.c", "int main;\n")
+        _write(
+            directory,
+            "foo/debian/changelog",
+            "foo (1.0-1) unstable; urgency=medium\n\n  * Initial release.\n\n"
+            " -- Max Mustermann <max@example.com>  Sat, 17 Oct 2026 12:00:00 +0000\n",
+        )
+        entries = launchpadtools.batch.load_manifest(filename)
+
+        daemon = launchpadtools.daemon.Daemon(
+            entries[:1], jobs=1, cache_dir=directory, use_cache=False
+        )
+        try:
+            report = daemon._run(0)
+        finally:
+            daemon.close()
+        assert report["error"] is None
+        assert report["status"] == "submitted"
+        assert report["results"] == {"bionic": None, "focal": None}
+        assert sorted(_FakeUploader.uploads) == [
+            ("john", "john/foo-nightly", "foo_1.0-1bionic1_source.changes"),
+            ("john", "john/foo-nightly", "foo_1.0-1focal1_source.changes"),
+        ]
+        assert daemon.status()["packages"][0]["last_run"]["status"] == "submitted"
+    return
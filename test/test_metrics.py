@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+#
+import os
+import subprocess
+import tempfile
+
+import pytest
+
+import launchpadtools
+
+
+def test_metrics():
+    metrics = launchpadtools.metrics
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, "metrics.jsonl")
+
+        # disabled: measured, but nothing written
+        with metrics.stage("outer") as s:
+            pass
+        assert s.elapsed_time >= 0.0
+        assert not os.path.exists(filename)
+
+        metrics.enable(filename)
+        try:
+            with metrics.context(package="foo"):
+                with metrics.stage("outer", single_pass=True) as s:
+                    s.add("files", 2)
+                    s.add("files")
+                    with metrics.context(release="bionic"):
+                        metrics.check_call(["true"])
+                    with pytest.raises(subprocess.CalledProcessError):
+                        metrics.check_call(["false"])
+        finally:
+            metrics.enable(None)
+
+        true, false, outer = metrics.read(filename)
+
+        assert true["kind"] == "subprocess"
+        assert true["name"] == "true"
+        assert true["parent"] == "outer"
+        assert true["package"] == "foo"
+        assert true["release"] == "bionic"
+
+        assert false["returncode"] == 1
+        assert false["error"] == "CalledProcessError"
+        assert "release" not in false
+
+        assert outer["kind"] == "stage"
+        assert outer["parent"] is None
+        assert outer["files"] == 3
+        assert outer["single_pass"]
+        assert outer["wall_time"] >= true["wall_time"] + false["wall_time"]
+        for key in ["start", "cpu_time", "children_cpu_time", "pid"]:
+            assert key in outer
+    return
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+#
+import os
+import tempfile
+
+import launchpadtools
+
+
+def _write(directory, path, content):
+    path = os.path.join(directory, path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(content)
+
+
+def _read(directory, path):
+    with open(os.path.join(directory, path), "rb") as f:
+        return f.read()
+
+
+LINES = b"".join(b"line %d\n" % k for k in range(1, 21))
+
+# applies exactly
+EXACT = b"""Description: exact
+--- a/a.txt
++++ b/a.txt
+@@ -2,3 +2,3 @@
+ line 2
+-line 3
++line three
+ line 4
+"""
+
+# the context of line 11 has been changed upstream, and everything has moved
+FUZZY = b"""Description: fuzzy
+Index: pkg/a.txt
+===================================================================
+--- a/a.txt
++++ b/a.txt
+@@ -8,7 +8,7 @@
+ line 8
+ line 9
+ line 10
+-line 11
++line eleven
+ line 12
+ line 13
+ line 14
+"""
+
+BROKEN = b"""--- a/a.txt
++++ b/a.txt
+@@ -15,3 +15,3 @@
+ line 15
+-line 99
++line 100
+ line 17
+"""
+
+NEW_FILE = b"""--- /dev/null
++++ b/b.txt
+@@ -0,0 +1,2 @@
++one
++two
+\\ No newline at end of file
+"""
+
+
+def test_update_patches():
+    with tempfile.TemporaryDirectory() as directory:
+        content = LINES.replace(b"line 8\n", b"line eight\n")
+        content = content.replace(b"line 1\n", b"line 0\nline 1\n")
+        _write(directory, "a.txt", content)
+        _write(directory, "debian/patches/exact.patch", EXACT)
+        _write(directory, "debian/patches/fuzzy.patch", FUZZY)
+        _write(directory, "debian/patches/broken.patch", BROKEN)
+        _write(directory, "debian/patches/new-file.patch", NEW_FILE)
+        _write(
+            directory,
+            "debian/patches/series",
+            b"# comment\nexact.patch\nfuzzy.patch -p1\nbroken.patch\nnew-file.patch\n",
+        )
+
+        refreshed, removed = launchpadtools.patches.update_patches(directory)
+        assert refreshed == ["exact.patch", "fuzzy.patch"]
+        assert removed == ["broken.patch"]
+
+        # The tree is left alone.
+        assert _read(directory, "a.txt") == content
+        assert not os.path.exists(os.path.join(directory, "b.txt"))
+
+        assert _read(directory, "debian/patches/series") == (
+            b"# comment\nexact.patch\nfuzzy.patch -p1\nnew-file.patch\n"
+        )
+        assert not os.path.exists(
+            os.path.join(directory, "debian", "patches", "broken.patch")
+        )
+        assert _read(directory, "debian/patches/new-file.patch") == NEW_FILE
+        # refreshed with three lines of context, like quilt does
+        assert _read(directory, "debian/patches/exact.patch") == (
+            b"Description: exact\n"
+            b"--- a/a.txt\n"
+            b"+++ b/a.txt\n"
+            b"@@ -1,7 +1,7 @@\n"
+            b" line 0\n"
+            b" line 1\n"
+            b" line 2\n"
+            b"-line 3\n"
+            b"+line three\n"
+            b" line 4\n"
+            b" line 5\n"
+            b" line 6\n"
+        )
+        assert _read(directory, "debian/patches/fuzzy.patch") == (
+            b"Description: fuzzy\n"
+            b"Index: pkg/a.txt\n"
+            b"===================================================================\n"
+            b"--- a/a.txt\n"
+            b"+++ b/a.txt\n"
+            b"@@ -9,7 +9,7 @@\n"
+            b" line eight\n"
+            b" line 9\n"
+            b" line 10\n"
+            b"-line 11\n"
+            b"+line eleven\n"
+            b" line 12\n"
+            b" line 13\n"
+            b" line 14\n"
+        )
+
+        # Now everything applies exactly.
+        assert launchpadtools.patches.update_patches(directory) == ([], [])
+    return
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+#
+import subprocess
+import threading
+import time
+
+import pytest
+
+import launchpadtools
+
+
+def test_overlap():
+    events = []
+    lock = threading.Lock()
+
+    def log(event):
+        with lock:
+            events.append(event)
+
+    def build(item):
+        log(("build", item))
+        time.sleep(0.2)
+        if item == "b":
+            raise subprocess.CalledProcessError(1, "debuild")
+        return item.upper()
+
+    def upload(item, built):
+        assert built == item.upper()
+        log(("upload", item))
+        time.sleep(0.2)
+        if item == "c":
+            raise subprocess.CalledProcessError(1, "dput")
+
+    tic = time.time()
+    results = launchpadtools.pipeline.run(
+        ["a", "b", "c", "d"], build, upload, errors=(subprocess.CalledProcessError,)
+    )
+    elapsed = time.time() - tic
+
+    assert list(results) == ["a", "b", "c", "d"]
+    assert results["a"] is None and results["d"] is None
+    assert results["b"].cmd == "debuild"
+    assert results["c"].cmd == "dput"
+    # a failed build isn't uploaded
+    assert ("upload", "b") not in events
+    # b is built while a uploads: four builds and the last upload, not the sum
+    # of seven steps
+    assert elapsed < 1.3
+    return
+
+
+def test_cancel():
+    started = []
+
+    def build(item):
+        started.append(item)
+        time.sleep(0.1)
+        return item
+
+    def upload(item, built):
+        if item == 1:
+            raise RuntimeError("unexpected")
+        time.sleep(0.1)
+
+    with pytest.raises(RuntimeError):
+        launchpadtools.pipeline.run(list(range(10)), build, upload, queue_size=1)
+    # Once the upload failed, no new builds were started.
+    assert len(started) < 5
+    return
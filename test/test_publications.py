@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+#
+import http.server
+import json
+import os
+import tempfile
+import threading
+import urllib.parse
+
+import launchpadtools
+
+
+class _FakeLaunchpad(http.server.BaseHTTPRequestHandler):
+    """Serves a small subset of the Launchpad web service for the PPA
+    `~john/+archive/ubuntu/nightly`.
+    """
+
+    # (version, series, status)
+    publications = [
+        ("1.0-abcd1234-1bionic1", "bionic", "Published"),
+        ("1.0-abcd1234-1xenial1", "xenial", "Published"),
+        ("0.9-0000aaaa-1xenial1", "xenial", "Superseded"),
+        ("1.1-ffff0000-1xenial1", "xenial", "Pending"),
+    ]
+    page_size = 1
+    requests = []
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, data):
+        body = json.dumps(data).encode("utf-8")
+        etag = '"{}"'.format(hash(body))
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self.requests.append(self.path)
+        root = f"http://localhost:{self.server.server_port}/1.0"
+        url = urllib.parse.urlparse(self.path)
+        query = dict(urllib.parse.parse_qsl(url.query))
+
+        if query["ws.op"] == "sourceFileUrls":
+            k = int(url.path.rsplit("/", 1)[-1])
+            version = self.publications[k][0]
+            upstream = version.rsplit("-", 1)[0]
+            self._send(
+                [
+                    f"{root}/+files/foo_{upstream}.orig.tar.gz",
+                    f"{root}/+files/foo_{version}.debian.tar.xz",
+                ]
+            )
+            return
+
+        assert url.path == "/1.0/~john/+archive/ubuntu/nightly"
+        assert query["ws.op"] == "getPublishedSources"
+        assert query["source_name"] == "foo"
+        entries = [
+            {
+                "source_package_version": version,
+                "distro_series_link": f"{root}/ubuntu/{series}",
+                "self_link": f"{root}/~john/+archive/ubuntu/nightly/+sourcepub/{k}",
+            }
+            for k, (version, series, status) in enumerate(self.publications)
+            if status == query["status"]
+        ]
+        start = int(query.get("ws.start", 0))
+        page = {"entries": entries[start : start + self.page_size]}
+        if start + self.page_size < len(entries):
+            query["ws.start"] = start + self.page_size
+            page["next_collection_link"] = "{}{}?{}".format(
+                root[: -len("/1.0")], url.path, urllib.parse.urlencode(query)
+            )
+        self._send(page)
+
+
+def test_publication_index(monkeypatch):
+    server = http.server.HTTPServer(("localhost", 0), _FakeLaunchpad)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    api_root = f"http://localhost:{server.server_port}/1.0"
+    requests = _FakeLaunchpad.requests
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            cache_dir = os.path.join(directory, "cache")
+            index = launchpadtools.publications.PublicationIndex(
+                "john/nightly", "foo", api_root=api_root, cache_dir=cache_dir
+            )
+            assert index.has_tree_hash("xenial", "abcd1234")
+            assert index.has_tree_hash("bionic", "abcd1234")
+            assert not index.has_tree_hash("trusty", "abcd1234")
+            assert not index.has_tree_hash("xenial", "0000aaaa")
+            # one page for the pending, two for the published sources
+            assert len(requests) == 3
+
+            assert index.get_file_names() == {
+                "foo_1.0-abcd1234.orig.tar.gz",
+                "foo_1.0-abcd1234-1bionic1.debian.tar.xz",
+                "foo_1.0-abcd1234-1xenial1.debian.tar.xz",
+                "foo_1.1-ffff0000.orig.tar.gz",
+                "foo_1.1-ffff0000-1xenial1.debian.tar.xz",
+            }
+            assert len(requests) == 6
+
+            # within the TTL, a new index doesn't ask Launchpad
+            index = launchpadtools.publications.PublicationIndex(
+                "john/nightly", "foo", api_root=api_root, cache_dir=cache_dir
+            )
+            assert index.has_tree_hash("xenial", "abcd1234")
+            assert len(index.get_file_names()) == 5
+            assert len(requests) == 6
+
+            # after it, all pages are revalidated
+            index = launchpadtools.publications.PublicationIndex(
+                "john/nightly", "foo", api_root=api_root, cache_dir=cache_dir, ttl=0
+            )
+            assert index.has_tree_hash("xenial", "abcd1234")
+            assert len(index.get_file_names()) == 5
+            assert len(requests) == 9
+
+            # a change on a later page is noticed, and only that page is fetched
+            publications = list(_FakeLaunchpad.publications)
+            publications[1] = ("1.0-eeee5555-1xenial1", "xenial", "Published")
+            monkeypatch.setattr(_FakeLaunchpad, "publications", publications)
+            index = launchpadtools.publications.PublicationIndex(
+                "john/nightly", "foo", api_root=api_root, cache_dir=cache_dir, ttl=0
+            )
+            assert index.has_tree_hash("xenial", "eeee5555")
+            assert index.has_tree_hash("bionic", "abcd1234")
+            assert len(requests) == 12
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+    return
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+#
+import os
+import tarfile
+import tempfile
+
+import launchpadtools
+
+DSC = """-----BEGIN PGP SIGNED MESSAGE-----
+Hash: SHA512
+
+Format: 3.0 (quilt)
+Source: foo
+Version: 1:1.0-1xenial1
+Checksums-Sha256:
+ aaaa 100 foo_1.0.orig.tar.gz
+ bbbb 200 foo_1.0-1xenial1.debian.tar.xz
+Files:
+ cccc 100 foo_1.0.orig.tar.gz
+ dddd 200 foo_1.0-1xenial1.debian.tar.xz
+
+-----BEGIN PGP SIGNATURE-----
+
+iQIzBAEBCgAdFiEE
+-----END PGP SIGNATURE-----
+"""
+
+CHANGELOG = """foo (1:1.0-1bionic1) bionic; urgency=medium
+
+  * launchpad-submit update
+
+ -- John Doe <john@example.com>  Sat, 17 Oct 2026 12:00:00 +0200
+"""
+
+
+def test_control():
+    (dsc,) = launchpadtools.source.parse_control(DSC)
+    assert dsc["Format"] == "3.0 (quilt)"
+    assert dsc["Files"].split("\n")[1] == " cccc 100 foo_1.0.orig.tar.gz"
+    ext = launchpadtools.source.get_debian_tarball_ext(dsc, "foo", "1.0-1xenial1")
+    assert ext == ".xz"
+
+    with tempfile.TemporaryDirectory() as directory:
+        new = os.path.join(directory, "foo_1.0-1bionic1.debian.tar.xz")
+        with open(new, "wb") as f:
+            f.write(b"abc")
+        launchpadtools.source.replace_files(
+            dsc, {"foo_1.0-1xenial1.debian.tar.xz": new}
+        )
+
+    text = launchpadtools.source.dump_control(dsc)
+    assert launchpadtools.source.parse_control(text) == [dsc]
+    assert (
+        " ba7816bf8f01cfea414140de5dae2223b00361a396177a9cb410ff61f20015ad 3 "
+        "foo_1.0-1bionic1.debian.tar.xz"
+    ) in text
+    assert " cccc 100 foo_1.0.orig.tar.gz" in text
+    return
+
+
+def test_debian_tarball():
+    with tempfile.TemporaryDirectory() as directory:
+        os.makedirs(os.path.join(directory, "orig", "debian", "source"))
+        with open(os.path.join(directory, "orig", "debian", "changelog"), "w") as f:
+            f.write(CHANGELOG)
+        with open(os.path.join(directory, "orig", "debian", "source", "format"), "w") as f:
+            f.write("3.0 (quilt)\n")
+
+        entry = launchpadtools.source.parse_changelog_entry(
+            os.path.join(directory, "orig", "debian", "changelog")
+        )
+        assert entry["Version"] == "1:1.0-1bionic1"
+        assert entry["Distribution"] == "bionic"
+        assert entry["Changed-By"] == "John Doe <john@example.com>"
+        assert entry["Changes"] == (
+            "\n foo (1:1.0-1bionic1) bionic; urgency=medium"
+            "\n ."
+            "\n   * launchpad-submit update"
+        )
+
+        filename = os.path.join(directory, "foo_1.0-1bionic1.debian.tar.xz")
+        launchpadtools.source.create_debian_tarball(
+            os.path.join(directory, "orig"), filename
+        )
+        with tarfile.open(filename) as tar:
+            assert tar.getnames() == [
+                "debian",
+                "debian/changelog",
+                "debian/source",
+                "debian/source/format",
+            ]
+            assert {m.mtime for m in tar.getmembers()} == {1792231200}
+    return
+
+
+def test_derive(monkeypatch):
+    stubs = os.path.join(os.path.dirname(__file__), "..", "benchmarks", "stubs")
+    monkeypatch.setenv("PATH", os.path.abspath(stubs) + os.pathsep + os.environ["PATH"])
+    with tempfile.TemporaryDirectory() as directory:
+        orig_dir = os.path.join(directory, "orig")
+        files = {
+            "debian/changelog": CHANGELOG.replace("bionic", "xenial"),
+            "debian/rules": "#!/usr/bin/make -f\n",
+            "debian/source/format": "3.0 (quilt)\n",
+            "debian/patches/series": "fix.patch\n",
+            "debian/patches/fix.patch": "",
+            # ignored by dpkg-source
+            "debian/rules~": "",
+            "debian/patches/fix.patch.orig": "",
+            "debian/.git/HEAD": "",
+        }
+        for relpath, content in files.items():
+            path = os.path.join(orig_dir, relpath)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w") as f:
+                f.write(content)
+
+        # what `debuild -S` would produce for the template
+        template = os.path.join(directory, "foo_1.0-1xenial1.debian.tar.xz")
+        launchpadtools.source.create_debian_tarball(orig_dir, template)
+        with tarfile.open(template) as tar:
+            template_names = tar.getnames()
+        assert template_names == [
+            "debian",
+            "debian/changelog",
+            "debian/patches",
+            "debian/rules",
+            "debian/source",
+            "debian/patches/fix.patch",
+            "debian/patches/series",
+            "debian/source/format",
+        ]
+        for filename in ["foo_1.0-1xenial1.dsc", "foo_1.0-1xenial1_source.changes"]:
+            with open(os.path.join(directory, filename), "w") as f:
+                f.write(
+                    "Format: 3.0 (quilt)\nFiles:\n"
+                    " dddd 200 foo_1.0-1xenial1.debian.tar.xz\n"
+                )
+
+        # left behind by the build of the template
+        with open(os.path.join(orig_dir, "debian", "files"), "w") as f:
+            f.write("foo_1.0-1xenial1_source.buildinfo devel optional\n")
+        with open(os.path.join(orig_dir, "debian", "changelog"), "w") as f:
+            f.write(CHANGELOG)
+
+        launchpadtools.source.derive_source_package(
+            directory, orig_dir, "foo", "1.0-1xenial1", "1.0-1bionic1"
+        )
+        derived = os.path.join(directory, "foo_1.0-1bionic1.debian.tar.xz")
+        with tarfile.open(derived) as tar:
+            assert tar.getnames() == template_names
+            changelog = tar.extractfile("debian/changelog").read().decode()
+        assert changelog == CHANGELOG
+    return
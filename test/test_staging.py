@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+#
+import os
+import tempfile
+
+import launchpadtools
+
+
+def _write(directory, relpath, content):
+    path = os.path.join(directory, relpath)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(content)
+
+
+def test_stage_tree():
+    with tempfile.TemporaryDirectory() as directory:
+        source = os.path.join(directory, "source")
+        target = os.path.join(directory, "target")
+        _write(source, ".git/HEAD", "ref: refs/heads/master\n")
+        _write(source, "src/main.c", "int main() { return 0; }\n")
+        _write(source, "src/util.c", "int util;\n")
+        _write(source, "debian/changelog", "foo (1.0-1) xenial; urgency=medium\n")
+        _write(source, "debian/patches/series", "fix.patch\n")
+        _write(
+            source,
+            "debian/patches/fix.patch",
+            "--- a/src/util.c\n+++ b/src/util.c\n@@ -1 +1 @@\n-int util;\n+int util2;\n",
+        )
+        os.symlink("main.c", os.path.join(source, "src", "link.c"))
+
+        counts = launchpadtools.staging.stage_tree(source, target)
+
+        assert not os.path.exists(os.path.join(target, ".git"))
+        assert os.readlink(os.path.join(target, "src", "link.c")) == "main.c"
+        assert sum(counts.values()) == 5
+
+        def same_inode(relpath):
+            return (
+                os.stat(os.path.join(source, relpath)).st_ino
+                == os.stat(os.path.join(target, relpath)).st_ino
+            )
+
+        # Files the pipeline modifies must never be hard-linked.
+        assert not same_inode("debian/changelog")
+        assert not same_inode("src/util.c")
+        if counts["hardlinked"]:
+            assert same_inode("src/main.c")
+
+        with open(os.path.join(target, "src", "util.c")) as f:
+            assert f.read() == "int util;\n"
+    return
+
+
+def test_sync_tree():
+    with tempfile.TemporaryDirectory() as directory:
+        source = os.path.join(directory, "source")
+        target = os.path.join(directory, "target")
+        _write(source, "src/main.c", "int main() { return 0; }\n")
+        _write(source, "src/util.c", "int util;\n")
+        _write(source, "doc/index.txt", "Docs\n")
+        _write(source, "debian/changelog", "foo (1.0-1) xenial; urgency=medium\n")
+
+        counts = launchpadtools.staging.sync_tree(source, target)
+        assert counts["unchanged"] == 0 and counts["deleted"] == 0
+        assert counts["reflinked"] + counts["hardlinked"] + counts["copied"] == 4
+
+        # what a run leaves behind
+        _write(target, ".pc/applied-patches", "")
+        _write(target, "debian/changelog", "foo (1.0-1ubuntu1) xenial\n")
+        # source changes; like Git, replace rather than rewrite files
+        os.remove(os.path.join(source, "src", "util.c"))
+        _write(source, "src/util.c", "int util2;\n")
+        _write(source, "src/new.c", "int new;\n")
+        os.remove(os.path.join(source, "doc", "index.txt"))
+        os.rmdir(os.path.join(source, "doc"))
+        _write(source, "doc", "Docs are a file now\n")
+
+        counts = launchpadtools.staging.sync_tree(source, target)
+        # main.c is the only file left alone
+        assert counts["unchanged"] == 1
+        assert counts["reflinked"] + counts["hardlinked"] + counts["copied"] == 4
+        assert counts["deleted"] == 1
+
+        def read(root):
+            files = {}
+            for dirpath, _, filenames in os.walk(root):
+                for filename in filenames:
+                    path = os.path.join(dirpath, filename)
+                    with open(path) as f:
+                        files[os.path.relpath(path, root)] = f.read()
+            return files
+
+        assert read(target) == read(source)
+
+        counts = launchpadtools.staging.sync_tree(source, target)
+        assert counts["unchanged"] == 5
+        assert counts["deleted"] == 0
+    return
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+#
+import os
+import subprocess
+import sys
+
+# Modules only the stages that need them may import
+LAZY = [
+    "paramiko",
+    "urllib.request",
+    "launchpadtools.submit",
+    "launchpadtools.upload",
+]
+
+# Budget in microseconds for `import launchpadtools.cli`. It's generous; the point
+# is to catch heavy imports creeping back in (paramiko alone takes longer).
+BUDGET_US = 100000
+
+
+def _get_import_times(code):
+    """Runs `code` in a fresh interpreter and returns the cumulative import time
+    in microseconds of every module imported.
+    """
+    out = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        check=True,
+    )
+    times = {}
+    for line in out.stderr.decode("utf-8").splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def test_startup():
+    times = _get_import_times(
+        "import launchpadtools.cli as cli; "
+        "cli._parse_cmd_arguments(['-d', '.', '-u', 'focal', '-p', 'a/b', '-l', 'a'])"
+    )
+    for name in LAZY:
+        assert name not in times, f"{name} is imported on startup"
+    # best of three, against noise
+    best = min(
+        times["launchpadtools.cli"],
+        _get_import_times("import launchpadtools.cli")["launchpadtools.cli"],
+        _get_import_times("import launchpadtools.cli")["launchpadtools.cli"],
+    )
+    assert best < BUDGET_US, f"import launchpadtools.cli took {best} us"
+    return
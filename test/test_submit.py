@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+#
+import os
+import tempfile
+
+import pytest
+
+import launchpadtools
+
+# Stand-ins for the Debian tools: debuild writes a source package with nothing but
+# a .dsc, logs whether the orig is included, and fails for the distribution in
+# $STUB_FAIL; dput logs its calls.
+DEBUILD = """#!/bin/sh
+VER=$(head -1 debian/changelog | sed 's/[^(]*(\\([^)]*\\)).*/\\1/')
+DIST=$(head -1 debian/changelog | sed 's/[^)]*) \\([^;]*\\);.*/\\1/')
+echo "debuild stub: $DIST"
+echo "$2" >> "${STUB_DEBUILD_LOG:-/dev/null}"
+if [ "$DIST" = "$STUB_FAIL" ]; then
+    echo "debuild stub: failing" >&2
+    exit 1
+fi
+echo stub > "../foo_$VER.dsc"
+printf "Format: 1.8\\nFiles:\\n 0000 5 devel optional foo_%s.dsc\\n" "$VER" \\
+    > "../foo_${VER}_source.changes"
+"""
+
+DPUT = """#!/bin/sh
+echo "$4" >> "$STUB_DPUT_LOG"
+"""
+
+
+class _FailingUploader:
+    """Makes every upload fall back to dput."""
+
+    def __init__(self, login):
+        return
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return
+
+    def upload(self, ppa_string, changes_file):
+        raise launchpadtools.upload.UploadError("no SFTP in tests")
+
+
+def _write(directory, relpath, content, mode=0o644):
+    path = os.path.join(directory, relpath)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(content)
+    os.chmod(path, mode)
+
+
+def _setup(directory, monkeypatch):
+    """Creates the package `foo` in `directory` and puts the stubs on the PATH.
+    Returns the package directory and the dput log.
+    """
+    package = os.path.join(directory, "foo")
+    _write(package, "src/main.c", "int main() { return 0; }\n")
+    _write(
+        package,
+        "debian/changelog",
+        "foo (1.0-1) unstable; urgency=medium\n\n  * Initial release.\n\n"
+        " -- Max Mustermann <max@example.com>  Sat, 17 Oct 2026 12:00:00 +0000\n",
+    )
+    bin_dir = os.path.join(directory, "bin")
+    _write(bin_dir, "debuild", DEBUILD, 0o755)
+    _write(bin_dir, "dput", DPUT, 0o755)
+    dput_log = os.path.join(directory, "dput.log")
+    monkeypatch.setenv("PATH", bin_dir + os.pathsep + os.environ["PATH"])
+    monkeypatch.setenv("STUB_DPUT_LOG", dput_log)
+    monkeypatch.setenv("DEBEMAIL", "Max Mustermann <max@example.com>")
+    monkeypatch.setattr(launchpadtools.upload, "Uploader", _FailingUploader)
+    return package, dput_log
+
+
+def _read_lines(filename):
+    if not os.path.exists(filename):
+        return []
+    with open(filename) as f:
+        return f.read().split()
+
+
+def test_parallel(monkeypatch, capsys):
+    with tempfile.TemporaryDirectory() as directory:
+        package, dput_log = _setup(directory, monkeypatch)
+        monkeypatch.setenv("STUB_FAIL", "bionic")
+        results = launchpadtools.submit.submit(
+            package,
+            ["xenial", "bionic", "focal"],
+            "john/foo-nightly",
+            "john",
+            force=True,
+            cache_dir=directory,
+            use_cache=False,
+            jobs=2,
+        )
+        # The failing build doesn't keep the others from being uploaded.
+        assert set(results) == {"xenial", "bionic", "focal"}
+        assert results["xenial"] is None
+        assert results["focal"] is None
+        assert results["bionic"] is not None
+        assert sorted(_read_lines(dput_log)) == [
+            "foo_1.0-1focal1_source.changes",
+            "foo_1.0-1xenial1_source.changes",
+        ]
+
+        # The output of each build is printed in one piece, including the failed one.
+        out = capsys.readouterr().out
+        for release in ["xenial", "bionic", "focal"]:
+            assert f"==> {release} <==\ndebuild stub: {release}\n" in out
+        assert "debuild stub: failing" in out
+    return
+
+
+def test_force_includes_orig(monkeypatch):
+    with tempfile.TemporaryDirectory() as directory:
+        package, _ = _setup(directory, monkeypatch)
+        work_dir = os.path.join(directory, "work")
+        kwargs = {"force": True, "cache_dir": directory, "work_dir": work_dir}
+        launchpadtools.submit.submit(
+            package, ["xenial"], "john/foo-nightly", "john", **kwargs
+        )
+
+        # The journal has the orig, e.g., from an upload that Launchpad rejected.
+        # Without a look at the PPA, it is uploaded again nonetheless.
+        orig_tarball = os.path.join(work_dir, "foo_1.0.orig.tar.gz")
+        journal = launchpadtools.cache.UploadJournal(directory)
+        journal.put(
+            "john/foo-nightly", "foo_1.0.orig.tar.gz", journal.get_sha256(orig_tarball)
+        )
+        debuild_log = os.path.join(directory, "debuild.log")
+        monkeypatch.setenv("STUB_DEBUILD_LOG", debuild_log)
+        launchpadtools.submit.submit(
+            package, ["xenial", "bionic"], "john/foo-nightly", "john", **kwargs
+        )
+        assert _read_lines(debuild_log) == ["-sa", "-sa"]
+        journal = launchpadtools.cache.UploadJournal(directory)
+        assert not journal.contains("john/foo-nightly", orig_tarball)
+    return
+
+
+def test_run_logged(capfd):
+    with tempfile.TemporaryDirectory() as directory:
+        log_file = os.path.join(directory, "log")
+        result = launchpadtools.submit.run_logged(
+            log_file, os.system, "echo to stdout; echo to stderr >&2"
+        )
+        assert result == 0
+        with open(log_file) as f:
+            assert f.read() == "to stdout\nto stderr\n"
+        # Nothing reaches the terminal, and the file descriptors are restored.
+        assert capfd.readouterr() == ("", "")
+        print("restored")
+        assert capfd.readouterr().out == "restored\n"
+    return
+
+
+def test_main(monkeypatch):
+    with tempfile.TemporaryDirectory() as directory:
+        package, dput_log = _setup(directory, monkeypatch)
+        argv = [
+            "-d",
+            package,
+            "-u",
+            "xenial",
+            "bionic",
+            "-p",
+            "john/foo-nightly",
+            "-l",
+            "john",
+            "-f",
+            "-j",
+            "2",
+            "--cache-dir",
+            directory,
+            "--no-cache",
+        ]
+        assert launchpadtools.cli.main(argv) == 0
+        assert len(_read_lines(dput_log)) == 2
+
+        monkeypatch.setenv("STUB_FAIL", "xenial")
+        assert launchpadtools.cli.main(argv) != 0
+        assert len(_read_lines(dput_log)) == 3
+    return
+
+
+def test_ignored_arguments():
+    argv = ["-d", "foo", "-u", "focal", "-p", "john/foo-nightly", "-l", "john"]
+    for extra in [
+        ["-c", "auto", "--compression-level", "9"],
+        ["--build-once", "-j", "2"],
+    ]:
+        with pytest.raises(SystemExit):
+            launchpadtools.cli._parse_cmd_arguments(argv + extra)
+    args = launchpadtools.cli._parse_cmd_arguments(argv + ["--build-once"])
+    assert args.build_once
+    return
@@ -0,0 +1,322 @@
+# -*- coding: utf-8 -*-
+#
+import gzip
+import hashlib
+import io
+import lzma
+import os
+import shutil
+import subprocess
+import tarfile
+import tempfile
+
+import pytest
+
+import launchpadtools
+
+
+def _write(directory, relpath, content, mode=0o644):
+    path = os.path.join(directory, relpath)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(content)
+    os.chmod(path, mode)
+
+
+def _sha256(filename):
+    with open(filename, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def test_parallel_gzip():
+    data = os.urandom(100000) * 20 + b"tail"
+    out = io.BytesIO()
+    with launchpadtools.tarball.ParallelGzipWriter(out, max_workers=4) as gz:
+        gz.write(data)
+    assert gzip.decompress(out.getvalue()) == data
+    return
+
+
+def test_block_cache():
+    with tempfile.TemporaryDirectory() as directory:
+        previous = os.path.join(directory, "previous.tar.gz")
+        data = os.urandom(500000)
+
+        def compress(data):
+            cache = launchpadtools.tarball.GzipBlockCache(previous)
+            out = os.path.join(directory, "out.gz")
+            with open(out, "wb") as f, launchpadtools.tarball.ParallelGzipWriter(
+                f, block_size=100000, block_cache=cache
+            ) as gz:
+                gz.write(data)
+            cache.save(out)
+            with open(out, "rb") as f:
+                assert gzip.decompress(f.read()) == data
+            os.remove(out)
+            return cache
+
+        cache = compress(data)
+        assert cache.hits == 0 and cache.misses == 5
+        # Only the changed block and the next one (whose dictionary, the tail of
+        # the changed one, differs) are compressed again.
+        cache = compress(data[:290000] + b"x" + data[290001:])
+        assert cache.hits == 3 and cache.misses == 2
+        # a corrupt index isn't used
+        with open(previous + ".blocks.json", "w") as f:
+            f.write("{")
+        cache = compress(data)
+        assert cache.hits == 0
+    return
+
+
+def test_create_tarball():
+    with tempfile.TemporaryDirectory() as directory:
+        source = os.path.join(directory, "source")
+        _write(source, "src/main.c", b"int main() { return 0; }\n")
+        _write(source, "run.sh", b"#!/bin/sh\n", mode=0o775)
+        _write(source, "data", os.urandom(500000))
+        _write(source, "debian/changelog", b"foo (1.0-1) xenial; urgency=medium\n")
+        os.symlink("src/main.c", os.path.join(source, "link"))
+
+        tarball1 = os.path.join(directory, "foo1.orig.tar.gz")
+        launchpadtools.tarball.create_tarball(
+            source, tarball1, "foo-1.0", excludes=["./debian"], max_workers=1
+        )
+
+        os.utime(os.path.join(source, "data"), (1e9, 1e9))
+        tarball2 = os.path.join(directory, "foo2.orig.tar.gz")
+        launchpadtools.tarball.create_tarball(
+            source, tarball2, "foo-1.0", excludes=["./debian"], max_workers=4
+        )
+        assert _sha256(tarball1) == _sha256(tarball2)
+
+        with tarfile.open(tarball1) as tar:
+            members = {m.name: m for m in tar.getmembers()}
+            assert sorted(members) == [
+                "foo-1.0",
+                "foo-1.0/data",
+                "foo-1.0/link",
+                "foo-1.0/run.sh",
+                "foo-1.0/src",
+                "foo-1.0/src/main.c",
+            ]
+            assert members["foo-1.0/run.sh"].mode == 0o755
+            assert members["foo-1.0/link"].linkname == "src/main.c"
+            content = tar.extractfile("foo-1.0/src/main.c").read()
+            assert content == b"int main() { return 0; }\n"
+    return
+
+
+def test_hash_and_create_tarball():
+    with tempfile.TemporaryDirectory() as directory:
+        source = os.path.join(directory, "source")
+        _write(source, "src/main.c", b"int main() { return 0; }\n")
+        _write(source, "src/main.o", b"\x7fELF")
+        _write(source, ".gitignore", b"*.o\n")
+        _write(source, "data", os.urandom(500000))
+        _write(source, "debian/changelog", b"foo (1.0-1) xenial; urgency=medium\n")
+        _write(source, ".git/HEAD", b"ref: refs/heads/master\n")
+        os.symlink("src/main.c", os.path.join(source, "link"))
+
+        tarball1 = os.path.join(directory, "foo1.orig.tar.gz")
+        tree_hash, content_hash = launchpadtools.stream.hash_and_create_tarball(
+            source, tarball1, "foo-1.0", excludes=["./debian"]
+        )
+        assert tree_hash == launchpadtools.treehash.get_tree_hash(source)
+        assert content_hash == launchpadtools.tarball.get_content_hash(
+            source, excludes=["./debian"]
+        )
+
+        tarball2 = os.path.join(directory, "foo2.orig.tar.gz")
+        launchpadtools.tarball.create_tarball(
+            source, tarball2, "foo-1.0", excludes=["./debian", "./.git"]
+        )
+        assert _sha256(tarball1) == _sha256(tarball2)
+    return
+
+
+def test_content_hash():
+    with tempfile.TemporaryDirectory() as directory:
+        trees = [os.path.join(directory, name) for name in ["a", "b", "c"]]
+        for tree in trees:
+            _write(tree, "src/main.c", b"int main() { return 0; }\n")
+            _write(tree, "run.sh", b"#!/bin/sh\n", mode=0o755)
+        # differs only in an empty directory, which Git doesn't track
+        os.makedirs(os.path.join(trees[1], "empty"))
+        # differs only in the mode of a file
+        os.chmod(os.path.join(trees[2], "run.sh"), 0o644)
+        tree_hashes = [launchpadtools.treehash.get_tree_hash(t) for t in trees[:2]]
+        assert tree_hashes[0] == tree_hashes[1]
+        content_hashes = [launchpadtools.tarball.get_content_hash(t) for t in trees]
+        assert len(set(content_hashes)) == 3
+
+        # The orig tarball of one isn't taken from the store for the other.
+        cache_dir = os.path.join(directory, "cache")
+        names = []
+        for k, tree in enumerate(trees[:2]):
+            work_dir = os.path.join(directory, f"work{k}")
+            os.makedirs(work_dir)
+            orig_dir = os.path.join(work_dir, "orig")
+            launchpadtools.staging.stage_tree(tree, orig_dir)
+            (orig_tarball,) = launchpadtools.submit._create_orig_tarballs(
+                tree, orig_dir, work_dir, "foo", "1.0", cache_dir, True
+            )
+            with tarfile.open(orig_tarball) as tar:
+                names.append(tar.getnames())
+        assert "foo-1.0/empty" not in names[0]
+        assert "foo-1.0/empty" in names[1]
+    return
+
+
+def test_excludes():
+    with tempfile.TemporaryDirectory() as directory:
+        source = os.path.join(directory, "source")
+        _write(source, "src/main.c", b"int main() { return 0; }\n")
+        _write(source, "build/main.o", b"\x7fELF")
+        _write(source, "vendor/blob.bin", os.urandom(1000))
+        _write(source, "debian/changelog", b"foo (1.0-1) xenial; urgency=medium\n")
+        _write(source, "debian/build/log", b"log\n")
+        _write(source, ".launchpadignore", b"build/\n")
+        matcher = launchpadtools.ignore.read_excludes(source, ["/vendor"])
+
+        tarball1 = os.path.join(directory, "foo1.orig.tar.gz")
+        tree_hash, content_hash = launchpadtools.stream.hash_and_create_tarball(
+            source, tarball1, "foo-1.0", excludes=["./debian"], matcher=matcher
+        )
+        assert tree_hash == launchpadtools.treehash.get_tree_hash(
+            source, matcher=matcher
+        )
+        assert content_hash == launchpadtools.tarball.get_content_hash(
+            source, excludes=["./debian"], matcher=matcher
+        )
+        with tarfile.open(tarball1) as tar:
+            assert sorted(tar.getnames()) == [
+                "foo-1.0",
+                "foo-1.0/.launchpadignore",
+                "foo-1.0/src",
+                "foo-1.0/src/main.c",
+            ]
+
+        # The staged copy holds exactly what has been hashed.
+        target = os.path.join(directory, "target")
+        launchpadtools.staging.stage_tree(source, target, matcher=matcher)
+        assert not os.path.exists(os.path.join(target, "vendor"))
+        assert not os.path.exists(os.path.join(target, "debian", "build"))
+        assert launchpadtools.treehash.get_tree_hash(target) == tree_hash
+        assert (
+            launchpadtools.tarball.get_content_hash(target, excludes=["./debian"])
+            == content_hash
+        )
+
+        tarball2 = os.path.join(directory, "foo2.orig.tar.gz")
+        launchpadtools.tarball.create_tarball(
+            target, tarball2, "foo-1.0", excludes=["./debian"]
+        )
+        assert _sha256(tarball1) == _sha256(tarball2)
+    return
+
+
+def test_parallel_xz():
+    data = os.urandom(100000) * 20 + b"tail"
+    out1 = io.BytesIO()
+    with launchpadtools.tarball.ParallelXzWriter(
+        out1, level=1, max_workers=1, block_size=300000
+    ) as xz:
+        xz.write(data)
+    out4 = io.BytesIO()
+    with launchpadtools.tarball.ParallelXzWriter(
+        out4, level=1, max_workers=4, block_size=300000
+    ) as xz:
+        xz.write(data[:1000])
+        xz.write(data[1000:])
+    # one stream of seven blocks, regardless of the workers
+    assert out1.getvalue() == out4.getvalue()
+    assert lzma.decompress(out1.getvalue()) == data
+    decompressor = lzma.LZMADecompressor()
+    assert decompressor.decompress(out1.getvalue()) == data
+    assert decompressor.eof and not decompressor.unused_data
+
+    empty = io.BytesIO()
+    launchpadtools.tarball.ParallelXzWriter(empty).close()
+    assert lzma.decompress(empty.getvalue()) == b""
+    return
+
+
+def test_compressions():
+    with tempfile.TemporaryDirectory() as directory:
+        source = os.path.join(directory, "source")
+        _write(source, "src/main.c", b"int main() { return 0; }\n" * 1000)
+        _write(source, "data", os.urandom(100000))
+
+        codecs = ["gz", "xz"]
+        if shutil.which("zstd") is not None:
+            codecs.append("zst")
+        for codec in codecs:
+            tarball = os.path.join(directory, f"foo.orig.tar.{codec}")
+            compression = launchpadtools.tarball.Compression(codec, threads=2)
+            launchpadtools.tarball.create_tarball(
+                source, tarball, "foo-1.0", compression=compression
+            )
+            if codec == "zst":
+                tar = subprocess.run(
+                    ["zstd", "-dc", tarball], stdout=subprocess.PIPE, check=True
+                ).stdout
+                assert tar.startswith(b"foo-1.0/")
+            else:
+                with tarfile.open(tarball) as tar:
+                    assert "foo-1.0/src/main.c" in tar.getnames()
+
+        # Slow uploads favor small tarballs, fast ones quick compression.
+        candidates = [("gz", 1), ("xz", 9)]
+        best, estimates = launchpadtools.tarball.autotune(
+            source, 1.0, candidates=candidates
+        )
+        assert (best.codec, best.level) == ("xz", 9)
+        assert len(estimates) == 2
+        best, _ = launchpadtools.tarball.autotune(source, 1.0e15, candidates=candidates)
+        assert (best.codec, best.level) == ("gz", 1)
+
+        with pytest.raises(launchpadtools.tarball.CompressionError):
+            launchpadtools.tarball.Compression("bz2")
+    return
+
+
+def test_components():
+    with tempfile.TemporaryDirectory() as directory:
+        source = os.path.join(directory, "source")
+        _write(source, "src/main.c", b"int main() { return 0; }\n")
+        _write(source, "docs/index.txt", b"Docs\n")
+        _write(source, "debian/changelog", b"foo (1.0-1) xenial; urgency=medium\n")
+        cache_dir = os.path.join(directory, "cache")
+
+        def create(version):
+            work_dir = os.path.join(directory, version)
+            os.makedirs(work_dir)
+            return launchpadtools.submit._create_orig_tarballs(
+                source,
+                source,
+                work_dir,
+                "foo",
+                version,
+                cache_dir,
+                True,
+                components=["docs"],
+            )
+
+        orig, docs = create("1.0")
+        assert os.path.basename(orig) == "foo_1.0.orig.tar.gz"
+        assert os.path.basename(docs) == "foo_1.0.orig-docs.tar.gz"
+        with tarfile.open(orig) as tar:
+            assert tar.getnames() == ["foo-1.0", "foo-1.0/src", "foo-1.0/src/main.c"]
+        with tarfile.open(docs) as tar:
+            assert tar.getnames() == ["docs", "docs/index.txt"]
+
+        # An unchanged component is taken from the store for a new version.
+        _write(source, "src/main.c", b"int main() { return 1; }\n")
+        orig2, docs2 = create("1.1")
+        assert os.path.samefile(docs, docs2)
+        assert not os.path.samefile(orig, orig2)
+
+        with pytest.raises(launchpadtools.submit.ComponentError):
+            launchpadtools.submit._check_components(source, ["src", "nope"])
+    return
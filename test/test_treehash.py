@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+#
+import os
+import subprocess
+import tempfile
+
+import launchpadtools
+
+
+def _write(directory, relpath, content, mode=0o644):
+    path = os.path.join(directory, relpath)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(content)
+    os.chmod(path, mode)
+
+
+def _create_tree(directory):
+    _write(directory, "README", b"readme\n")
+    _write(directory, "a.b", b"sorts before a/\n")
+    _write(directory, "a/x", b"x\n")
+    _write(directory, "a-b/y", b"y\n")
+    _write(directory, "bin/run.sh", b"#!/bin/sh\n", mode=0o755)
+    _write(directory, "big", os.urandom(3 * 1024 * 1024 + 17))
+    _write(directory, "build/out.o", b"ignored\n")
+    _write(directory, "src/keep.log", b"re-included\n")
+    _write(directory, "src/drop.log", b"ignored\n")
+    _write(directory, "src/deep/nested/file.c", b"int main;\n")
+    _write(directory, ".gitignore", b"build/\n*.log\n!keep.log\n")
+    _write(directory, "src/deep/.gitignore", b"/nested/*.c\n")
+    _write(directory, "debian/changelog", b"foo (1.0-1) xenial; urgency=medium\n")
+    os.makedirs(os.path.join(directory, "empty", "dir"))
+    os.symlink("README", os.path.join(directory, "link"))
+
+
+def _git_tree_hash(directory):
+    env = dict(
+        os.environ,
+        GIT_CONFIG_NOSYSTEM="1",
+        GIT_CONFIG_GLOBAL=os.devnull,
+        HOME=directory,
+    )
+    subprocess.check_call(["git", "init", "-q"], cwd=directory, env=env)
+    subprocess.check_call(["git", "add", "-A"], cwd=directory, env=env)
+    out = subprocess.check_output(["git", "write-tree"], cwd=directory, env=env)
+    return out.decode("utf-8").strip()
+
+
+def test_tree_hash():
+    with tempfile.TemporaryDirectory() as directory:
+        _create_tree(directory)
+        tree_hash = launchpadtools.treehash.get_tree_hash(directory)
+        assert tree_hash == _git_tree_hash(directory)
+    return
+
+
+def test_empty():
+    with tempfile.TemporaryDirectory() as directory:
+        tree_hash = launchpadtools.treehash.get_tree_hash(directory)
+        assert tree_hash == "4b825dc642cb6eb9a060e54bf8d69288fbee4904"
+    return
+
+
+def test_cache(monkeypatch):
+    with tempfile.TemporaryDirectory() as directory:
+        source = os.path.join(directory, "source")
+        os.mkdir(source)
+        _create_tree(source)
+        # Fresh files are never cached, so backdate them.
+        for root, _, files in os.walk(source):
+            for name in files:
+                os.utime(os.path.join(root, name), (1e9, 1e9), follow_symlinks=False)
+
+        hashed = []
+        hash_file = launchpadtools.treehash.hash_file
+
+        def counting_hash_file(path, size=None):
+            hashed.append(path)
+            return hash_file(path, size)
+
+        monkeypatch.setattr(launchpadtools.treehash, "hash_file", counting_hash_file)
+
+        cache_dir = os.path.join(directory, "cache")
+        tree_hash = launchpadtools.treehash.get_tree_hash(source)
+        with launchpadtools.cache.HashCache(cache_dir) as cache:
+            assert (
+                launchpadtools.treehash.get_tree_hash(source, cache=cache) == tree_hash
+            )
+        assert hashed
+
+        hashed.clear()
+        with launchpadtools.cache.HashCache(cache_dir) as cache:
+            assert (
+                launchpadtools.treehash.get_tree_hash(source, cache=cache) == tree_hash
+            )
+        assert not hashed
+
+        _write(source, "a/x", b"changed\n")
+        with launchpadtools.cache.HashCache(cache_dir) as cache:
+            tree_hash = launchpadtools.treehash.get_tree_hash(source, cache=cache)
+        assert hashed == [os.path.join(source, "a", "x")]
+        assert tree_hash == _git_tree_hash(source)
+    return
+
+
+def test_cache_variants(monkeypatch):
+    with tempfile.TemporaryDirectory() as directory:
+        source = os.path.join(directory, "source")
+        os.mkdir(source)
+        _create_tree(source)
+        for root, _, files in os.walk(source):
+            for name in files:
+                os.utime(os.path.join(root, name), (1e9, 1e9), follow_symlinks=False)
+
+        cache_dir = os.path.join(directory, "cache")
+        variants = [{}, {"honor_gitignore": False, "excludes": {"debian"}}]
+        tree_hashes = []
+        for kwargs in variants:
+            with launchpadtools.cache.HashCache(cache_dir) as cache:
+                tree_hashes.append(
+                    launchpadtools.treehash.get_tree_hash(source, cache=cache, **kwargs)
+                )
+        assert tree_hashes[0] != tree_hashes[1]
+
+        hashed = []
+        hash_tree = launchpadtools.treehash.hash_tree
+
+        def counting_hash_tree(entries):
+            hashed.append(entries)
+            return hash_tree(entries)
+
+        monkeypatch.setattr(launchpadtools.treehash, "hash_tree", counting_hash_tree)
+        # Both variants are taken from the cache, not one at the cost of the other.
+        for kwargs, tree_hash in zip(variants, tree_hashes):
+            with launchpadtools.cache.HashCache(cache_dir) as cache:
+                assert (
+                    launchpadtools.treehash.get_tree_hash(source, cache=cache, **kwargs)
+                    == tree_hash
+                )
+        assert not hashed
+    return
+
+
+def test_excludes():
+    with tempfile.TemporaryDirectory() as directory:
+        _create_tree(directory)
+        _write(directory, ".launchpadignore", b"/a/\nbin/*.sh\n*.log\n")
+        matcher = launchpadtools.ignore.read_excludes(directory, ["big", "!keep.log"])
+        assert matcher.patterns == ["/a", "bin/*.sh", "*.log", "big", "!keep.log"]
+        assert matcher.match("a", True)
+        assert not matcher.match("a", False)
+        assert not matcher.match("src/a", True)
+        assert matcher.match("src/drop.log", False)
+        assert not matcher.match("src/keep.log", False)
+        assert not launchpadtools.ignore.Matcher()
+
+        tree_hash = launchpadtools.treehash.get_tree_hash(directory, matcher=matcher)
+        # Excluded paths are as good as absent.
+        for relpath in ["a/x", "bin/run.sh", "big"]:
+            os.remove(os.path.join(directory, relpath))
+        assert tree_hash == _git_tree_hash(directory)
+    return
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+#
+import os
+import tempfile
+
+import launchpadtools
+
+
+class _RemoteFile:
+    def __init__(self, server, client, path, mode):
+        self.server = server
+        self.client = client
+        self.handle = open(path, mode)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.handle.close()
+
+    def set_pipelined(self, pipelined):
+        pass
+
+    def write(self, data):
+        self.handle.write(data)
+        self.server.received += len(data)
+        if (
+            self.server.drop_after is not None
+            and self.server.received >= self.server.drop_after
+        ):
+            # connection lost after this write
+            self.server.drop_after = None
+            self.client.active = False
+            raise EOFError()
+
+
+class _SFTP:
+    def __init__(self, server, client):
+        self.server = server
+        self.client = client
+
+    def _get_path(self, path):
+        return os.path.join(self.server.root, path)
+
+    def stat(self, path):
+        assert self.client.active
+        return os.stat(self._get_path(path))
+
+    def open(self, path, mode):
+        assert self.client.active
+        path = self._get_path(path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return _RemoteFile(self.server, self.client, path, mode)
+
+    def close(self):
+        pass
+
+
+class _Client:
+    def __init__(self, server):
+        self.server = server
+        self.active = True
+
+    def open_sftp(self):
+        if not self.active:
+            raise EOFError()
+        return _SFTP(self.server, self)
+
+    def get_transport(self):
+        return self
+
+    def is_active(self):
+        return self.active
+
+    def close(self):
+        self.active = False
+
+
+class _Server:
+    """Local stand-in for an SFTP server, serving `root`."""
+
+    def __init__(self, root, drop_after=None):
+        self.root = root
+        self.drop_after = drop_after
+        self.received = 0
+        self.connections = 0
+
+    def connect(self, host, port, username):
+        self.connections += 1
+        return _Client(self)
+
+
+def _create_upload(directory):
+    files = {
+        "foo_1.0.orig.tar.gz": os.urandom(1000000),
+        "foo_1.0-1xenial1.debian.tar.xz": os.urandom(1000),
+        "foo_1.0-1xenial1.dsc": b"Format: 3.0 (quilt)\n",
+    }
+    for filename, content in files.items():
+        with open(os.path.join(directory, filename), "wb") as f:
+            f.write(content)
+    changes_file = os.path.join(directory, "foo_1.0-1xenial1_source.changes")
+    with open(changes_file, "w") as f:
+        f.write("Source: foo\nFiles:\n")
+        for filename, content in files.items():
+            f.write(f" abcd {len(content)} devel optional {filename}\n")
+    return changes_file
+
+
+def _check_remote(local_dir, remote_dir):
+    for filename in os.listdir(local_dir):
+        with open(os.path.join(local_dir, filename), "rb") as f:
+            local = f.read()
+        with open(os.path.join(remote_dir, filename), "rb") as f:
+            assert f.read() == local, filename
+
+
+def test_upload():
+    with tempfile.TemporaryDirectory() as directory:
+        local_dir = os.path.join(directory, "local")
+        os.makedirs(local_dir)
+        changes_file = _create_upload(local_dir)
+        size = sum(
+            os.path.getsize(os.path.join(local_dir, f)) for f in os.listdir(local_dir)
+        )
+
+        server = _Server(os.path.join(directory, "remote"))
+        with launchpadtools.upload.Uploader(
+            "john", client_factory=server.connect
+        ) as uploader:
+            assert uploader.upload("john/nightly", changes_file) == size
+            # everything's there already
+            assert uploader.upload("john/nightly", changes_file) == 0
+        assert server.connections == 1
+        _check_remote(local_dir, os.path.join(server.root, "~john/nightly/ubuntu"))
+    return
+
+
+def test_upload_resume():
+    with tempfile.TemporaryDirectory() as directory:
+        local_dir = os.path.join(directory, "local")
+        os.makedirs(local_dir)
+        changes_file = _create_upload(local_dir)
+        size = sum(
+            os.path.getsize(os.path.join(local_dir, f)) for f in os.listdir(local_dir)
+        )
+
+        server = _Server(os.path.join(directory, "remote"), drop_after=300000)
+        with launchpadtools.upload.Uploader(
+            "john", max_workers=1, backoff=0.0, client_factory=server.connect
+        ) as uploader:
+            assert uploader.upload("john/nightly", changes_file) < size
+        # reconnected, and nothing was sent twice
+        assert server.connections == 2
+        assert server.received == size
+        _check_remote(local_dir, os.path.join(server.root, "~john/nightly/ubuntu"))
+    return
+
+
+def test_upload_stale():
+    with tempfile.TemporaryDirectory() as directory:
+        local_dir = os.path.join(directory, "local")
+        os.makedirs(local_dir)
+        changes_file = _create_upload(local_dir)
+
+        # Left over from another run: a file of the same size and a shorter one,
+        # neither of which has the content of the local file
+        server = _Server(os.path.join(directory, "remote"))
+        remote_dir = os.path.join(server.root, "~john/nightly/ubuntu")
+        os.makedirs(remote_dir)
+        for filename, size in [
+            ("foo_1.0.orig.tar.gz", 1000000),
+            ("foo_1.0-1xenial1.debian.tar.xz", 500),
+        ]:
+            with open(os.path.join(remote_dir, filename), "wb") as f:
+                f.write(os.urandom(size))
+
+        with launchpadtools.upload.Uploader(
+            "john", client_factory=server.connect
+        ) as uploader:
+            uploader.upload("john/nightly", changes_file)
+        _check_remote(local_dir, remote_dir)
+    return
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+#
+import http.server
+import json
+import threading
+import urllib.parse
+
+import launchpadtools
+
+
+class _FakeLaunchpad(http.server.BaseHTTPRequestHandler):
+    """Serves the parts of the Launchpad web service the watcher needs. Uploads show
+    up as publications after a number of polls, and their builds step through
+    `summaries`, one state per poll.
+    """
+
+    # source id -> (PPA, name, version, series, polls until accepted, summaries)
+    sources = {
+        1: (
+            "john/nightly",
+            "foo",
+            "1:1.0-1xenial1",
+            "xenial",
+            2,
+            ["NEEDSBUILD"] * 2 + ["BUILDING", "FULLYBUILT"],
+        ),
+        2: (
+            "john/nightly",
+            "foo",
+            "1:1.0-1bionic1",
+            "bionic",
+            0,
+            ["BUILDING"] * 4 + ["FAILEDTOBUILD"],
+        ),
+        3: ("john/nightly", "foo", "0.9-1xenial1", "xenial", 0, ["FULLYBUILT"]),
+    }
+    builds = {
+        1: [("amd64", "Successfully built")],
+        2: [("amd64", "Failed to build"), ("arm64", "Successfully built")],
+    }
+    requests = []
+    not_modified = []
+    polls = {}
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, data):
+        body = json.dumps(data).encode("utf-8")
+        etag = '"{}"'.format(hash(body))
+        if self.headers.get("If-None-Match") == etag:
+            self.not_modified.append(self.path)
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _poll(self, key):
+        self.polls[key] = self.polls.get(key, 0) + 1
+        return self.polls[key]
+
+    def do_GET(self):
+        self.requests.append(self.path)
+        root = f"http://localhost:{self.server.server_port}/1.0"
+        url = urllib.parse.urlparse(self.path)
+        query = urllib.parse.parse_qs(url.query)
+        op = query["ws.op"][0]
+
+        if op == "getBuilds":
+            k = int(url.path.split("/")[-1])
+            self._send(
+                {
+                    "entries": [
+                        {
+                            "arch_tag": arch,
+                            "buildstate": state,
+                            "web_link": f"https://launchpad.net/builds/{k}-{arch}",
+                            "build_log_url": f"https://launchpad.net/logs/{k}-{arch}",
+                        }
+                        for arch, state in self.builds[k]
+                    ]
+                }
+            )
+            return
+
+        owner, _, _, ppa_name = url.path[len("/1.0/~") :].split("/")
+        ppa = f"{owner}/{ppa_name}"
+        if op == "getPublishedSources":
+            polls = self._poll((ppa, query["source_name"][0]))
+            entries = [
+                {
+                    "source_package_version": version,
+                    "distro_series_link": f"{root}/ubuntu/{series}",
+                    "self_link": f"{root}/~{ppa}/+sourcepub/{k}",
+                    "web_link": f"https://launchpad.net/~{ppa}/+sourcepub/{k}",
+                }
+                for k, (p, name, version, series, after, _) in self.sources.items()
+                if p == ppa and name == query["source_name"][0] and polls > after
+            ]
+            self._send({"entries": entries[::-1]})
+            return
+
+        assert op == "getBuildSummariesForSourceIds"
+        summaries = {}
+        for k in query["source_ids"]:
+            states = self.sources[int(k)][5]
+            summaries[k] = {"status": states[min(self._poll(k), len(states)) - 1]}
+        self._send(summaries)
+
+
+def test_watch():
+    server = http.server.ThreadingHTTPServer(("localhost", 0), _FakeLaunchpad)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    api_root = f"http://localhost:{server.server_port}/1.0"
+    uploads = [
+        {"ppa": "john/nightly", "name": "foo", "version": v, "series": s}
+        for v, s in [("1.0-1xenial1", "xenial"), ("1.0-1bionic1", "bionic")]
+    ]
+    # never accepted
+    uploads.append(
+        {"ppa": "jane/stable", "name": "bar", "version": "2.0-1", "series": "focal"}
+    )
+    try:
+        outcomes = launchpadtools.watch.wait(
+            uploads,
+            api_root=api_root,
+            min_interval=0.01,
+            max_interval=0.05,
+            accept_timeout=0.5,
+            timeout=10,
+        )
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+    assert [o["status"] for o in outcomes] == ["built", "failed", "not accepted"]
+    assert outcomes[0]["web_link"] == "https://launchpad.net/~john/nightly/+sourcepub/1"
+    assert outcomes[1]["builds"][0] == {
+        "arch": "amd64",
+        "state": "Failed to build",
+        "web_link": "https://launchpad.net/builds/2-amd64",
+        "log_url": "https://launchpad.net/logs/2-amd64",
+    }
+    error = launchpadtools.watch.BuildError(outcomes[1])
+    assert str(error) == "failed to build on amd64"
+    assert launchpadtools.watch.has_failures(outcomes)
+
+    requests = _FakeLaunchpad.requests
+    summaries = [r for r in requests if "getBuildSummariesForSourceIds" in r]
+    # one request for both sources of the PPA
+    assert any("source_ids=1&source_ids=2" in r for r in summaries)
+    # the publications of foo are not asked for once both are found
+    foo = [r for r in requests if "source_name=foo" in r]
+    assert len(foo) == 3
+    # unchanged answers are revalidated
+    assert _FakeLaunchpad.not_modified
+    return
+
+
+def test_journal():
+    journal = launchpadtools.cache.UploadJournal(persistent=False)
+    upload = {
+        "ppa": "john/nightly",
+        "name": "foo",
+        "version": "1.0-1",
+        "series": "focal",
+    }
+    journal.put_upload(upload)
+    journal.put_upload(upload)
+    assert journal.get_uploads() == [upload]
+    assert journal.get_uploads("jane/stable") == []
+    journal.discard_uploads([dict(upload, status="built")])
+    assert journal.get_uploads() == []
+    return